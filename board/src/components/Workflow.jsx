@@ -284,7 +284,7 @@ function Workflow({config, history}) {
     if (!status) return;
     console.log('Getting workflow ', workflowID);
     const userID = getUserID();
-    getWorkflow(workflowID)
+    getWorkflow(workflowID, userID)
       .then(w => {
         const to_dos = Object.values(w)
           .map(withIndex)
@@ -145,7 +145,49 @@ export const getFromStorage = (collection, name) =>
     .then(url => fetch(url))
     .then(response => response.json());
 
-export const getWorkflow = name => getFromStorage('workflow', name.trim());
+// FNV-1a hash of a user ID, as user_shard in util/workflow_shards.py.
+const userHash = userID => {
+  let hash = 0x811c9dc5;
+  for (let i = 0; i < userID.length; i++)
+    hash = Math.imul(hash ^ userID.charCodeAt(i), 0x01000193) >>> 0;
+  return hash;
+};
+
+// SHA-256 of the salt and user ID in hex, as hidden_name in
+// util/workflow_shards.py.
+const hiddenName = (salt, userID) =>
+  crypto.subtle
+    .digest('SHA-256', new TextEncoder().encode(salt + userID))
+    .then(digest =>
+      Array.from(new Uint8Array(digest), byte =>
+        byte.toString(16).padStart(2, '0')
+      ).join('')
+    );
+
+// Tasks of the user's shard, without the ones hidden for the user. Users
+// without hidden tasks have no object of them. Workflows uploaded as a single
+// file have no manifest.
+export const getWorkflow = (name, userID = '') => {
+  const directory = `workflow/${name.trim()}`;
+  return getFromStorage(directory, 'manifest')
+    .then(manifest =>
+      Promise.all([
+        getFromStorage(directory, userHash(userID) % manifest.shards),
+        hiddenName(manifest.salt, userID).then(hash =>
+          getFromStorage(`${directory}/hidden`, hash).catch(e => [])
+        ),
+      ])
+    )
+    .then(([{tasks}, hidden]) => {
+      const skip = new Set(hidden);
+      const result = {};
+      Object.keys(tasks)
+        .filter(key => !skip.has(key))
+        .forEach(key => (result[key] = tasks[key]));
+      return result;
+    })
+    .catch(e => getFromStorage('workflow', name.trim()));
+};
 
 export const useDB = (collection, doc) =>
   useDocumentData(db.collection(collection).doc(doc));
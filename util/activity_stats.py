@@ -0,0 +1,250 @@
+# coding=utf-8
+# Copyright 2019 Google LLC.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# Lint as: python3
+
+# Activity statistics of the game: correct votes, incorrect votes and writes
+# per hour, day or ISO week, and per player, category or page. Votes and
+# writes are loaded as columns and aggregated with NumPy.
+
+import datetime
+import numpy as np
+
+from typing import Text, Dict, List, Iterable, Any, Optional, Tuple
+
+try:
+    import zoneinfo
+except ImportError:
+    zoneinfo = None
+
+kGRANULARITIES = ["hour", "day", "week"]
+kDIMENSIONS = ["author", "category", "page"]
+kATTRS = ["vote_correct", "vote_incorrect", "write"]
+kEPOCH = datetime.date(1970, 1, 1)
+
+
+def _codes(values: Iterable[Any]) -> Tuple[List[Any], np.ndarray]:
+    """Sorted distinct values and the index of each value among them."""
+    index = {}
+    codes = np.fromiter(
+        (index.setdefault("" if x is None else x, len(index))
+         for x in values), dtype=np.int64)
+    names = sorted(index)
+    rank = np.empty(len(names), dtype=np.int64)
+    rank[[index[x] for x in names]] = np.arange(len(names))
+    return names, rank[codes]
+
+
+class Activity(object):
+    """Votes and writes, one array per column.
+
+    `time` is UTC in seconds, `write` tells writes from votes and `correct`
+    is 1 for votes that got points, 0 for those that did not and -1 when
+    unknown. Players, pages and categories are `codes` into sorted `names`,
+    where "" is a missing name.
+    """
+
+    def __init__(self, rows: Iterable[Tuple], missing_category: Text = ""):
+        rows = list(rows)
+        columns = list(zip(*rows)) or [[]] * 6
+        self.time = np.array(columns[0], dtype=np.int64)
+        self.write = np.array(columns[2], dtype=bool)
+        self.correct = np.array(columns[3], dtype=np.int8)
+        self.names = {}
+        self.codes = {}
+        for dimension, values in [
+                ("author", columns[1]),
+                ("page", columns[4]),
+                ("category", [x or missing_category for x in columns[5]])]:
+            self.names[dimension], self.codes[dimension] = _codes(values)
+
+    def __len__(self) -> int:
+        return len(self.time)
+
+    def counts(self) -> Dict[Text, np.ndarray]:
+        return {
+            "vote_correct": ~self.write & (self.correct == 1),
+            "vote_incorrect": ~self.write & (self.correct == 0),
+            "write": self.write,
+        }
+
+
+def zone_name(time_offset: int, timezone: Optional[Text] = None) -> Text:
+    return timezone or f"{time_offset:+d}h"
+
+
+def local_time(
+    time: np.ndarray,
+    time_offset: int = 0,
+    timezone: Optional[Text] = None,
+) -> np.ndarray:
+    """Local time in seconds, in a fixed offset or an IANA time zone.
+
+    Time zone offsets are looked up once per distinct UTC hour.
+    """
+    if not timezone:
+        return time + time_offset * 3600
+    if zoneinfo is None:
+        raise ValueError("Time zones need Python 3.9 or later")
+    zone = zoneinfo.ZoneInfo(timezone)
+    hours, index = np.unique(time // 3600, return_inverse=True)
+    offsets = np.array([
+        datetime.datetime.fromtimestamp(
+            int(x) * 3600, datetime.timezone.utc).astimezone(zone)
+        .utcoffset().total_seconds()
+        for x in hours], dtype=np.int64)
+    return time + offsets[index]
+
+
+def buckets(local: np.ndarray, granularity: Text) -> np.ndarray:
+    """Ordered bucket number of each local time.
+
+    Hours and days are counted from the epoch, weeks by the day of their
+    Monday.
+    """
+    if granularity == "hour":
+        return local // 3600
+    days = local // 86400
+    if granularity == "day":
+        return days
+    if granularity == "week":
+        # The epoch was a Thursday.
+        return days - (days + 3) % 7
+    raise ValueError(f"Unknown granularity {granularity}")
+
+
+def bucket_start(bucket: int, granularity: Text) -> int:
+    """Local time in seconds when a bucket starts."""
+    return bucket * (3600 if granularity == "hour" else 86400)
+
+
+def bucket_label(bucket: int, granularity: Text) -> Text:
+    """Name of a bucket, in an order that sorts like the buckets."""
+    if granularity == "hour":
+        day, hour = divmod(int(bucket), 24)
+        return f"{kEPOCH + datetime.timedelta(days=day)} {hour:02d}:00"
+    day = kEPOCH + datetime.timedelta(days=int(bucket))
+    if granularity == "week":
+        year, week, _ = day.isocalendar()
+        return f"{year}-W{week:02d}"
+    return str(day)
+
+
+def aggregate(
+    activity: Activity,
+    bucket: np.ndarray,
+    granularity: Text,
+    dimension: Text,
+    mask: Optional[np.ndarray] = None,
+) -> List[Tuple[Text, Text, int, int, int]]:
+    """Counts per bucket and player, category or page, sorted by both.
+
+    Activity of players without a name is not counted per player.
+    """
+    names = activity.names[dimension]
+    codes = activity.codes[dimension]
+    keep = np.ones(len(activity), dtype=bool) if mask is None else mask
+    if dimension == "author" and names and names[0] == "":
+        keep = keep & (codes != 0)
+    if not keep.any():
+        return []
+
+    # One sortable key per bucket and name.
+    first = bucket[keep].min()
+    keys = (bucket[keep] - first) * len(names) + codes[keep]
+    groups, index = np.unique(keys, return_inverse=True)
+    totals = np.stack([
+        np.bincount(index, weights=x[keep], minlength=len(groups))
+        for x in activity.counts().values()], axis=1).astype(np.int64)
+    group_buckets, group_names = np.divmod(groups, len(names))
+    labels = {
+        x: bucket_label(first + x, granularity)
+        for x in np.unique(group_buckets).tolist()}
+    return [
+        (labels[x], names[y], *counts)
+        for x, y, counts in zip(
+            group_buckets.tolist(), group_names.tolist(), totals.tolist())]
+
+
+def stats_watermark(zone: Text, granularity: Text, dimension: Text) -> Text:
+    """Name of the time up to which the statistics are synced."""
+    return f"stats/{zone}/{granularity}/{dimension}"
+
+
+def update_stats(
+    store: Any,
+    time_offset: int = 0,
+    timezone: Optional[Text] = None,
+    granularities: Iterable[Text] = ("day",),
+    dimensions: Iterable[Text] = ("author",),
+    missing_category: Text = "",
+    incremental: bool = False,
+    overlap: datetime.timedelta = datetime.timedelta(0),
+):
+    """Aggregates the activity in the store into its stats table.
+
+    In incremental mode only buckets that may have changed since the last
+    update of the same zone, granularity and dimension, `overlap` before it,
+    are computed again. Combinations without statistics yet are computed in
+    full.
+    """
+    zone = zone_name(time_offset, timezone)
+    granularities = [x for x in kGRANULARITIES if x in granularities]
+    dimensions = list(dimensions)
+    since = {}
+    for granularity in granularities:
+        for dimension in dimensions:
+            synced = store.synced(
+                stats_watermark(zone, granularity, dimension))
+            if (incremental and synced and
+                    store.has_stats(zone, granularity, dimension)):
+                local_since = local_time(
+                    np.array([int((synced - overlap).timestamp())]),
+                    time_offset, timezone)
+                since[granularity, dimension] = int(
+                    buckets(local_since, granularity)[0])
+            else:
+                since[granularity, dimension] = None
+
+    if since and None not in since.values():
+        # Rows from the start of the earliest bucket on, with a day to spare
+        # since local and UTC times differ by less than that.
+        start = min(bucket_start(y, x[0]) for x, y in since.items())
+        load_since = datetime.datetime.fromtimestamp(
+            start - 86400, datetime.timezone.utc)
+        activity = Activity(store.activity(load_since), missing_category)
+    else:
+        activity = Activity(store.activity(), missing_category)
+
+    local = local_time(activity.time, time_offset, timezone)
+    latest = None
+    if len(activity):
+        latest = datetime.datetime.fromtimestamp(
+            int(activity.time.max()), datetime.timezone.utc)
+    for granularity in granularities:
+        bucket = buckets(local, granularity)
+        for dimension in dimensions:
+            first = since[granularity, dimension]
+            mask = None
+            if first is not None:
+                mask = bucket >= first
+                first = bucket_label(first, granularity)
+            store.put_stats(
+                zone, granularity, dimension,
+                aggregate(activity, bucket, granularity, dimension, mask),
+                since=first)
+            if latest is not None:
+                name = stats_watermark(zone, granularity, dimension)
+                previous = store.synced(name)
+                store.set_synced(name, max(latest, previous or latest))
@@ -0,0 +1,89 @@
+# coding=utf-8
+# Copyright 2019 Google LLC.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# Lint as: python3
+
+# Concurrent reads of Firestore queries with the asyncio client, so reading
+# several collections takes about as long as reading the largest one. At
+# most a given number of queries stream at once, and a query that fails with
+# a transient error is read again from the start after a backoff.
+
+import asyncio
+import random
+
+from typing import Text, Mapping, Dict, List, Any, Tuple, Type
+
+import instrumentation
+
+
+def retry_errors() -> Tuple[Type[Exception], ...]:
+    """Errors after which a query can be read again.
+
+    The Google Cloud libraries are only imported when a query is read, like
+    in fibs_firebase_config.
+    """
+    from google.api_core import exceptions
+    return (
+        exceptions.Aborted,
+        exceptions.DeadlineExceeded,
+        exceptions.InternalServerError,
+        exceptions.ResourceExhausted,
+        exceptions.ServiceUnavailable,
+    )
+
+
+def backoff(attempt: int) -> float:
+    """Seconds to wait after a failed attempt, with jitter."""
+    return min(2 ** attempt, 30) * (1 + random.random()) / 2
+
+
+async def read_query(
+    query: Any,
+    semaphore: asyncio.Semaphore,
+    retries: int,
+) -> List[Any]:
+    """Snapshots of all documents of an AsyncQuery."""
+    retry = retry_errors()
+    for attempt in range(retries + 1):
+        try:
+            async with semaphore:
+                return [x async for x in query.stream()]
+        except retry:
+            instrumentation.count("firestore_retries")
+            if attempt == retries:
+                raise
+        await asyncio.sleep(backoff(attempt))
+
+
+async def _read_queries(
+    queries: Mapping[Text, Any],
+    workers: int,
+    retries: int,
+) -> Dict[Text, List[Any]]:
+    semaphore = asyncio.Semaphore(workers)
+    results = await asyncio.gather(
+        *[read_query(x, semaphore, retries) for x in queries.values()])
+    return dict(zip(queries, results))
+
+
+def read_queries(
+    queries: Mapping[Text, Any],
+    workers: int = 8,
+    retries: int = 5,
+) -> Dict[Text, List[Any]]:
+    """Reads the queries concurrently, returns the snapshots of each one.
+
+    At most `workers` queries are read at once.
+    """
+    return asyncio.run(_read_queries(queries, workers, retries))
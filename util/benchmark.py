@@ -0,0 +1,288 @@
+# coding=utf-8
+# Copyright 2019 Google LLC.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# Lint as: python3
+
+# Benchmarks of the workflow builder and of page ingestion on synthetic data,
+# against an in-memory Firestore, or the Firestore emulator, and a bucket in
+# a local directory. Results, with the commit they were measured at, are
+# appended to --benchmark_output so runs of different commits compare.
+
+import gc
+import json
+import os
+import random
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from typing import Text, Dict, Any, Callable, Tuple
+
+from absl import app
+from absl import flags
+
+import create_workflow
+import download_wiki
+import fibs_firebase_config
+import fm2_dataset
+import instrumentation
+import local_backends
+import page_manifest
+import synthetic_data
+import workflow_store
+
+FLAGS = flags.FLAGS
+flags.DEFINE_float("scale", 1.0,
+                   "Size of the synthetic data, 1 is 1000 claims, 100 "
+                   "players and the pages of categories/")
+flags.DEFINE_integer("seed", 0, "Seed of the synthetic data")
+flags.DEFINE_list("benchmarks", None,
+                  "Benchmarks to run, all of them by default")
+flags.DEFINE_integer("repeats", 3, "Timed runs of each benchmark",
+                     lower_bound=1)
+flags.DEFINE_integer("process_pages", 20,
+                     "Pages ingested by the process_page benchmark")
+flags.DEFINE_string("benchmark_emulator", None,
+                    "Host and port of a Firestore emulator to run against, "
+                    "instead of an in-memory Firestore")
+flags.DEFINE_string("benchmark_output",
+                    os.path.join("logs", "benchmarks.jsonl"),
+                    "File the results are appended to")
+
+
+class Context(object):
+    """Synthetic data loaded in the stand-ins, shared by the benchmarks."""
+
+    def __init__(self, data: synthetic_data.SyntheticData, db: Any):
+        self.data = data
+        self.db = db
+        self.flip_categories = {
+            page: category for category, page in data.pages()}
+        self.claims = None
+        self.votes = None
+
+    def read_claims(self) -> Dict[Text, Any]:
+        if self.claims is None:
+            self.claims, self.votes = create_workflow.get_claims(
+                self.db, self.flip_categories)
+        return self.claims
+
+    def comparisons(self) -> Dict[Text, Dict[Text, Text]]:
+        """Claims each player compared, both ways, as get_comparisons."""
+        return {
+            user: {
+                x: y for key in status
+                for x, y in [key.split("_"), key.split("_")[::-1]]}
+            for user, status in self.data.status.items()}
+
+
+def get_claims(context: Context) -> Callable[[], Any]:
+    return lambda: create_workflow.get_claims(
+        context.db, context.flip_categories)
+
+
+def read_firestore(context: Context) -> Callable[[], Any]:
+    def run():
+        store = workflow_store.WorkflowStore()
+        store.put_users(create_workflow.get_users(context.db))
+        store.put_comparisons(create_workflow.get_comparisons(context.db))
+        create_workflow.sync_store(context.db, store)
+    return run
+
+
+def read_firestore_async(context: Context) -> Callable[[], Any]:
+    if FLAGS.benchmark_emulator:
+        db = fibs_firebase_config.initialize_async_firebase()
+    else:
+        db = local_backends.AsyncFirestoreClient(context.db)
+    return lambda: create_workflow.read_firestore_async(
+        db, workflow_store.WorkflowStore(), FLAGS.read_workers,
+        FLAGS.read_retries)
+
+
+def page_lengths(context: Context) -> Callable[[], Any]:
+    # Runs in an empty directory, so all pages are read from Firestore.
+    os.makedirs("pages", exist_ok=True)
+    return lambda: create_workflow.page_lengths(
+        context.db, context.data.categories, context.data.priority)
+
+
+def save_workflow(context: Context) -> Callable[[], Any]:
+    claims = context.read_claims()
+    pairs = list(create_workflow.build_pairs(claims))
+    return lambda: create_workflow.save_workflow(
+        context.db, "benchmark", claims, pairs, context.data.categories,
+        context.data.priority, comparisons=context.comparisons(),
+        num_shards=FLAGS.workflow_shards, workers=FLAGS.shard_upload_workers)
+
+
+def save_comparisons(context: Context) -> Callable[[], Any]:
+    claims = context.read_claims()
+    comparisons = context.comparisons()
+    return lambda: create_workflow.save_comparisons(
+        comparisons, claims, context.votes, "benchmark")
+
+
+def process_page(context: Context) -> Callable[[], Any]:
+    os.makedirs("pages", exist_ok=True)
+    nlp = download_wiki.load_nlp(FLAGS.senter)
+    wiki = synthetic_data.SyntheticWiki(context.data)
+    pages = list(context.data.pages())[:FLAGS.process_pages]
+    bucket = fibs_firebase_config.get_bucket()
+
+    def run():
+        manifest = page_manifest.Manifest()
+        for category, page in pages:
+            download_wiki.process_page(
+                nlp, category, wiki, page, bucket, manifest)
+    return run
+
+
+kBENCHMARKS = {
+    "get_claims": get_claims,
+    "read_firestore": read_firestore,
+    "read_firestore_async": read_firestore_async,
+    "page_lengths": page_lengths,
+    "save_workflow": save_workflow,
+    "save_comparisons": save_comparisons,
+    "process_page": process_page,
+}
+
+
+def commit() -> Text:
+    """Commit of the code being measured, with a + if it has changes."""
+    try:
+        head = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+            text=True, check=True).stdout.strip()
+        dirty = subprocess.run(
+            ["git", "status", "--porcelain", "--untracked-files=no"],
+            capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+    return head + ("+" if dirty else "")
+
+
+def measure(
+    context: Context,
+    setup: Callable[[Context], Callable[[], Any]],
+    repeats: int,
+) -> Dict[Text, Any]:
+    """Times runs of a benchmark, each in a fresh working directory.
+
+    A last run under tracemalloc measures the peak of Python allocations,
+    apart from the timed runs since tracing slows them down.
+    """
+    cwd = os.getcwd()
+    seconds = []
+    cpu_seconds = []
+    peak = 0
+    for ii in range(repeats + 1):
+        with tempfile.TemporaryDirectory() as directory:
+            os.chdir(directory)
+            try:
+                random.seed(FLAGS.seed)
+                run = setup(context)
+                gc.collect()
+                if ii == repeats:
+                    tracemalloc.start()
+                    run()
+                    peak = tracemalloc.get_traced_memory()[1]
+                    tracemalloc.stop()
+                    continue
+                instrumentation.reset()
+                start, cpu_start = time.perf_counter(), time.process_time()
+                run()
+                seconds.append(time.perf_counter() - start)
+                cpu_seconds.append(time.process_time() - cpu_start)
+                counters = instrumentation.take()["counters"]
+            finally:
+                os.chdir(cwd)
+    return {
+        "seconds": {
+            "min": round(min(seconds), 4),
+            "median": round(statistics.median(seconds), 4),
+            "max": round(max(seconds), 4)},
+        "cpu_seconds": round(statistics.median(cpu_seconds), 4),
+        "peak_bytes": peak,
+        "counters": counters,
+    }
+
+
+def load_context() -> Tuple[Context, float]:
+    """Generates the data and writes it to Firestore, returns the seconds."""
+    templates = [
+        claim for split in ["dev", "test"]
+        for claim in fm2_dataset.load_split(split, FLAGS.dataset_dir,
+                                            FLAGS.columns_dir)]
+    categories, _ = download_wiki.read_categories()
+    start = time.perf_counter()
+    data = synthetic_data.SyntheticData(
+        templates, categories, FLAGS.scale, FLAGS.seed)
+    if FLAGS.benchmark_emulator:
+        os.environ["FIRESTORE_EMULATOR_HOST"] = FLAGS.benchmark_emulator
+        db = fibs_firebase_config.initialize_firebase()
+    else:
+        db = local_backends.FirestoreClient()
+    data.write(db)
+    return Context(data, db), time.perf_counter() - start
+
+
+def main(argv):
+    names = FLAGS.benchmarks or list(kBENCHMARKS)
+    for name in names:
+        if name not in kBENCHMARKS:
+            raise app.UsageError(f"Unknown benchmark {name}")
+    context, load_seconds = load_context()
+    print(
+        f"Generated {len(context.data.claims)} claims, "
+        f"{len(context.data.votes)} votes and {len(context.data.likes)} "
+        f"likes in {load_seconds:.1f}s")
+
+    with tempfile.TemporaryDirectory() as bucket_directory:
+        fibs_firebase_config.use_clients(
+            firestore=context.db,
+            bucket=local_backends.LocalBucket(bucket_directory))
+        results = []
+        for name in names:
+            result = {
+                "benchmark": name,
+                "commit": commit(),
+                "scale": FLAGS.scale,
+                "seed": FLAGS.seed,
+                "repeats": FLAGS.repeats,
+                "firestore": (
+                    "emulator" if FLAGS.benchmark_emulator else "memory"),
+                "python": sys.version.split()[0],
+                **measure(context, kBENCHMARKS[name], FLAGS.repeats),
+                "max_rss_kb": resource.getrusage(
+                    resource.RUSAGE_SELF).ru_maxrss,
+            }
+            print(
+                f"{name}: {result['seconds']['median']:.3f}s median, "
+                f"{result['peak_bytes'] / 2**20:.1f} MiB peak")
+            results.append(result)
+
+    os.makedirs(os.path.dirname(FLAGS.benchmark_output) or ".", exist_ok=True)
+    with open(FLAGS.benchmark_output, "a") as outfile:
+        for result in results:
+            outfile.write(json.dumps(result, sort_keys=True) + "\n")
+
+
+if __name__ == "__main__":
+    app.run(main)
@@ -0,0 +1,293 @@
+# coding=utf-8
+# Copyright 2019 Google LLC.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# Lint as: python3
+
+# BM25 retrieval over the sentences of the downloaded pages, to recompute the
+# retrieved_evidence of the dataset. Sentences of a page are scored against
+# that page only, like the lunr index of the page does in the browser.
+# Run to build the index and report recall@k against the gold evidence.
+
+import functools
+import json
+import os
+import re
+import fm2_dataset
+import numpy as np
+import tqdm
+
+from glob import glob
+from scipy import sparse
+from typing import Text, Mapping, Dict, List, Iterable, Any
+
+from absl import app
+from absl import flags
+
+from lunr.stemmer import stemmer
+from lunr.stop_word_filter import WORDS
+from lunr.token import Token
+
+FLAGS = flags.FLAGS
+flags.DEFINE_string("retrieval_index", os.path.join("pages", "bm25"),
+                    "Directory of the BM25 index")
+flags.DEFINE_boolean("rebuild_index", False,
+                     "Build the index even if it exists")
+flags.DEFINE_list("retrieval_splits", ["dev", "test"],
+                  "Dataset splits to compute recall on")
+flags.DEFINE_list("recall_at", ["1", "5", "10"],
+                  "Values of k to report recall@k for")
+flags.DEFINE_float("k1", 1.2, "BM25 term frequency saturation")
+flags.DEFINE_float("b", 0.75, "BM25 document length normalization")
+
+kTOKEN = re.compile(r"\w+")
+kSTOP_WORDS = frozenset(WORDS)
+# Arrays of the index, saved as .npy files so they can be memory-mapped.
+kARRAYS = [
+    "indptr", "indices", "counts", "lengths", "page_offsets",
+    "names", "name_offsets", "lines", "line_offsets"]
+
+
+@functools.lru_cache(maxsize=None)
+def _stem(word: Text) -> Text:
+    return stemmer(Token(word)).string
+
+
+def tokenize(text: Text) -> List[Text]:
+    """Lowercased, stemmed words of a text, without stop words."""
+    return [
+        _stem(word) for word in kTOKEN.findall(text.lower())
+        if word not in kSTOP_WORDS]
+
+
+class Bm25Index(object):
+    """Term counts of every sentence, in CSR format, grouped by page.
+
+    Rows of the sentences of the i-th page go from page_offsets[i] to
+    page_offsets[i + 1].
+    """
+
+    def __init__(
+        self,
+        vocabulary: List[Text],
+        pages: List[Text],
+        arrays: Mapping[Text, np.ndarray],
+    ):
+        self.vocabulary = {term: ii for ii, term in enumerate(vocabulary)}
+        self.pages = {page: ii for ii, page in enumerate(pages)}
+        for name in kARRAYS:
+            setattr(self, name, arrays[name])
+        self.names_column = fm2_dataset.StringColumn(
+            self.names, self.name_offsets)
+        self.lines_column = fm2_dataset.StringColumn(
+            self.lines, self.line_offsets)
+
+    @classmethod
+    def build(cls, filenames: Iterable[Text]) -> "Bm25Index":
+        vocabulary = {}
+        pages = []
+        names = []
+        lines = []
+        indices = []
+        counts = []
+        indptr = [0]
+        page_offsets = [0]
+        for filename in tqdm.tqdm(filenames, desc="index"):
+            with open(filename) as infile:
+                document = json.load(infile)
+            pages.append(document["title"])
+            for sentence in document["sentences"]:
+                text = f"{sentence['name']} {sentence['line']}"
+                terms = [
+                    vocabulary.setdefault(x, len(vocabulary))
+                    for x in tokenize(text)]
+                unique, count = np.unique(terms, return_counts=True)
+                indices.append(unique)
+                counts.append(count)
+                indptr.append(indptr[-1] + len(unique))
+                names.append(sentence["name"])
+                lines.append(sentence["line"])
+            page_offsets.append(len(lines))
+
+        counts = [x.astype(np.int32) for x in counts]
+        arrays = {
+            "indptr": np.array(indptr, dtype=np.int64),
+            "indices": np.concatenate(
+                indices or [[]]).astype(np.int32),
+            "counts": np.concatenate(counts or [[]]).astype(np.int32),
+            "lengths": np.array([x.sum() for x in counts], dtype=np.int32),
+            "page_offsets": np.array(page_offsets, dtype=np.int64),
+        }
+        pack = fm2_dataset.pack_strings
+        arrays["names"], arrays["name_offsets"] = pack(names)
+        arrays["lines"], arrays["line_offsets"] = pack(lines)
+        return cls(sorted(vocabulary, key=vocabulary.get), pages, arrays)
+
+    def save(self, directory: Text):
+        os.makedirs(directory, exist_ok=True)
+        for name in kARRAYS:
+            filename = os.path.join(directory, f"{name}.npy")
+            np.save(filename, getattr(self, name))
+        with open(os.path.join(directory, "terms.json"), "w") as outfile:
+            json.dump({
+                "vocabulary": sorted(self.vocabulary, key=self.vocabulary.get),
+                "pages": sorted(self.pages, key=self.pages.get),
+            }, outfile)
+
+    @classmethod
+    def load(cls, directory: Text) -> "Bm25Index":
+        """Reads an index, memory-mapping its arrays."""
+        with open(os.path.join(directory, "terms.json")) as infile:
+            terms = json.load(infile)
+        arrays = {
+            name: np.load(
+                os.path.join(directory, f"{name}.npy"), mmap_mode="r")
+            for name in kARRAYS}
+        return cls(terms["vocabulary"], terms["pages"], arrays)
+
+    def page_weights(
+        self,
+        page: Text,
+        k1: float = 1.2,
+        b: float = 0.75,
+    ) -> sparse.csr_matrix:
+        """BM25 weight of every term in every sentence of a page.
+
+        Document frequencies and the average length come from the page.
+        """
+        ii = self.pages[page]
+        start, end = self.page_offsets[ii], self.page_offsets[ii + 1]
+        begin, stop = self.indptr[start], self.indptr[end]
+        indices = np.asarray(self.indices[begin:stop])
+        counts = np.asarray(self.counts[begin:stop], dtype=np.float64)
+        indptr = np.asarray(self.indptr[start:end + 1]) - begin
+        lengths = np.asarray(self.lengths[start:end], dtype=np.float64)
+
+        n = end - start
+        _, terms, df = np.unique(
+            indices, return_inverse=True, return_counts=True)
+        idf = np.log1p((n - df + 0.5) / (df + 0.5))[terms]
+        norm = k1 * (1 - b + b * lengths / max(lengths.mean(), 1))
+        norm = np.repeat(norm, np.diff(indptr))
+        weights = idf * counts * (k1 + 1) / (counts + norm)
+        return sparse.csr_matrix(
+            (weights, indices, indptr), shape=(n, len(self.vocabulary)))
+
+    def queries(self, texts: List[Text]) -> sparse.csr_matrix:
+        """Terms of each text that are in the vocabulary, as a 0/1 matrix."""
+        rows = []
+        cols = []
+        for row, text in enumerate(texts):
+            terms = {
+                self.vocabulary[x] for x in tokenize(text)
+                if x in self.vocabulary}
+            rows.extend([row] * len(terms))
+            cols.extend(terms)
+        return sparse.csr_matrix(
+            (np.ones(len(rows)), (rows, cols)),
+            shape=(len(texts), len(self.vocabulary)))
+
+    def sentence(self, row: int) -> Dict[Text, Any]:
+        return {
+            "section_header": self.names_column[row],
+            "text": self.lines_column[row],
+        }
+
+    def search(
+        self,
+        page: Text,
+        texts: List[Text],
+        k: int = 10,
+        k1: float = 1.2,
+        b: float = 0.75,
+    ) -> List[List[Dict[Text, Any]]]:
+        """Top k sentences of the page for each text, best first."""
+        if page not in self.pages or not texts:
+            return [[] for _ in texts]
+        offset = self.page_offsets[self.pages[page]]
+        scores = (self.queries(texts) @ self.page_weights(page, k1, b).T)
+        scores = scores.toarray()
+        k = min(k, scores.shape[1])
+        if k == 0:
+            return [[] for _ in texts]
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        results = []
+        for row, candidates in enumerate(top):
+            order = np.argsort(-scores[row, candidates], kind="stable")
+            order = candidates[order]
+            results.append([
+                dict(self.sentence(offset + x), id=int(x),
+                     score=float(scores[row, x]))
+                for x in order])
+        return results
+
+
+def retrieve(
+    index: Bm25Index,
+    claims: List[Mapping[Text, Any]],
+    k: int = 10,
+    k1: float = 1.2,
+    b: float = 0.75,
+) -> List[List[Dict[Text, Any]]]:
+    """Top k sentences for each claim, scoring the claims of a page at once."""
+    by_page = {}
+    for ii, claim in enumerate(claims):
+        by_page.setdefault(claim["wikipedia_page"], []).append(ii)
+    results = [None] * len(claims)
+    for page, rows in tqdm.tqdm(by_page.items(), desc="retrieve"):
+        found = index.search(page, [claims[x]["text"] for x in rows], k, k1, b)
+        for row, evidence in zip(rows, found):
+            results[row] = evidence
+    return results
+
+
+def recall(
+    claims: List[Mapping[Text, Any]],
+    results: List[List[Mapping[Text, Any]]],
+    k: int,
+) -> float:
+    """Fraction of the claims with gold evidence in their top k sentences."""
+    hits = 0
+    total = 0
+    for claim, evidence in zip(claims, results):
+        gold = {x["text"].strip() for x in claim["gold_evidence"]}
+        if not gold:
+            continue
+        total += 1
+        hits += any(x["text"].strip() in gold for x in evidence[:k])
+    return hits / max(total, 1)
+
+
+def main(argv):
+    if FLAGS.rebuild_index or not os.path.exists(
+            os.path.join(FLAGS.retrieval_index, "terms.json")):
+        filenames = sorted(glob(os.path.join("pages", "*.sentences.json")))
+        Bm25Index.build(filenames).save(FLAGS.retrieval_index)
+    index = Bm25Index.load(FLAGS.retrieval_index)
+
+    ks = sorted(int(x) for x in FLAGS.recall_at)
+    for split in FLAGS.retrieval_splits:
+        claims = list(fm2_dataset.load_split(split))
+        results = retrieve(index, claims, max(ks), FLAGS.k1, FLAGS.b)
+        indexed = sum(x["wikipedia_page"] in index.pages for x in claims)
+        print(f"{split}: {indexed} of {len(claims)} claims on indexed pages")
+        for k in ks:
+            dataset = recall(
+                claims, [x["retrieved_evidence"] for x in claims], k)
+            print(
+                f"\trecall@{k}: {recall(claims, results, k):.3f} "
+                f"(dataset retrieved_evidence: {dataset:.3f})")
+
+
+if __name__ == "__main__":
+    app.run(main)
@@ -16,14 +16,124 @@
 
 import os
 import download_wiki
+import fm2_dataset
 import wikipediaapi
 import fibs_firebase_config
-import spacy
+import instrumentation
 import json
 import random
+import threading
+import time
+import tqdm
+
+from concurrent import futures
+
+from absl import app
+from absl import flags
+from google.api_core import exceptions
+
+FLAGS = flags.FLAGS
+flags.DEFINE_string("import_file", None,
+                    "JSONL file of claims to import into Firestore instead "
+                    "of bootstrapping, e.g. dataset/train.jsonl")
+flags.DEFINE_integer("import_batch_size", 500,
+                     "Number of claims per batched write, at most 500")
+flags.DEFINE_integer("import_workers", 8,
+                     "Number of batched writes committed concurrently")
+flags.DEFINE_integer("import_retries", 5,
+                     "Number of times a failed batched write is retried")
+flags.DEFINE_string("emulator", None,
+                    "host:port of a Firestore emulator to write to instead "
+                    "of the project's database")
 
 kNUM_WRITES = 10
 kNUM_VOTES = 10
+# Firestore limit on the number of writes in a batch.
+kMAX_BATCH_WRITES = 500
+# Errors after which a batched write can be retried.
+kRETRY = (
+    exceptions.Aborted,
+    exceptions.DeadlineExceeded,
+    exceptions.InternalServerError,
+    exceptions.ResourceExhausted,
+    exceptions.ServiceUnavailable,
+)
+
+
+def claim_document(claim):
+    """Firestore document of a claim from the dataset."""
+    return {
+        "page": claim["wikipedia_page"],
+        "claim": claim["text"],
+        "author": "UNK",
+        "veracity": str(bool(claim["label"] == "SUPPORTS")).upper(),
+        "gold": [
+            {"line": ev["text"], "name": ev["section_header"]}
+            for ev in claim["gold_evidence"]],
+        "evidence": [
+            {"line": ev["text"], "name": ev["section_header"]}
+            for ev in claim["retrieved_evidence"]],
+    }
+
+
+def commit_batch(db, claims, retries):
+    """Writes claims in one batched write, retrying with backoff."""
+    for attempt in range(retries + 1):
+        batch = db.batch()
+        for claim in claims:
+            batch.set(
+                db.collection("fibs").document(claim["id"]),
+                claim_document(claim))
+        try:
+            with instrumentation.phase("firestore_write"):
+                batch.commit()
+            instrumentation.count("firestore_commits")
+            instrumentation.count("firestore_writes", len(claims))
+            return len(claims)
+        except kRETRY:
+            instrumentation.count("firestore_retries")
+            if attempt == retries:
+                raise
+            time.sleep(min(2 ** attempt, 30) * (1 + random.random()) / 2)
+
+
+def import_claims(db, filename, batch_size=500, workers=8, retries=5):
+    """Writes all the claims of a JSONL file with concurrent batched writes.
+
+    Claims are read as they are written, with at most twice as many batches
+    in memory as there are workers.
+    """
+    batch_size = min(batch_size, kMAX_BATCH_WRITES)
+    start = time.time()
+    pending = threading.BoundedSemaphore(2 * workers)
+    progress = tqdm.tqdm(desc="claims")
+
+    def done(future):
+        pending.release()
+        progress.update(future.result())
+
+    with futures.ThreadPoolExecutor(workers) as pool, open(filename) as f:
+        submitted = []
+        claims = []
+        for line in f:
+            claims.append(json.loads(line))
+            if len(claims) == batch_size:
+                pending.acquire()
+                submitted.append(pool.submit(commit_batch, db, claims, retries))
+                submitted[-1].add_done_callback(done)
+                claims = []
+        if claims:
+            pending.acquire()
+            submitted.append(pool.submit(commit_batch, db, claims, retries))
+            submitted[-1].add_done_callback(done)
+        written = sum(x.result() for x in submitted)
+    progress.close()
+
+    elapsed = time.time() - start
+    print(
+        f"Wrote {written} claims in {elapsed:.1f}s "
+        f"({written / max(elapsed, 1e-6):.1f} writes/sec)")
+    return written
 
 
 def bootstrap():
@@ -36,7 +146,7 @@ def bootstrap():
     bucket.update()
 
     random.seed(42)
-    nlp = spacy.load("en_core_web_sm")
+    nlp = download_wiki.load_nlp()
     wiki = wikipediaapi.Wikipedia("en")
     pages_by_category, _ = download_wiki.read_categories()
     db = fibs_firebase_config.initialize_firebase()
@@ -54,31 +164,19 @@ def bootstrap():
             "veracity": bool(index % 2)
         }
 
-    claims = [[], []]
-    with open(os.path.join("dataset", "test.jsonl")) as f:
-        for line in f:
-            claim = json.loads(line)
-            label = int(claim["label"] == "SUPPORTS")
-            claims[label].append(claim)
-    random.shuffle(claims[0])
-    random.shuffle(claims[1])
+    # Only the sampled claims are read from the columns of the split.
+    test = fm2_dataset.load_split("test")
+    claims = [
+        [test[x] for x in random.sample(list(test.where(label=label)),
+                                        kNUM_VOTES)]
+        for label in ["REFUTES", "SUPPORTS"]]
     os.makedirs("pages", exist_ok=True)
     for index in range(kNUM_VOTES):
         if random.random() < 0.5:
             claim_left, claim_right = claims[0][index], claims[1][index]
         else:
             claim_right, claim_left = claims[0][index], claims[1][index]
-        for claim in [claim_left, claim_right]:
-            db.collection("fibs").document(claim["id"]).set({
-                "page": claim["wikipedia_page"],
-                "claim": claim["text"],
-                "author": "UNK",
-                "veracity": str(bool(claim["label"] == "SUPPORTS")).upper(),
-                "gold": [
-                    {"line": ev["text"]} for ev in claim["gold_evidence"]],
-                "evidence": [
-                    {"line": ev["text"]} for ev in claim["retrieved_evidence"]],
-            })
+        commit_batch(db, [claim_left, claim_right], retries=0)
         workflow[f"{index:05}_vote"] = {
             "claim_left": claim_left["id"],
             "claim_right": claim_right["id"],
@@ -92,5 +190,18 @@ def bootstrap():
         json.dumps(workflow, indent=2, sort_keys=True),
         content_type='application/json')
 
+
+def main(argv):
+    if FLAGS.emulator:
+        os.environ["FIRESTORE_EMULATOR_HOST"] = FLAGS.emulator
+    if FLAGS.import_file:
+        db = fibs_firebase_config.initialize_firebase()
+        import_claims(
+            db, FLAGS.import_file, FLAGS.import_batch_size,
+            FLAGS.import_workers, FLAGS.import_retries)
+    else:
+        bootstrap()
+
+
 if __name__ == "__main__":
-    bootstrap()
+    app.run(instrumentation.instrumented(main))
@@ -0,0 +1,500 @@
+# coding=utf-8
+# Copyright 2019 Google LLC.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# Lint as: python3
+
+# Compact in-memory claims, votes and likes for create_workflow. Votes and
+# likes are columns of NumPy arrays, with claims and users as int32 ids, and
+# claims are records with __slots__ whose votes and likes come from the
+# tables. All of them read like the dictionaries they replace.
+
+import datetime
+
+from array import array
+from collections import abc
+from typing import (
+    Text, Mapping, Dict, List, Iterable, Iterator, Any, Optional, Set, Tuple)
+
+import numpy as np
+
+kEPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+# Time of votes without one, in microseconds since kEPOCH.
+kNO_TIME = np.iinfo(np.int64).min
+# Default of getattr for fields a claim does not have.
+kMISSING = object()
+
+
+class Interner(object):
+    """Int ids of strings, in the order they are first seen."""
+
+    __slots__ = ("ids", "names")
+
+    def __init__(self):
+        self.ids = {}
+        self.names = []
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def intern(self, name: Text) -> int:
+        index = self.ids.get(name)
+        if index is None:
+            index = self.ids[name] = len(self.names)
+            self.names.append(name)
+        return index
+
+    def get(self, name: Text, default: int = -1) -> int:
+        return self.ids.get(name, default)
+
+
+def compact_column(values: List[Any]) -> np.ndarray:
+    """Smallest array that gives the values back as they were.
+
+    Integers get the smallest integer type that holds them, floats stay
+    floats, and anything else, like None, an object array.
+    """
+    if all(isinstance(x, bool) for x in values):
+        return np.array(values, dtype=bool)
+    if values and all(
+            isinstance(x, int) and not isinstance(x, bool) for x in values):
+        column = np.array(values, dtype=np.int64)
+        for dtype in [np.int8, np.int16, np.int32]:
+            info = np.iinfo(dtype)
+            if info.min <= column.min() and column.max() <= info.max:
+                return column.astype(dtype)
+        return column
+    if all(isinstance(x, float) for x in values):
+        return np.array(values, dtype=np.float64)
+    column = np.empty(len(values), dtype=object)
+    column[:] = values
+    return column
+
+
+def _to_micros(time: Optional[datetime.datetime]) -> int:
+    if time is None:
+        return kNO_TIME
+    if time.tzinfo is None:
+        time = time.replace(tzinfo=datetime.timezone.utc)
+    return (time - kEPOCH) // datetime.timedelta(microseconds=1)
+
+
+def _from_micros(micros: int) -> Optional[datetime.datetime]:
+    if micros == kNO_TIME:
+        return None
+    return kEPOCH + datetime.timedelta(microseconds=micros)
+
+
+def _group(claims: np.ndarray, num_claims: int) -> Tuple[np.ndarray, ...]:
+    """Rows ordered by claim, keeping their order, and offsets per claim."""
+    order = np.argsort(claims, kind="stable")
+    offsets = np.zeros(num_claims + 1, dtype=np.int64)
+    np.cumsum(np.bincount(claims, minlength=num_claims), out=offsets[1:])
+    return order, offsets
+
+
+def _vote_key(claim: Any, voter: Any) -> Any:
+    # Claim ids in the high and voter ids in the low 32 bits, so keys sort by
+    # claim and then voter.
+    return (claim << 32) | voter
+
+
+def _group_by_voter(
+    claims: np.ndarray,
+    voters: np.ndarray,
+    num_claims: int,
+) -> Tuple[np.ndarray, ...]:
+    """Rows ordered by claim, voter and row, their keys and claim offsets."""
+    order = np.lexsort((voters, claims)).astype(np.int32)
+    keys = _vote_key(claims.astype(np.int64), voters.astype(np.int64))[order]
+    offsets = np.zeros(num_claims + 1, dtype=np.int64)
+    np.cumsum(np.bincount(claims, minlength=num_claims), out=offsets[1:])
+    return order, keys, offsets
+
+
+def _count(counts: List[int], index: int) -> int:
+    # Claims interned after the table was built have no rows.
+    return counts[index] if 0 <= index < len(counts) else 0
+
+
+def _rows(order: np.ndarray, offsets: np.ndarray, index: int) -> np.ndarray:
+    # Claims interned after the table was built have no rows.
+    if index < 0 or index + 1 >= len(offsets):
+        return order[:0]
+    return order[offsets[index]:offsets[index + 1]]
+
+
+class Vote(abc.Mapping):
+    """A vote of a VoteTable, as points, time, secondsLeft and evidence_used.
+    """
+
+    __slots__ = ("_table", "_row")
+    kFIELDS = ("points", "time", "secondsLeft", "evidence_used")
+
+    def __init__(self, table: "VoteTable", row: int):
+        self._table = table
+        self._row = row
+
+    def __getitem__(self, field: Text) -> Any:
+        table, row = self._table, self._row
+        if field == "points":
+            return table.points.item(row)
+        if field == "time":
+            return _from_micros(table.time.item(row))
+        if field == "secondsLeft":
+            return table.seconds_left.item(row)
+        if field == "evidence_used":
+            return table.evidence_used(row)
+        raise KeyError(field)
+
+    def __iter__(self) -> Iterator[Text]:
+        return iter(self.kFIELDS)
+
+    def __len__(self) -> int:
+        return len(self.kFIELDS)
+
+    def keys(self) -> Tuple[Text, ...]:
+        # dict(vote) reads the fields through keys().
+        return self.kFIELDS
+
+
+class ClaimVotes(abc.Mapping):
+    """Votes of a claim by voter, a slice of the rows of a VoteTable."""
+
+    __slots__ = ("_table", "_claim")
+
+    def __init__(self, table: "VoteTable", claim: int):
+        self._table = table
+        self._claim = claim
+
+    def __getitem__(self, voter: Text) -> Vote:
+        row = self._table.row(self._claim, voter)
+        if row is None:
+            raise KeyError(voter)
+        return Vote(self._table, row)
+
+    def __contains__(self, voter: Any) -> bool:
+        return self._table.row(self._claim, voter) is not None
+
+    def __iter__(self) -> Iterator[Text]:
+        table = self._table
+        names = table.users.names
+        voters = table.voter[table.claim_rows(self._claim)].tolist()
+        return iter(dict.fromkeys(names[x] for x in voters))
+
+    def __len__(self) -> int:
+        voters = self._table.sorted_voters(self._claim)
+        return int(np.count_nonzero(np.diff(voters))) + (len(voters) > 0)
+
+
+class VoteTable(abc.Mapping):
+    """Votes as columns, readable like votes[claim][voter][field].
+
+    Rows are in the order votes were added. Claims without votes read as no
+    votes, like a defaultdict, but are not keys.
+    """
+
+    def __init__(
+        self,
+        claims: Interner,
+        users: Interner,
+        columns: Mapping[Text, np.ndarray],
+    ):
+        self.claims = claims
+        self.users = users
+        self.claim = columns["claim"]
+        self.voter = columns["voter"]
+        self.points = columns["points"]
+        self.time = columns["time"]
+        self.seconds_left = columns["seconds_left"]
+        self.success = columns["success"]
+        # Claims of the pair voted on and the evidence used of each one.
+        self.fibs = columns["fibs"]
+        self.evidence = columns["evidence"]
+        # Rows by claim, then voter, then row, and their (claim, voter) keys,
+        # so a voter's vote on a claim is found by a binary search.
+        self._order, self._keys, self._offsets = _group_by_voter(
+            self.claim, self.voter, len(claims))
+        # Votes and correct votes per claim, read for every claim record.
+        self._totals = np.diff(self._offsets).tolist()
+        self._correct = np.bincount(
+            self.claim, self.success, minlength=len(claims)
+        ).astype(np.int64).tolist()
+
+    @classmethod
+    def build(
+        cls,
+        votes: Iterable[Tuple[Text, Text, Mapping[Text, Any]]],
+        claims: Interner,
+        users: Interner,
+    ) -> "VoteTable":
+        """Table of votes given as claim, voter and vote document."""
+        claim, voter, time, fibs = (
+            array("i"), array("i"), array("q"), array("i"))
+        points, seconds_left, success, evidence = [], [], [], []
+        for key, _, vote in votes:
+            claim.append(claims.intern(key))
+            voter.append(users.intern(vote["author"]))
+            points.append(vote["points"])
+            time.append(_to_micros(vote["created"]))
+            seconds_left.append(vote.get("secondsLeft", -1))
+            success.append(bool(vote["success"]))
+
+            pair = vote.get("fibs", None)
+            used = vote.get("evidenceUsed", -1)
+            if pair and used:
+                assert key in pair, f"key {key} not in fibs {pair}"
+                fibs.extend([claims.intern(pair[0]), claims.intern(pair[1])])
+                evidence.extend([used[0], used[1]])
+            else:
+                fibs.extend([-1, -1])
+                evidence.extend([0, 0])
+        return cls(claims, users, {
+            "claim": np.frombuffer(claim, dtype=np.int32),
+            "voter": np.frombuffer(voter, dtype=np.int32),
+            "points": compact_column(points),
+            "time": np.frombuffer(time, dtype=np.int64),
+            "seconds_left": compact_column(seconds_left),
+            "success": np.array(success, dtype=bool),
+            "fibs": np.frombuffer(fibs, dtype=np.int32).reshape(-1, 2),
+            "evidence": compact_column(evidence).reshape(-1, 2),
+        })
+
+    def claim_rows(self, claim: int) -> np.ndarray:
+        """Rows of the votes on an interned claim, in the order added."""
+        return np.sort(_rows(self._order, self._offsets, claim))
+
+    def rows(self, key: Text) -> np.ndarray:
+        """Rows of the votes on a claim, in the order they were added."""
+        return self.claim_rows(self.claims.get(key))
+
+    def sorted_voters(self, claim: int) -> np.ndarray:
+        """Voter ids of the votes on an interned claim, sorted."""
+        if claim < 0 or claim + 1 >= len(self._offsets):
+            return self.voter[:0]
+        keys = self._keys[self._offsets[claim]:self._offsets[claim + 1]]
+        return (keys & 0xFFFFFFFF).astype(self.voter.dtype)
+
+    def row(self, claim: int, voter: Any) -> Optional[int]:
+        """Row of the vote of a voter on an interned claim, if any.
+
+        The last vote wins, like it did when votes were dictionaries.
+        """
+        index = self.users.get(voter)
+        if index < 0 or claim < 0:
+            return None
+        key = _vote_key(claim, index)
+        # Rows of the same voter are in the order added, the last is newest.
+        found = int(self._keys.searchsorted(key, side="right")) - 1
+        if found < 0 or self._keys.item(found) != key:
+            return None
+        return self._order.item(found)
+
+    def evidence_used(self, row: int) -> Dict[Text, Any]:
+        left, right = self.fibs.item(row, 0), self.fibs.item(row, 1)
+        if left < 0:
+            return {}
+        names = self.claims.names
+        return {
+            names[left]: self.evidence.item(row, 0),
+            names[right]: self.evidence.item(row, 1)}
+
+    def voters(self, key: Text) -> List[Text]:
+        names = self.users.names
+        return [names[x] for x in self.voter[self.rows(key)].tolist()]
+
+    def counts(self, key: Text) -> Tuple[int, int]:
+        """Number of votes on a claim and of the ones that were correct."""
+        index = self.claims.get(key)
+        return _count(self._totals, index), _count(self._correct, index)
+
+    def mean_evidence_used(self) -> Dict[Text, float]:
+        """Like pair_matching.mean_evidence_used, over the columns."""
+        claim = np.repeat(self.claim[:, None], 2, axis=1)
+        own = (self.fibs == claim).ravel()
+        seen = self.evidence.ravel()[own]
+        if seen.dtype == object:
+            known = np.array(
+                [isinstance(x, (int, float)) and x >= 0 for x in seen],
+                dtype=bool)
+        else:
+            known = seen >= 0
+        claims = claim.ravel()[own][known]
+        seen = seen[known].astype(np.float64)
+        total = np.bincount(claims, seen, minlength=len(self.claims))
+        count = np.bincount(claims, minlength=len(self.claims))
+        names = self.claims.names
+        return {
+            names[x]: float(total[x] / count[x])
+            for x in np.flatnonzero(count).tolist()}
+
+    def __getitem__(self, key: Text) -> ClaimVotes:
+        return ClaimVotes(self, self.claims.get(key))
+
+    def __contains__(self, key: Any) -> bool:
+        return len(self.rows(key)) > 0
+
+    def __iter__(self) -> Iterator[Text]:
+        names = self.claims.names
+        counts = np.diff(self._offsets)
+        return iter([names[x] for x in np.flatnonzero(counts).tolist()])
+
+    def __len__(self) -> int:
+        return int(np.count_nonzero(np.diff(self._offsets)))
+
+
+class LikeTable(object):
+    """Users that liked each claim, as int32 columns."""
+
+    def __init__(self, claims: Interner, users: Interner,
+                 claim: np.ndarray, user: np.ndarray):
+        self.claims = claims
+        self.users = users
+        self.claim = claim
+        self.user = user
+        self._order, self._offsets = _group(claim, len(claims))
+        self._counts = np.diff(self._offsets).tolist()
+
+    @classmethod
+    def build(
+        cls,
+        likes: Iterable[Tuple[Text, Text]],
+        claims: Interner,
+        users: Interner,
+    ) -> "LikeTable":
+        claim, user = array("i"), array("i")
+        for key, liker in likes:
+            claim.append(claims.intern(key))
+            user.append(users.intern(liker))
+        return cls(
+            claims, users, np.frombuffer(claim, dtype=np.int32),
+            np.frombuffer(user, dtype=np.int32))
+
+    def rows(self, key: Text) -> np.ndarray:
+        return _rows(self._order, self._offsets, self.claims.get(key))
+
+    def likers(self, key: Text) -> Set[Text]:
+        names = self.users.names
+        return {names[x] for x in self.user[self.rows(key)].tolist()}
+
+    def count(self, key: Text) -> int:
+        return _count(self._counts, self.claims.get(key))
+
+
+class Claim(abc.MutableMapping):
+    """A claim of the workflow, readable and writable like its dictionary.
+
+    Fields of the Firestore document are attributes, with an extra
+    dictionary for unusual ones. Its votes, likes and their counts are read
+    from the tables and cannot be set, the same fields of the document are
+    ignored.
+    """
+
+    __slots__ = (
+        "id", "page", "claim", "author", "veracity", "created", "gold",
+        "evidence", "category", "duplicate_of", "_extra", "_votes", "_likes")
+    kFIELDS = __slots__[:-3]
+    kFIELD_SET = frozenset(kFIELDS)
+    kCOMPUTED = (
+        "votes", "likes", "total_votes", "total_likes", "correct_votes")
+    kCOMPUTED_SET = frozenset(kCOMPUTED)
+
+    def __init__(
+        self,
+        key: Text,
+        document: Mapping[Text, Any],
+        category: Text,
+        votes: VoteTable,
+        likes: LikeTable,
+    ):
+        self._extra = None
+        self._votes = votes
+        self._likes = likes
+        for field, value in document.items():
+            if field not in self.kCOMPUTED:
+                self[field] = value
+        self.category = category
+        self.id = key
+
+    def __getitem__(self, field: Text) -> Any:
+        if field in self.kFIELD_SET:
+            try:
+                return getattr(self, field)
+            except AttributeError:
+                raise KeyError(field) from None
+        if field in self.kCOMPUTED_SET:
+            if field == "votes":
+                return self._votes.voters(self.id)
+            if field == "likes":
+                return self._likes.likers(self.id)
+            if field == "total_likes":
+                return self._likes.count(self.id)
+            total, correct = self._votes.counts(self.id)
+            return total if field == "total_votes" else correct
+        if self._extra is None:
+            raise KeyError(field)
+        return self._extra[field]
+
+    def __contains__(self, field: Any) -> bool:
+        if field in self.kFIELD_SET:
+            return hasattr(self, field)
+        return field in self.kCOMPUTED_SET or (
+            self._extra is not None and field in self._extra)
+
+    def __setitem__(self, field: Text, value: Any):
+        if field in self.kCOMPUTED_SET:
+            raise KeyError(f"{field} is read from the vote and like tables")
+        if field in self.kFIELD_SET:
+            setattr(self, field, value)
+            return
+        if self._extra is None:
+            self._extra = {}
+        self._extra[field] = value
+
+    def __delitem__(self, field: Text):
+        if field in self.kFIELD_SET and hasattr(self, field):
+            delattr(self, field)
+        elif self._extra and field in self._extra:
+            del self._extra[field]
+        else:
+            raise KeyError(field)
+
+    def __iter__(self) -> Iterator[Text]:
+        for field in self.kFIELDS:
+            if hasattr(self, field):
+                yield field
+        yield from self._extra or ()
+        yield from self.kCOMPUTED
+
+    def items(self) -> abc.ItemsView:
+        """Fields and values, read at once rather than field by field."""
+        result = {}
+        for field in self.kFIELDS:
+            value = getattr(self, field, kMISSING)
+            if value is not kMISSING:
+                result[field] = value
+        result.update(self._extra or ())
+        total, correct = self._votes.counts(self.id)
+        result.update(
+            votes=self._votes.voters(self.id),
+            likes=self._likes.likers(self.id),
+            total_votes=total,
+            total_likes=self._likes.count(self.id),
+            correct_votes=correct)
+        return result.items()
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+
+    def __repr__(self) -> Text:
+        return f"Claim({dict(self)!r})"
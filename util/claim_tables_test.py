@@ -0,0 +1,87 @@
+# coding=utf-8
+# Copyright 2019 Google LLC.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# Lint as: python3
+
+import datetime
+
+import claim_tables
+
+kTIME = datetime.datetime(2020, 1, 1, tzinfo=datetime.timezone.utc)
+
+
+def vote(author, points, minutes=0, pair=None, used=None):
+    return {"author": author, "points": points, "success": points > 0,
+            "created": kTIME + datetime.timedelta(minutes=minutes),
+            "secondsLeft": 30, "fibs": pair, "evidenceUsed": used}
+
+
+def table(votes):
+    return claim_tables.VoteTable.build(
+        votes, claim_tables.Interner(), claim_tables.Interner())
+
+
+def as_dicts(votes):
+    """Votes as the nested dictionaries the table replaces."""
+    nested = {}
+    for key, _, document in votes:
+        nested.setdefault(key, {})[document["author"]] = document
+    return nested
+
+
+kVOTES = [
+    ("a", "v1", vote("ann", 10, 0, ["a", "b"], [2, 0])),
+    ("b", "v2", vote("ann", 10, 0, ["a", "b"], [2, 0])),
+    ("a", "v3", vote("bob", -5, 1)),
+    ("c", "v4", vote("bob", 7, 2)),
+    ("a", "v5", vote("cat", 3, 3)),
+    ("a", "v6", vote("bob", 8, 4)),
+]
+
+
+def test_lookup_by_claim_and_voter():
+    votes = table(kVOTES)
+    assert votes["a"]["ann"]["points"] == 10
+    assert votes["a"]["ann"]["time"] == kTIME
+    assert votes["a"]["ann"]["secondsLeft"] == 30
+    assert votes["a"]["ann"]["evidence_used"] == {"a": 2, "b": 0}
+    assert votes["c"]["bob"]["evidence_used"] == {}
+
+
+def test_last_vote_wins():
+    votes = table(kVOTES)
+    assert votes["a"]["bob"]["points"] == 8
+    assert votes["a"]["bob"]["time"] == kTIME + datetime.timedelta(minutes=4)
+
+
+def test_missing_claims_and_voters():
+    votes = table(kVOTES)
+    assert votes["a"].get("dan") is None
+    assert "dan" not in votes["a"]
+    assert votes["c"].get("ann") is None
+    assert votes["missing"].get("ann") is None
+    assert len(votes["missing"]) == 0
+    assert "missing" not in votes
+
+
+def test_same_as_dictionaries():
+    votes, nested = table(kVOTES), as_dicts(kVOTES)
+    assert list(votes) == list(nested)
+    for key in nested:
+        assert list(votes[key]) == list(nested[key])
+        assert len(votes[key]) == len(nested[key])
+        for author, document in nested[key].items():
+            assert votes[key][author]["points"] == document["points"]
+    assert votes.counts("a") == (4, 3)
+    assert votes.voters("a") == ["ann", "bob", "cat", "bob"]
@@ -0,0 +1,148 @@
+# coding=utf-8
+# Copyright 2019 Google LLC.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# Lint as: python3
+
+# Rewrites the page and index blobs uploaded before download_wiki compressed
+# them, minified and gzip-encoded, and reports the bytes saved per category.
+# The manifest is updated so download_wiki does not upload them again.
+
+import tqdm
+from collections import defaultdict
+from concurrent import futures
+
+import download_wiki
+import fibs_firebase_config
+import instrumentation
+import page_manifest
+
+from absl import app
+from absl import flags
+
+from typing import TYPE_CHECKING, Text, Mapping, Dict, List, Tuple
+
+if TYPE_CHECKING:
+    from google.cloud import storage
+
+FLAGS = flags.FLAGS
+flags.DEFINE_boolean("report_only", False,
+                     "Only report the bytes compression would save, without "
+                     "rewriting the blobs")
+flags.DEFINE_integer("compress_workers", 8,
+                     "Number of blobs downloaded and rewritten concurrently")
+
+kPREFIXES = ["pages/", "indices/"]
+kFIELDS = "items(name,contentEncoding),nextPageToken"
+
+
+def uncompressed_blobs(bucket: "storage.Bucket") -> Tuple[List[Text], int]:
+    """Names of the blobs to compress, and how many already are."""
+    names = []
+    compressed = 0
+    for prefix in kPREFIXES:
+        for blob in bucket.list_blobs(prefix=prefix, fields=kFIELDS):
+            if blob.content_encoding == "gzip":
+                compressed += 1
+            else:
+                names.append(blob.name)
+    return names, compressed
+
+
+def compress_blob(
+    bucket: "storage.Bucket",
+    name: Text,
+    report_only: bool = False,
+) -> Tuple[Text, Text, int, int]:
+    """Compresses a blob in place.
+
+    Returns the hashes of the blob before and after and their sizes.
+    """
+    data = bucket.blob(name).download_as_bytes()
+    payload = page_manifest.compress_json(data)
+    if not report_only:
+        page_manifest.upload_compressed(bucket, name, payload)
+    return (
+        page_manifest.md5_hash(data), page_manifest.md5_hash(payload),
+        len(data), len(payload))
+
+
+def page_of(name: Text) -> Text:
+    return name.split("/", 1)[1][:-len(".json")]
+
+
+def record_blob(
+    manifest: page_manifest.Manifest,
+    name: Text,
+    before: Text,
+    after: Text,
+):
+    """Records the new hash of a blob that had the hash of the manifest."""
+    manifest.remote[name] = after
+    page = page_of(name)
+    field = "sentences" if name.startswith("pages/") else "index"
+    if manifest.pages.get(page, {}).get(field) == before:
+        manifest.update(page, **{f"{field}_blob": after})
+
+
+def size_report(
+    sizes: Mapping[Text, Tuple[int, int]],
+    categories: Mapping[Text, List[Text]],
+) -> Dict[Text, List[int]]:
+    """Blobs, bytes before and bytes after per category."""
+    category_of = {
+        page: category
+        for category in categories for page in categories[category]}
+    report = defaultdict(lambda: [0, 0, 0])
+    for name, (before, after) in sizes.items():
+        row = report[category_of.get(page_of(name), "(none)")]
+        row[0] += 1
+        row[1] += before
+        row[2] += after
+    return dict(sorted(report.items()))
+
+
+def main(argv):
+    bucket = fibs_firebase_config.get_bucket()
+    categories, _ = download_wiki.read_categories()
+    manifest = page_manifest.Manifest.load(
+        bucket, FLAGS.manifest, FLAGS.remote_cache, FLAGS.remote_ttl,
+        FLAGS.lengths)
+    names, compressed = uncompressed_blobs(bucket)
+    print(f"{len(names)} blobs to compress, {compressed} already are.")
+
+    sizes = {}
+    with futures.ThreadPoolExecutor(FLAGS.compress_workers) as executor:
+        results = executor.map(
+            lambda name: compress_blob(bucket, name, FLAGS.report_only),
+            names)
+        for (before, after, size, compressed_size), name in zip(
+                tqdm.tqdm(results, total=len(names)), names):
+            sizes[name] = (size, compressed_size)
+            if not FLAGS.report_only:
+                record_blob(manifest, name, before, after)
+    if not FLAGS.report_only:
+        manifest.save(bucket, FLAGS.manifest, FLAGS.lengths)
+        if FLAGS.remote_cache and FLAGS.remote_ttl > 0:
+            manifest.save_remote(FLAGS.remote_cache)
+
+    print("category\tblobs\tbefore\tafter\tsaved")
+    report = size_report(sizes, categories)
+    report["total"] = [sum(x) for x in zip(*report.values())] or [0, 0, 0]
+    for category, (count, before, after) in report.items():
+        saved = 1 - after / before if before else 0
+        print(f"{category}\t{count}\t{before}\t{after}\t{saved:.1%}")
+
+
+if __name__ == "__main__":
+    app.run(instrumentation.instrumented(main))
@@ -19,66 +19,156 @@
 
 import random
 import datetime
-import pickle
 import json
 import os
+import time
 import tqdm
 
 from csv import DictWriter
-from collections import defaultdict, Counter
+from collections import defaultdict
+from concurrent import futures
+from glob import glob
 
 from absl import app
 from absl import flags
 
+import activity_stats
+import async_reads
+import claim_tables
 import download_wiki
+import evidence_index
+import export_writers
 import fibs_firebase_config
+import instrumentation
+import near_duplicates
+import page_manifest
+import pair_matching
+import workflow_shards
+import workflow_store
 
 FLAGS = flags.FLAGS
 flags.DEFINE_string("name", os.path.join('logs', str(datetime.date.today())),
                     "Name of workflow and ouput files by default today's date")
 flags.DEFINE_integer("min_length", 20,
                      "Minimum length of Wikipedia page to be included in task")
+flags.DEFINE_integer("read_workers", 8,
+                     "Number of concurrent Firestore reads of missing pages, "
+                     "or of collections with --async_reads")
+flags.DEFINE_boolean("async_reads", False,
+                     "Read users, comparisons, claims, votes and likes "
+                     "concurrently with the asyncio Firestore client")
+flags.DEFINE_integer("read_retries", 5,
+                     "Number of times a collection is read again after a "
+                     "transient error with --async_reads")
 flags.DEFINE_boolean("use_cache", False,
-                     "Use local cache instead of from Firebase")
+                     "Use the local store instead of syncing from Firebase")
 flags.DEFINE_integer("time_offset", -6,
                      "Time Offset for date statistics")
+flags.DEFINE_string("timezone", None,
+                    "Time zone of the statistics, like America/Chicago, "
+                    "instead of a fixed --time_offset")
+flags.DEFINE_list("stats_granularity", ["day"],
+                  "Buckets of time of the statistics: hour, day or week")
+flags.DEFINE_list("stats_by", ["author", "category", "page"],
+                  "Statistics to compute per bucket: author, category or page")
+flags.DEFINE_enum("pairing", "greedy", ["greedy", "optimal"],
+                  "Match claims for voting greedily or with an optimal "
+                  "assignment")
+flags.DEFINE_boolean("pair_by_difficulty", False,
+                     "Pair claims of similar difficulty, from their votes, "
+                     "likes and the evidence players used")
+flags.DEFINE_boolean("incremental_stats", False,
+                     "Only compute the statistics of the buckets with new "
+                     "activity since the last run")
 flags.DEFINE_string("missing_category", "NOCAT",
                     "Category to assign to pages without a category")
-
-
-def save_claims(claims, filename):
-    claim_list = []
-    fields = set()
+flags.DEFINE_string("store", os.path.join('logs', 'workflow.db'),
+                    "Local SQLite store of claims, votes, likes, users and "
+                    "comparisons, updated with the claims, votes and likes "
+                    "created since the last run")
+flags.DEFINE_boolean("full_sync", False,
+                     "Read all claims, votes and likes instead of only the "
+                     "ones created since the last run")
+flags.DEFINE_float("reconcile_hours", 24,
+                   "Hours between reads of the keys of all claims, votes "
+                   "and likes, which remove the ones deleted from Firestore "
+                   "from the store; 0 reads them on every run")
+flags.DEFINE_integer("workflow_shards", 8,
+                     "Shards to split the workflow in, players get the one of "
+                     "their user ID; 0 uploads a single workflow file")
+flags.DEFINE_integer("shard_upload_workers", 8,
+                     "Number of threads uploading the workflow shards")
+flags.DEFINE_string("duplicates", os.path.join('logs', 'duplicates.npz'),
+                    "Near-duplicate index of the claims, only new claims are "
+                    "added to it; empty to keep it in memory")
+flags.DEFINE_float("duplicate_threshold", 0.7,
+                   "Estimated Jaccard similarity of the shingles of claims "
+                   "above which they are near-duplicates")
+flags.DEFINE_boolean("duplicates_by_page", True,
+                     "Only look for near-duplicates among claims of the "
+                     "same page")
+flags.DEFINE_boolean("link_evidence", True,
+                     "Add the page and sentence id of the evidence of the "
+                     "exported claims, and report evidence without match")
+flags.DEFINE_string("evidence_cache",
+                    os.path.join("pages", "evidence_index.json"),
+                    "Sentences of the pages linked to evidence, only pages "
+                    "whose file changed are read again; empty to disable")
+
+# Documents created this long before the last synced one are read again, in
+# case they were committed after the last sync.
+kSYNC_OVERLAP = datetime.timedelta(minutes=10)
+# Number of pages read from Firestore with a single get_all.
+kPAGES_PER_READ = 100
+kLABELS = {"TRUE": "SUPPORTS", "FALSE": "REFUTES"}
+# Columns of the CSV exports, the JSONL exports keep every field.
+kCLAIM_FIELDS = [
+    "id", "text", "label", "page", "category", "author", "created",
+    "gold_evidence", "retrieved_evidence", "likes", "votes", "total_likes",
+    "total_votes", "correct_votes", "duplicate_of"]
+kCOMPARISON_FIELDS = (
+    ["true", "false", "true_claim", "false_claim", "user", "points",
+     "secondsLeft", "time", "true_evidence_seen", "false_evidence_seen"] +
+    [f"{side}_{x}" for side in ["true", "false"]
+     for x in ["points", "secondsLeft", "time"]])
+
+
+def claim_label(claim):
+    """Dataset label of a claim, None if its veracity is not valid."""
+    return kLABELS.get(claim.get("veracity"))
+
+
+def claim_records(claims):
+    """Claims in the format of the dataset, without modifying them."""
     for ii in claims:
-        claims[ii]["likes"] = list(claims[ii]["likes"])
-        claims[ii]["text"] = claims[ii].pop("claim").strip()
-
-        if claims[ii]["veracity"] == "TRUE":
-            claims[ii]["label"] = "SUPPORTS"
-        elif claims[ii]["veracity"] == "FALSE":
-            claims[ii]["label"] = "REFUTES"
-        else:
+        label = claim_label(claims[ii])
+        if label is None:
             print("Error", claims[ii].get("veracity", "No Veracity found"))
             continue
-        del claims[ii]["veracity"]
 
-        claims[ii]["id"] = ii
-        if "created" in claims[ii]:
-            claims[ii]["created"] = str(claims[ii]["created"])
+        record = {
+            jj: value for jj, value in claims[ii].items()
+            if jj not in ["claim", "veracity", "evidence", "gold",
+                          "evidence1", "evidence2"]}
+        record["likes"] = list(claims[ii]["likes"])
+        record["text"] = claims[ii]["claim"].strip()
+        record["label"] = label
+        record["id"] = ii
+        if "created" in record:
+            record["created"] = str(record["created"])
 
         if "evidence1" in claims[ii]:
-            claims[ii]["evidence"] = [
-                claims[ii]["evidence1"], claims[ii]["evidence2"]]
-            del claims[ii]["evidence1"]
-            del claims[ii]["evidence2"]
+            evidence = [claims[ii]["evidence1"], claims[ii]["evidence2"]]
+        else:
+            evidence = claims[ii]["evidence"]
 
-        if not isinstance(claims[ii]["evidence"][0], dict):
+        if not isinstance(evidence[0], dict):
             print("Error", ii, "Evidence is not dict")
             continue
 
-        claims[ii]["retrieved_evidence"] = [
+        record["retrieved_evidence"] = [
             dict(text=e["line"].strip(), section_header=e["name"])
-            for e in claims[ii].pop("evidence")]
+            for e in evidence]
 
         gold = claims[ii].get("gold", [])
         if not gold:
@@ -88,31 +178,32 @@ def save_claims(claims, filename):
             print("Error", ii, "Gold is not dict")
             continue
 
-        claims[ii]["gold_evidence"] = [
+        record["gold_evidence"] = [
             dict(text=e["line"].strip(), section_header=e["name"])
-            for e in claims[ii].pop("gold")]
+            for e in gold]
 
-        claim_list.append(claims[ii])
-        for jj in claims[ii]:
-            fields.add(jj)
+        yield record
 
-    print(f"{len(claim_list)} claims with {str(fields)} fields")
 
-    with open(f"{filename}.claims.csv", mode='w') as outfile:
-        w = DictWriter(outfile, fields)
-        w.writeheader()
-        for ii in claim_list:
-            w.writerow(ii)
+def save_claims(claims, filename, evidence=None):
+    """Writes the claims to a CSV and a JSONL file in a single pass.
 
-    with open(f"{filename}.claims.jsonl", mode='w') as outfile:
-        for ii in claim_list:
-            outfile.write(json.dumps(ii, sort_keys=True) + '\n')
-
-    return claim_list
-
-
-def save_comparisons(comparisons, claims, votes, filename):
-    comparison_rows = []
+    With an evidence index, evidence gets the id of its sentence and the
+    evidence without one is reported in an .unmatched_evidence.csv file.
+    """
+    records = claim_records(claims)
+    if evidence is not None:
+        records = evidence_index.link_evidence(
+            records, evidence, f"{filename}.unmatched_evidence.csv")
+    count = export_writers.write_jsonl(
+        export_writers.tee_csv(
+            records, f"{filename}.claims.csv", kCLAIM_FIELDS),
+        f"{filename}.claims.jsonl")
+    print(f"{count} claims with {kCLAIM_FIELDS} fields")
+    return count
+
+
+def comparison_rows(comparisons, claims, votes):
     fields = ["points", "secondsLeft", "time"]
 
     for user in comparisons:
@@ -124,92 +215,103 @@ def save_comparisons(comparisons, claims, votes, filename):
             if not comparisons[user][ii] in claims:
                 print(f"Missing claim {comparisons[user][ii]}")
                 continue
-            claim_label = claims[ii]["label"]
-            if claim_label == "SUPPORTS":
+            label = claim_label(claims[ii])
+            if label == "SUPPORTS":
                 true_claim = ii
                 false_claim = comparisons[user][ii]
-            else:
-                assert claim_label == "REFUTES", f"Invalid {ii}: {claim_label}"
+            elif label == "REFUTES":
                 false_claim = ii
                 true_claim = comparisons[user][ii]
+            else:
+                print(f"Invalid {ii}: {claims[ii].get('veracity')}")
+                continue
 
             comparison_row["true"] = true_claim
             comparison_row["false"] = false_claim
 
-            comparison_row["true_claim"] = claims[true_claim]["text"]
-            comparison_row["false_claim"] = claims[false_claim]["text"]
+            comparison_row["true_claim"] = claims[true_claim]["claim"].strip()
+            comparison_row["false_claim"] = claims[false_claim]["claim"].strip()
 
             comparison_row["user"] = user
+            # Each vote is read from the vote table once.
+            true_vote = votes[true_claim].get(user)
+            false_vote = votes[false_claim].get(user)
+            true_vote = {} if true_vote is None else dict(true_vote)
+            false_vote = {} if false_vote is None else dict(false_vote)
             for field in fields:
                 try:
-                    true_field = votes[true_claim][user][field]
-                    false_field = votes[false_claim][user][field]
+                    true_field = true_vote[field]
+                    false_field = false_vote[field]
                     assert(true_field == false_field)
-                    comparison_row[field] = votes[true_claim][user][field]
+                    comparison_row[field] = true_vote[field]
                     if field == "time":
                         comparison_row[field] = str(comparison_row[field])
                 except KeyError:
                     comparison_row[field] = -1
 
-            if user not in votes[false_claim] or user not in votes[true_claim]:
+            if not false_vote or not true_vote:
                 print(f"Corrupted vote for user {user}:")
-                if user not in votes[false_claim]:
+                if not false_vote:
                     print(f"\t Not in votes for claim {false_claim} (false)")
-                if user not in votes[true_claim]:
+                if not true_vote:
                     print(f"\t Not in votes for claim {true_claim} (true)")
                 comparison_row["true_evidence_seen"] = -1
                 comparison_row["false_evidence_seen"] = -1
             else:
                 # Evidence used should be consistent across these two votes.
-                true_evidence_seen_1 = votes[true_claim][user][
+                true_evidence_seen_1 = true_vote[
                     "evidence_used"].get(true_claim, -1)
-                false_evidence_seen_1 = votes[false_claim][user][
+                false_evidence_seen_1 = false_vote[
                     "evidence_used"].get(true_claim, -1)
                 assert(true_evidence_seen_1 == false_evidence_seen_1)
-                false_evidence_seen_0 = votes[false_claim][user][
+                false_evidence_seen_0 = false_vote[
                     "evidence_used"].get(false_claim, -1)
-                true_evidence_seen_0 = votes[true_claim][user][
+                true_evidence_seen_0 = true_vote[
                     "evidence_used"].get(false_claim, -1)
                 assert(false_evidence_seen_0 == true_evidence_seen_0)
                 # So we can use from either (we'll use true)
                 comparison_row["true_evidence_seen"] = true_evidence_seen_1
                 comparison_row["false_evidence_seen"] = true_evidence_seen_0
-            comparison_rows.append(comparison_row)
-
-    fields = (
-        list(comparison_row.keys()) +
-        ["true_" + x for x in fields] +
-        ["false_" + x for x in fields])
+            yield comparison_row
 
-    print(f"{len(comparison_rows)} comparison rows with fields {fields}")
 
-    with open(f"{filename}.votes.jsonl", mode='w') as outfile:
+def save_comparisons(comparisons, claims, votes, filename):
+    """Writes the comparisons to CSV as they are built and sorted to JSONL."""
+    count = export_writers.write_jsonl(
         # Sort by who has used evidence (makes it easier to see harder stuff)
-        for ii in sorted(
-            comparison_rows,
+        export_writers.external_sort(
+            export_writers.tee_csv(
+                comparison_rows(comparisons, claims, votes),
+                f"{filename}.votes.csv", kCOMPARISON_FIELDS),
             key=lambda x: x["false_evidence_seen"] + x["true_evidence_seen"],
-            reverse=True,
-        ):
-            outfile.write(json.dumps(ii, sort_keys=True) + '\n')
-
-    with open(f"{filename}.votes.csv", 'w') as outfile:
-        w = DictWriter(outfile, fields)
-        w.writeheader()
-        for ii in comparison_rows:
-            w.writerow(ii)
+            reverse=True),
+        f"{filename}.votes.jsonl")
+    print(f"{count} comparison rows with fields {kCOMPARISON_FIELDS}")
+    return count
 
 
-def get_users(db):
+def users_from(snapshots):
+    """Display names of the users of the snapshots of users/."""
     result = {}
-    for ii in db.collection('users').stream():
+    for ii in snapshots:
         result[ii.reference.id] = ii.to_dict()['displayName']
+    instrumentation.count("firestore_queries")
+    instrumentation.count("firestore_reads", len(result))
     return result
 
 
-def get_comparisons(db):
+@instrumentation.timed("firestore_read")
+def get_users(db):
+    return users_from(db.collection('users').stream())
+
+
+def comparisons_from(snapshots):
+    """Pairs of claims each user saw, from the snapshots of status/."""
     d = defaultdict(dict)
     num_comparisons = 0
-    for ii in db.collection('status').stream():
+    instrumentation.count("firestore_queries")
+    for ii in snapshots:
+        instrumentation.count("firestore_reads")
         user = ii.reference.id
         val = ii.to_dict()
 
@@ -226,64 +328,209 @@ def get_comparisons(db):
     return d
 
 
+@instrumentation.timed("firestore_read")
+def get_comparisons(db):
+    return comparisons_from(db.collection('status').stream())
+
+
 def get_claims(db, categories):
-    claims = {}
-    votes = defaultdict(dict)
-    for ii in db.collection('fibs').stream():
-        key = ii.reference.id
-        claims[key] = ii.to_dict()
-
-    for key in tqdm.tqdm(claims):
-        claims[key]["category"] = categories.get(
-            claims[key]["page"], FLAGS.missing_category)
-
-        num_votes = 0
-        num_likes = 0
-        num_correct = 0
-
-        claims[key]["votes"] = []
-        vote_iterator = db.collection('fibs').document(key).collection("votes")
-        for jj in vote_iterator.stream():
-            num_votes += 1
-            vote = jj.to_dict()
-
-            claims[key]["votes"].append(vote["author"])
-            if vote["success"]:
-                num_correct += 1
-
-            vote = jj.to_dict()
-            voter = vote["author"]
-
-            if voter not in votes[key]:
-                votes[key][voter] = {}
-            votes[key][voter]["points"] = vote["points"]
-            votes[key][voter]["time"] = vote["created"]
-            votes[key][voter]["secondsLeft"] = vote.get("secondsLeft", -1)
-
-            fibs = vote.get("fibs", None)
-            evidence = vote.get("evidenceUsed", -1)
-
-            evidence_used = {}
-            if fibs and evidence:
-                evidence_used[fibs[0]] = evidence[0]
-                evidence_used[fibs[1]] = evidence[1]
-                assert key in fibs, f"key {key} not in fibs {fibs}"
-            votes[key][voter]["evidence_used"] = evidence_used
-
-        claims[key]["likes"] = set()
-        like_iterator = db.collection('fibs').document(key).collection("likes")
-        for jj in like_iterator.stream():
-            num_likes += 1
-            claims[key]["likes"].add(jj.reference.id)
-
-        claims[key]['id'] = key
-        claims[key]['total_votes'] = num_votes
-        claims[key]['total_likes'] = num_likes
-        claims[key]['correct_votes'] = num_correct
+    """Reads claims with their votes and likes."""
+    store = workflow_store.WorkflowStore()
+    store.put_pages(categories)
+    sync_store(db, store)
+    claims, votes = claims_from_store(store)
+    flag_duplicates(claims)
+    return claims, votes
+
+
+def document_queries(db):
+    """Queries of all claims, and of the votes and likes of all claims.
+
+    Votes and likes are read with one collection group query each.
+    """
+    return {
+        "fibs": db.collection('fibs'),
+        "votes": db.collection_group('votes'),
+        "likes": db.collection_group('likes'),
+    }
+
+
+def sync_queries(db, store):
+    """Queries of the claims, votes and likes created since the last sync.
+
+    Claims without creation time, like the ones written by bootstrap, are
+    only read when the store is empty.
+    """
+    queries = document_queries(db)
+    for name, query in queries.items():
+        synced = store.synced(name)
+        if synced is not None:
+            queries[name] = query.where(
+                'created', '>', synced - kSYNC_OVERLAP)
+    return queries
+
+
+def document_key(name, snapshot):
+    """Key of a claim, vote or like in the store, None if not of a claim."""
+    if name == "fibs":
+        return (snapshot.reference.id,)
+    claim = snapshot.reference.parent.parent
+    if claim is None or claim.parent.id != 'fibs':
+        return None
+    return (claim.id, snapshot.reference.id)
+
+
+def put_documents(store, name, snapshots):
+    """Adds the snapshots of a sync query to the store, returns their number.
+    """
+    writers = {
+        "fibs": store.put_claims,
+        "votes": store.put_votes,
+        "likes": store.put_likes,
+    }
+    synced = store.synced(name)
+    num_documents = 0
+    documents = []
+    instrumentation.count("firestore_queries")
+    with instrumentation.phase("firestore_read"):
+        for jj in tqdm.tqdm(snapshots, desc=name):
+            num_documents += 1
+            instrumentation.count("firestore_reads")
+            document = jj.to_dict()
+            key = document_key(name, jj)
+            if key is None:
+                continue
+            documents.append(key + (document,))
+            created = document.get('created')
+            if created and (synced is None or created > synced):
+                synced = created
+    writers[name](documents)
+    if synced is not None:
+        store.set_synced(name, synced)
+    return num_documents
+
+
+def reconcile_store(db, store, interval):
+    """Removes the claims, votes and likes deleted from Firestore.
+
+    Syncs only read documents created since the last one, so every
+    `interval` the keys of all documents are read, without their fields,
+    and the rows of the store without a document are deleted.
+    """
+    now = datetime.datetime.now(datetime.timezone.utc)
+    reconciled = store.synced("reconciled")
+    if reconciled is not None and now - reconciled < interval:
+        return
+    start = time.time()
+    tables = {"fibs": "claims", "votes": "votes", "likes": "likes"}
+    deleted = {}
+    with instrumentation.phase("firestore_reconcile"):
+        for name, query in document_queries(db).items():
+            table = tables[name]
+            instrumentation.count("firestore_queries")
+            keys = []
+            for jj in tqdm.tqdm(query.select([]).stream(), desc=name):
+                instrumentation.count("firestore_reads")
+                key = document_key(name, jj)
+                if key is not None:
+                    keys.append(key)
+            deleted[table] = store.delete_missing(table, keys)
+    store.set_synced("reconciled", now)
+    print(f"Reconciled the store in {time.time() - start:.1f}s, deleted "
+          f"{deleted['claims']} claims, {deleted['votes']} votes and "
+          f"{deleted['likes']} likes")
+
+
+def print_synced(store, num_documents, start):
+    print(
+        f"Read {num_documents} documents in {time.time() - start:.1f}s, "
+        f"store has {store.count('claims')} claims, "
+        f"{store.count('votes')} votes and {store.count('likes')} likes")
+
+
+def sync_store(db, store):
+    """Adds the claims, votes and likes created since the last sync."""
+    start = time.time()
+    num_documents = 0
+    for name, query in sync_queries(db, store).items():
+        num_documents += put_documents(store, name, query.stream())
+    print_synced(store, num_documents, start)
+
+
+def read_firestore_async(db, store, workers=8, retries=5):
+    """Reads users, comparisons, claims, votes and likes concurrently.
+
+    Takes an AsyncClient and fills the store like get_users,
+    get_comparisons and sync_store do.
+    """
+    start = time.time()
+    queries = {
+        "users": db.collection('users'),
+        "status": db.collection('status'),
+        **sync_queries(db, store),
+    }
+    with instrumentation.phase("firestore_async_read"):
+        snapshots = async_reads.read_queries(queries, workers, retries)
+    store.put_users(users_from(snapshots.pop("users")))
+    store.put_comparisons(comparisons_from(snapshots.pop("status")))
+    num_documents = 0
+    for name in list(snapshots):
+        num_documents += put_documents(store, name, snapshots.pop(name))
+    print_synced(store, num_documents, start)
+
+
+def claims_from_store(store):
+    """Builds the claims and votes of the workflow from the store.
+
+    Claims read like dictionaries, with the likes and voters of each claim,
+    and votes like votes[claim][voter], but are backed by columns of ids.
+    """
+    keys = claim_tables.Interner()
+    users = claim_tables.Interner()
+    documents = []
+    for key, document, category in store.claims():
+        keys.intern(key)
+        documents.append((key, document, category))
+    votes = claim_tables.VoteTable.build(store.votes(), keys, users)
+    likes = claim_tables.LikeTable.build(store.likes(), keys, users)
 
+    claims = {}
+    for key, document, category in documents:
+        claims[key] = claim_tables.Claim(
+            key, document, category or FLAGS.missing_category, votes, likes)
     return claims, votes
 
 
+def flag_duplicates(claims, filename=None, rebuild=False):
+    """Sets the oldest claim each claim is a near-duplicate of, or None.
+
+    The index saved in the file is updated with the new claims, unless
+    `rebuild` starts it over.
+    """
+    params = dict(
+        threshold=FLAGS.duplicate_threshold, by_page=FLAGS.duplicates_by_page)
+    if filename and not rebuild:
+        index = near_duplicates.DuplicateIndex.load(filename, **params)
+    else:
+        index = near_duplicates.DuplicateIndex(**params)
+    with instrumentation.phase("duplicates"):
+        added = index.add(near_duplicates.claim_items(claims))
+        duplicate_of = index.duplicate_of()
+    if filename:
+        index.save(filename)
+
+    flagged = 0
+    for key in claims:
+        original = duplicate_of.get(key)
+        if original not in claims:
+            original = None
+        claims[key]["duplicate_of"] = original
+        flagged += original is not None
+    print(f"Added {added} claims to the near-duplicate index, "
+          f"{flagged} claims are near-duplicates")
+    return flagged
+
+
 def cluster_by_category(claims, min_size=8, max_size=64, desired=16):
     # First, cluster by categories
     cat_cluster = defaultdict(list)
@@ -337,63 +584,70 @@ def cluster_check(clusters, min_size, max_size):
     return too_small, too_big
 
 
-def build_pairs(claims):
+def build_pairs(claims, mode="greedy", difficulty=None):
+    """Pairs of claims to vote on, leaving out near-duplicates."""
+    claims = {
+        key: claim for key, claim in claims.items()
+        if not claim.get("duplicate_of")}
     clusters = cluster_by_category(claims)
+    paired = 0
     for ii in sorted(clusters):
-        for jj, kk in build_cluster_pairs(clusters[ii]):
+        for jj, kk in build_cluster_pairs(clusters[ii], mode, difficulty):
+            paired += 2
             yield jj["id"], kk["id"]
+    print(f"Paired {paired} claims, {len(claims) - paired} left unpaired")
 
 
-def build_cluster_pairs(cluster):
+def build_cluster_pairs(cluster, mode="greedy", difficulty=None):
     shuffled_order = list(cluster)
     random.shuffle(shuffled_order)
 
-    true_claims = [x for x in cluster if x["veracity"].lower() == 'true']
-    false_claims = [x for x in cluster if x["veracity"].lower() != 'true']
-
-    max_length = min(len(true_claims), len(false_claims))
+    true_claims = [
+        x for x in shuffled_order if x["veracity"].lower() == 'true']
+    false_claims = [
+        x for x in shuffled_order if x["veracity"].lower() != 'true']
 
-    for ii, jj in zip(true_claims[:max_length], false_claims[:max_length]):
+    for ii, jj in pair_matching.match(
+            true_claims, false_claims, mode, difficulty):
         if random.random() > 0.5:
-            yield ii, jj
+            yield true_claims[ii], false_claims[jj]
         else:
-            yield jj, ii
-
-
-def compute_stats(users, votes, claims, filename, time_offset):
-    stats = defaultdict(Counter)
-    delta = datetime.timedelta(hours=time_offset)
-    for claim in claims.values():
-        author = users.get(claim.get('author'))
-        created = claim.get('created')
-        if author and created:
-            day = (created + delta).isoformat()[:10]
-            stats[(day, author)]['write'] += 1
-    for user_vote in votes.values():
-        for user, vote in user_vote.items():
-            created = vote.get('time')
-            author = users.get(user)
-            result = 'correct' if vote["points"] > 0 else 'incorrect'
-            if author and created:
-                day = (created + delta).isoformat()[:10]
-                stats[(day, author)][f'vote_{result}'] += 1
-    keys = sorted(stats.keys())
-    attrs = ['vote_correct', 'vote_incorrect', 'write']
-    with open(f"{filename}.stats.csv", 'w') as outfile:
-        w = DictWriter(outfile, ['day', 'author'] + attrs)
-        w.writeheader()
-        for key in keys:
-            day, author = key
-            row = dict(day=day, author=author)
-            for attr in attrs:
-                row[attr] = stats[key][attr]
-            w.writerow(row)
+            yield false_claims[jj], true_claims[ii]
+
+
+def compute_stats(
+    store, filename, time_offset, timezone=None, granularities=("day",),
+    dimensions=("author",), incremental=False,
+):
+    """Writes the activity per bucket of time and player, category or page.
+
+    Daily activity per player goes to {filename}.stats.csv, the rest to
+    {filename}.stats.{dimension}.{granularity}.csv.
+    """
+    activity_stats.update_stats(
+        store, time_offset, timezone, granularities, dimensions,
+        FLAGS.missing_category, incremental, kSYNC_OVERLAP)
+    zone = activity_stats.zone_name(time_offset, timezone)
+    attrs = activity_stats.kATTRS
+    for granularity in granularities:
+        for dimension in dimensions:
+            if (granularity, dimension) == ("day", "author"):
+                output = f"{filename}.stats.csv"
+            else:
+                output = f"{filename}.stats.{dimension}.{granularity}.csv"
+            columns = [granularity, dimension] + attrs
+            with open(output, 'w') as outfile:
+                w = DictWriter(outfile, columns)
+                w.writeheader()
+                for row in store.stats(zone, granularity, dimension):
+                    w.writerow(dict(zip(columns, row)))
 
 
 def save_workflow(
     db, workflow_name, claims, pairs, categories, priority, min_author=100,
-    true_probability=0.5,
+    true_probability=0.5, comparisons=None, num_shards=8, workers=8,
 ):
+    """Uploads the tasks, split in shards unless `num_shards` is 0."""
     d = defaultdict(dict)
     banned_pages = set()
     order = 0
@@ -447,41 +701,91 @@ def save_workflow(
         f"Created new workflow {workflow_name} with {num_author} authoring "
         f"tasks and {num_vote} voting tasks.")
     bucket = fibs_firebase_config.get_bucket()
-    blob = bucket.blob(f"workflow/{workflow_name}.json")
-    blob.upload_from_string(
-        json.dumps(d, indent=2, sort_keys=True),
-        content_type='application/json')
-
-
-def get_index_length(db, page):
-    filename = f'pages/{page}.sentences.json'
-    sentences = []
-    if os.path.isfile(filename):
-        with open(filename, 'r') as infile:
-            document = json.loads(infile.read())
-    else:
-        ref = db.collection('pages').document(page).get().to_dict()
-        if ref is None:
-            print('No JSON in index', page)
-            return 0
-        document = json.loads(ref['sentences'])
-        with open(filename, 'w') as f:
-            f.write(ref['sentences'])
-    sentences = document["sentences"]
-    if not sentences:
+    if not num_shards:
+        workflow_shards.upload(bucket, f"workflow/{workflow_name}.json", d)
+        return
+    manifest = workflow_shards.save_shards(
+        bucket, workflow_name, d, claims, comparisons, num_shards, workers)
+    print(
+        f"Uploaded {manifest['shards']} shards of {workflow_name} and the "
+        f"hidden tasks of {manifest['hidden']} players, {manifest['bytes']} "
+        f"bytes compressed.")
+
+
+def sentences_length(sentences):
+    document = json.loads(sentences)
+    if not document["sentences"]:
         return 0
-    return len(sentences)
+    return len(document["sentences"])
+
+
+def fetch_page_lengths(db, pages):
+    """Downloads sentences of pages from Firestore, returns their lengths."""
+    def fetch(batch):
+        lengths = {}
+        refs = [db.collection('pages').document(page) for page in batch]
+        with instrumentation.phase("firestore_read"):
+            snapshots = list(db.get_all(refs))
+        instrumentation.count("firestore_queries")
+        instrumentation.count("firestore_reads", len(refs))
+        for snapshot in snapshots:
+            ref = snapshot.to_dict() if snapshot.exists else None
+            if ref is None:
+                continue
+            page = snapshot.reference.id
+            with open(f'pages/{page}.sentences.json', 'w') as f:
+                f.write(ref['sentences'])
+            lengths[page] = sentences_length(ref['sentences'])
+        return lengths
+
+    batches = [
+        pages[start:start + kPAGES_PER_READ]
+        for start in range(0, len(pages), kPAGES_PER_READ)]
+    lengths = {}
+    with futures.ThreadPoolExecutor(FLAGS.read_workers) as pool:
+        for batch_lengths in pool.map(fetch, batches):
+            lengths.update(batch_lengths)
+    for page in pages:
+        if page not in lengths:
+            print('No JSON in index', page)
+    return lengths
 
 
 def page_lengths(db, pages, priority):
     """
     Read the length of pages.  This is used later to filter short pages.
+
+    Lengths are read from the lengths file, pages whose sentences changed
+    since are parsed again and pages without sentences are read from
+    Firestore.
     """
 
+    # The --lengths flag is defined by page_manifest.
+    cache = page_manifest.read_lengths(FLAGS.lengths)
+    by_page = {}
+    missing = []
+    for page in dict.fromkeys(x for y in pages.values() for x in y):
+        filename = f'pages/{page}.sentences.json'
+        length = page_manifest.cached_length(cache, page, filename)
+        if length is None and os.path.isfile(filename):
+            with open(filename, 'r') as infile:
+                length = sentences_length(infile.read())
+        if length is None:
+            missing.append(page)
+        else:
+            by_page[page] = length
+    by_page.update(fetch_page_lengths(db, missing))
+
+    for page, length in by_page.items():
+        filename = f'pages/{page}.sentences.json'
+        if page_manifest.cached_length(cache, page, filename) is None:
+            cache[page] = page_manifest.length_entry(filename, length)
+    page_manifest.write_lengths(cache, FLAGS.lengths)
+
     lengths = defaultdict(dict)
     for category in pages:
         for page in pages[category]:
-            lengths[category][page] = get_index_length(db, page)
+            lengths[category][page] = by_page.get(page, 0)
             if (lengths[category][page] < FLAGS.min_length):
                 print('Too short', category, page)
     return lengths
@@ -492,7 +796,8 @@ def main(argv):
     db = fibs_firebase_config.initialize_firebase()
     # Read in the subjects we might write claims about
     categories, priority = download_wiki.read_categories()
-    categories = page_lengths(db, categories, priority)
+    with instrumentation.phase("page_lengths"):
+        categories = page_lengths(db, categories, priority)
     flip_categories = {}
     # Lookup for categories given page
     for ii in categories:
@@ -503,38 +808,35 @@ def main(argv):
             # else:
             #    print(length, ii, jj)
 
-    if FLAGS.use_cache:
-        try:
-            with open(f"{FLAGS.name}.comparisons.pkl", "rb") as infile:
-                comparisons = pickle.load(infile)
-            with open(f"{FLAGS.name}.votes.pkl", "rb") as infile:
-                votes = pickle.load(infile)
-            with open(f"{FLAGS.name}.claims.pkl", "rb") as infile:
-                claims = pickle.load(infile)
-            with open(f"{FLAGS.name}.users.pkl", "rb") as infile:
-                users = pickle.load(infile)
-            cache_fail = False
-        except IOError:
-            cache_fail = True
-
-    if not FLAGS.use_cache or cache_fail:
-        users = get_users(db)
-        comparisons = get_comparisons(db)
-        print("Loaded comparisons")
-        # This can be sped up, it gets votes twice
-        claims, votes = get_claims(db, flip_categories)
+    store = workflow_store.WorkflowStore(FLAGS.store)
+    store.put_pages(flip_categories)
+    if FLAGS.full_sync:
+        store.clear()
+    if not FLAGS.use_cache or store.empty():
+        if store.empty():
+            # Everything is read, so there is nothing deleted to remove.
+            store.set_synced(
+                "reconciled", datetime.datetime.now(datetime.timezone.utc))
+        if FLAGS.async_reads:
+            read_firestore_async(
+                fibs_firebase_config.initialize_async_firebase(), store,
+                FLAGS.read_workers, FLAGS.read_retries)
+        else:
+            store.put_users(get_users(db))
+            store.put_comparisons(get_comparisons(db))
+            print("Loaded comparisons")
+            sync_store(db, store)
+        reconcile_store(
+            db, store, datetime.timedelta(hours=FLAGS.reconcile_hours))
         print("Loaded claims and votes")
+    comparisons = store.comparisons()
+    claims, votes = claims_from_store(store)
+    flag_duplicates(claims, FLAGS.duplicates, rebuild=FLAGS.full_sync)
 
-        with open(f"{FLAGS.name}.comparisons.pkl", "wb") as outfile:
-            pickle.dump(comparisons, outfile)
-        with open(f"{FLAGS.name}.votes.pkl", "wb") as outfile:
-            pickle.dump(votes, outfile)
-        with open(f"{FLAGS.name}.claims.pkl", "wb") as outfile:
-            pickle.dump(claims, outfile)
-        with open(f"{FLAGS.name}.users.pkl", "wb") as outfile:
-            pickle.dump(users, outfile)
-
-    compute_stats(users, votes, claims, FLAGS.name, FLAGS.time_offset)
+    with instrumentation.phase("stats"):
+        compute_stats(
+            store, FLAGS.name, FLAGS.time_offset, FLAGS.timezone,
+            FLAGS.stats_granularity, FLAGS.stats_by, FLAGS.incremental_stats)
 
     # We want the number of true and false claims to be balanced
     true_probability = sum(
@@ -542,15 +844,33 @@ def main(argv):
         if x["veracity"].lower() == 'true') / len(claims)
     print(f"Percentage of true claims: {true_probability}")
 
-    pairs = list(build_pairs(claims))
+    difficulty = None
+    if FLAGS.pair_by_difficulty:
+        evidence_used = votes.mean_evidence_used()
+        difficulty = {
+            key: pair_matching.claim_difficulty(
+                claims[key], evidence_used.get(key))
+            for key in claims}
+    with instrumentation.phase("pairing"):
+        pairs = list(build_pairs(claims, FLAGS.pairing, difficulty))
 
     workflow_name = os.path.split(FLAGS.name)[-1]
-    save_workflow(
-        db, workflow_name, claims, pairs, categories, priority,
-        true_probability=true_probability)
-    save_claims(claims, FLAGS.name)
-    save_comparisons(comparisons, claims, votes, FLAGS.name)
+    with instrumentation.phase("upload"):
+        save_workflow(
+            db, workflow_name, claims, pairs, categories, priority,
+            true_probability=true_probability, comparisons=comparisons,
+            num_shards=FLAGS.workflow_shards,
+            workers=FLAGS.shard_upload_workers)
+    evidence = None
+    if FLAGS.link_evidence:
+        with instrumentation.phase("evidence_index"):
+            evidence = evidence_index.EvidenceIndex.build(
+                sorted(glob(os.path.join("pages", "*.sentences.json"))),
+                FLAGS.evidence_cache)
+    with instrumentation.phase("export"):
+        save_claims(claims, FLAGS.name, evidence)
+        save_comparisons(comparisons, claims, votes, FLAGS.name)
 
 
 if __name__ == '__main__':
-    app.run(main)
+    app.run(instrumentation.instrumented(main))
@@ -17,15 +17,57 @@
 import wikipediaapi
 import spacy
 import json
+import time
+import threading
 import tqdm
-from collections import defaultdict
+from collections import defaultdict, Counter
+from concurrent import futures
 from glob import glob
 import os
-import subprocess
 import fibs_firebase_config
+import instrumentation
+import lunr_index
+import page_manifest
 
+from absl import app
+from absl import flags
 
-from typing import Text, Tuple, Mapping, Set, List, Iterable, Any
+from typing import (
+    TYPE_CHECKING, Text, Tuple, Mapping, Set, List, Iterable, Any, Optional,
+    NamedTuple)
+
+if TYPE_CHECKING:
+    from google.cloud import storage
+
+FLAGS = flags.FLAGS
+flags.DEFINE_integer("bulk_pages", 0,
+                     "Number of pages whose sections are sentence split "
+                     "together with nlp.pipe, 0 to process a page at a time")
+flags.DEFINE_integer("batch_size", 64,
+                     "Number of sections per nlp.pipe batch in bulk mode")
+flags.DEFINE_integer("n_process", 1,
+                     "Number of processes used by nlp.pipe in bulk mode")
+flags.DEFINE_boolean("senter", False,
+                     "Split sentences with the senter component instead of "
+                     "the parser, faster but boundaries may differ slightly")
+flags.DEFINE_boolean("pipeline", True,
+                     "Overlap fetching, sentence splitting and uploading of "
+                     "pages, otherwise pages are processed one after another")
+flags.DEFINE_integer("fetch_workers", 8,
+                     "Number of threads fetching pages from Wikipedia")
+flags.DEFINE_integer("extract_workers", os.cpu_count() or 1,
+                     "Number of processes splitting sentences")
+flags.DEFINE_integer("upload_workers", 8,
+                     "Number of threads indexing and uploading pages")
+flags.DEFINE_integer("max_pending", 64,
+                     "Maximum number of pages in flight in the pipeline")
+flags.DEFINE_string("manifest", os.path.join("pages", "manifest.json"),
+                    "Revisions and hashes of the pages ingested so far")
+flags.DEFINE_string("remote_cache", os.path.join("pages", "remote.json"),
+                    "Local copy of the hashes of the blobs in the bucket")
+flags.DEFINE_integer("remote_ttl", 3600,
+                     "Seconds before the blobs in the bucket are listed "
+                     "again, 0 to always list them")
 
 kBAD_SECTIONS = [
     "References", "Further reading", "Further Reading", "Episodes", "Sources",
@@ -37,6 +79,70 @@ kBAD_STARTS = ["(", "'s"]
 kREFER = ["refer to:", "refers to:", 'disambiguation']
 kMAX_LENGTH = 200000
 kMIN_SENT_LENGTH = 30
+# Components of en_core_web_sm that play no role in sentence boundaries.
+kSPLIT_EXCLUDE = ["tagger", "attribute_ruler", "lemmatizer", "ner"]
+
+
+class Section(NamedTuple):
+    """Picklable copy of a WikipediaPageSection."""
+    title: Text
+    text: Text
+    sections: List["Section"]
+
+
+def plain_sections(
+    sections: Iterable[wikipediaapi.WikipediaPageSection],
+) -> List[Section]:
+    return [
+        Section(section.title, section.text, plain_sections(section.sections))
+        for section in sections]
+
+
+def load_nlp(senter: bool = False) -> spacy.Language:
+    """Loads a pipeline with only the components needed to split sentences.
+
+    By default sentence boundaries come from the dependency parser, exactly
+    as with the full pipeline. With `senter` the parser is replaced by the
+    statistical sentence segmenter, which is much faster.
+    """
+    if senter:
+        nlp = spacy.load('en_core_web_sm', exclude=kSPLIT_EXCLUDE + ["parser"])
+        nlp.enable_pipe("senter")
+        return nlp
+    return spacy.load('en_core_web_sm', exclude=kSPLIT_EXCLUDE)
+
+
+def section_texts(
+    sections: Iterable[wikipediaapi.WikipediaPageSection],
+) -> Iterable[Text]:
+    """Texts of all the sections that extract_sections will split."""
+    for section in sections:
+        if section.title in kBAD_SECTIONS:
+            continue
+        yield section.text
+        for text in section_texts(section.sections):
+            yield text
+
+
+@instrumentation.timed("split")
+def split_sentences(
+    nlp: spacy.Language,
+    texts: Iterable[Text],
+    batch_size: int = 64,
+    n_process: int = 1,
+) -> Mapping[Text, List[Text]]:
+    """Splits many texts at once, returns the sentences of each text."""
+    unique_texts = list(dict.fromkeys(texts))
+    instrumentation.count("sections_split", len(unique_texts))
+    docs = nlp.pipe(unique_texts, batch_size=batch_size, n_process=n_process)
+    return {
+        text: list(map(str, doc.sents))
+        for text, doc in zip(unique_texts, docs)}
+
+
+def split_rate(sections: int, seconds: float) -> Text:
+    return (f"Split {sections} sections in {seconds:.1f}s "
+            f"({sections / max(seconds, 1e-6):.1f} sections/sec)")
 
 
 def extract_sections(
@@ -45,12 +151,16 @@ def extract_sections(
     level: Text = '',
     min_sent_length: int = kMIN_SENT_LENGTH,
     max_length: int = kMAX_LENGTH,
+    split: Optional[Mapping[Text, List[Text]]] = None,
 ) -> Iterable[Mapping[Text, Any]]:
     total_length = 0
     for section in sections:
         if section.title in kBAD_SECTIONS:
             continue
-        sents = list(map(str, nlp(section.text).sents))
+        if split is not None and section.text in split:
+            sents = split[section.text]
+        else:
+            sents = list(map(str, nlp(section.text).sents))
         name = f"{level} | {section.title}" if level else section.title
         buffer = ""
         paragraph = False
@@ -80,47 +190,257 @@ def extract_sections(
                 "par": True,
                 "line": buffer,
             }
-        for subsection in extract_sections(nlp, section.sections, name):
+        for subsection in extract_sections(
+                nlp, section.sections, name, split=split):
             yield subsection
 
 
+def sentences_filename(page: Text) -> Text:
+    return os.path.join("pages", f"{page}.sentences.json")
+
+
+@instrumentation.timed("fetch")
+def fetch_sections(
+    wiki: wikipediaapi.Wikipedia,
+    page: Text,
+) -> List[wikipediaapi.WikipediaPageSection]:
+    article = wiki.page(page)
+    summary = wikipediaapi.WikipediaPageSection(
+        wiki=wiki, title='Summary', text=article.summary)
+    instrumentation.count("pages_fetched")
+    return [summary] + article.sections
+
+
+def save_sentences(
+    nlp: spacy.Language,
+    category: Text,
+    page: Text,
+    sections: Iterable[wikipediaapi.WikipediaPageSection],
+    split: Optional[Mapping[Text, List[Text]]] = None,
+) -> int:
+    """Writes the sentences of a page, unless it is a disambiguation page.
+
+    Returns the number of sentences written.
+    """
+    sentences = [
+        dict(id=id, **sentence)
+        for id, sentence in enumerate(
+            extract_sections(nlp, sections, split=split))
+    ]
+    if not sentences:
+        return 0
+    if any(refer in sentences[0]["line"].lower() for refer in kREFER):
+        return 0
+    with open(sentences_filename(page), 'w') as outfile:
+        json.dump(
+            {"category": category, "title": page, "sentences": sentences},
+            outfile, indent=2)
+    return len(sentences)
+
+
+def extract_page(
+    nlp: spacy.Language,
+    category: Text,
+    page: Text,
+    sections: Iterable[wikipediaapi.WikipediaPageSection],
+    split: Optional[Mapping[Text, List[Text]]] = None,
+) -> int:
+    """Writes the sentences and the index of a page.
+
+    Returns the number of sentences, zero if the page was skipped.
+    """
+    with instrumentation.phase("write_sentences"):
+        length = save_sentences(nlp, category, page, sections, split)
+    if length:
+        filename = sentences_filename(page)
+        with instrumentation.phase("index"):
+            lunr_index.write_index(
+                filename, filename.replace(".sentences.", ".index."))
+    return length
+
+
+def needs_fetch(
+    page: Text,
+    manifest: Optional[page_manifest.Manifest] = None,
+    revision: Optional[int] = None,
+) -> bool:
+    """Whether the local sentences of a page are missing or out of date."""
+    filename = sentences_filename(page)
+    if manifest is None:
+        return not os.path.exists(filename)
+    return not manifest.current_locally(page, revision, filename)
+
+
+def needs_extract(
+    page: Text,
+    content: Text,
+    manifest: Optional[page_manifest.Manifest] = None,
+) -> bool:
+    """Whether the fetched content of a page differs from the local one."""
+    if manifest is None:
+        return True
+    return not manifest.extracted(page, content, sentences_filename(page))
+
+
 def process_page(
     nlp: spacy.Language,
     category: Text,
     wiki: wikipediaapi.Wikipedia,
     page: Text,
+    bucket: Optional["storage.Bucket"] = None,
+    manifest: Optional[page_manifest.Manifest] = None,
+    revision: Optional[int] = None,
 ) -> bool:
-    """Fetches a single page and creates index files."""
-    filename = os.path.join("pages", f"{page}.sentences.json")
-    output_filename = filename.replace(".sentences.", ".index.")
-    if not os.path.exists(filename):
-        article = wiki.page(page)
-        summary = wikipediaapi.WikipediaPageSection(
-            wiki=wiki, title='Summary', text=article.summary)
-        sections = [summary] + article.sections
-        sentences = [
-            dict(id=id, **sentence)
-            for id, sentence in enumerate(extract_sections(nlp, sections))
-        ]
-        if any(refer in sentences[0]["line"].lower() for refer in kREFER):
+    """Fetches a single page and creates index files.
+
+    With a `manifest`, pages are only fetched when their `revision` changed,
+    re-extracted when their content changed, and only the blobs whose hash
+    changed are uploaded.
+    """
+    if manifest is not None and manifest.unchanged(page, revision):
+        return False
+    if needs_fetch(page, manifest, revision):
+        sections = fetch_sections(wiki, page)
+        content = page_manifest.content_hash(sections)
+        length = None
+        if needs_extract(page, content, manifest):
+            length = extract_page(nlp, category, page, sections)
+        if manifest is not None:
+            record_page(manifest, page, revision, content, length)
+        if skipped(manifest, page, length):
             return False
-        with open(filename, 'w') as outfile:
-            json.dump(
-                {"category": category, "title": page, "sentences": sentences},
-                outfile, indent=2)
+    return upload_page(page, bucket, manifest)
+
+
+def process_pages(
+    nlp: spacy.Language,
+    category: Text,
+    wiki: wikipediaapi.Wikipedia,
+    pages: Iterable[Text],
+    batch_size: int = 64,
+    n_process: int = 1,
+    bucket: Optional["storage.Bucket"] = None,
+    manifest: Optional[page_manifest.Manifest] = None,
+    revisions: Optional[Mapping[Text, int]] = None,
+) -> int:
+    """Like process_page, but splits the sections of all pages together."""
+    revisions = revisions or {}
+    pages = [
+        x for x in pages
+        if manifest is None or not manifest.unchanged(x, revisions.get(x))]
+    fetched = {
+        page: fetch_sections(wiki, page)
+        for page in pages
+        if needs_fetch(page, manifest, revisions.get(page))}
+    contents = {
+        page: page_manifest.content_hash(sections)
+        for page, sections in fetched.items()}
+    extract = [
+        page for page in fetched
+        if needs_extract(page, contents[page], manifest)]
+    texts = [
+        text for page in extract for text in section_texts(fetched[page])]
+    start = time.time()
+    split = split_sentences(nlp, texts, batch_size, n_process)
+    elapsed = time.time() - start
+    if texts:
+        tqdm.tqdm.write(split_rate(len(texts), elapsed))
+
+    total = 0
+    for page in pages:
+        if page in fetched:
+            length = None
+            if page in extract:
+                length = extract_page(
+                    nlp, category, page, fetched[page], split)
+            if manifest is not None:
+                record_page(
+                    manifest, page, revisions.get(page), contents[page],
+                    length)
+            if skipped(manifest, page, length):
+                continue
+        total += int(upload_page(page, bucket, manifest))
+    return total
+
+
+def skipped(
+    manifest: Optional[page_manifest.Manifest],
+    page: Text,
+    length: Optional[int],
+) -> bool:
+    """Whether a fetched page has no sentences, `length` as in record_page."""
+    if length is not None:
+        return length == 0
+    return not manifest.is_page(page)
+
+
+def record_page(
+    manifest: page_manifest.Manifest,
+    page: Text,
+    revision: Optional[int],
+    content: Text,
+    length: Optional[int],
+):
+    """Records a fetched page, `length` is None if it wasn't extracted."""
+    manifest.update(page, revision=revision, content=content)
+    if length == 0:
+        manifest.update(page, sentences=None, index=None)
+    elif length is not None:
+        manifest.record_length(page, sentences_filename(page), length)
+
+
+def upload_page(
+    page: Text,
+    bucket: Optional["storage.Bucket"] = None,
+    manifest: Optional[page_manifest.Manifest] = None,
+) -> bool:
+    """Indexes a page and uploads it, returns whether it was new.
+
+    Blobs are uploaded minified and gzip-encoded. With a `manifest` blobs
+    are uploaded whenever their hash changed, and pages count as new if any
+    of their blobs was uploaded.
+    """
+    filename = sentences_filename(page)
+    output_filename = filename.replace(".sentences.", ".index.")
     if not os.path.exists(output_filename):
-        command = f'node util/single_index.js "{filename}" "{output_filename}"'
-        subprocess.call(command, shell=True)
+        with instrumentation.phase("index"):
+            lunr_index.write_index(filename, output_filename)
+
+    if bucket is None:
+        bucket = fibs_firebase_config.get_bucket()
+    with instrumentation.phase("upload"):
+        added = _upload_blobs(page, filename, output_filename, bucket, manifest)
+    instrumentation.count("pages_uploaded", int(added))
+    return added
+
+
+def _upload_blobs(
+    page: Text,
+    filename: Text,
+    output_filename: Text,
+    bucket: "storage.Bucket",
+    manifest: Optional[page_manifest.Manifest],
+) -> bool:
+    if manifest is not None:
+        added = manifest.upload(bucket, f"pages/{page}.json", filename)
+        added |= manifest.upload(
+            bucket, f"indices/{page}.json", output_filename)
+        manifest.update(
+            page,
+            sentences=page_manifest.file_hash(filename),
+            index=page_manifest.file_hash(output_filename),
+            sentences_blob=manifest.remote[f"pages/{page}.json"],
+            index_blob=manifest.remote[f"indices/{page}.json"])
+        return added
 
-    bucket = fibs_firebase_config.get_bucket()
     blob = bucket.blob(f"pages/{page}.json")
     if not blob.exists():
-        blob.upload_from_filename(
-            filename,
-            content_type='application/json')
-        bucket.blob(f"indices/{page}.json").upload_from_filename(
-            output_filename,
-            content_type='application/json')
+        for name, source in [
+                (f"pages/{page}.json", filename),
+                (f"indices/{page}.json", output_filename)]:
+            with open(source, "rb") as infile:
+                page_manifest.upload_compressed(
+                    bucket, name, page_manifest.compress_json(infile.read()))
         return True
     return False
 
@@ -143,14 +463,180 @@ def read_categories(
     return pages, priority
 
 
-if __name__ == "__main__":
-    nlp = spacy.load('en_core_web_sm')
+_worker_nlp = None
+
+
+def _init_extract_worker(senter: bool, trace: bool = False):
+    global _worker_nlp
+    # Forked workers start with a copy of the measurements of the parent.
+    instrumentation.reset(trace)
+    _worker_nlp = load_nlp(senter)
+
+
+def _extract_page(
+    category: Text,
+    page: Text,
+    sections: List[Section],
+    batch_size: int,
+) -> Tuple[int, Mapping[Text, Any]]:
+    """Length as in extract_page, and the measurements of the worker."""
+    split = split_sentences(_worker_nlp, section_texts(sections), batch_size)
+    # Indexing is CPU bound too, so it is better done here than in uploads.
+    length = extract_page(_worker_nlp, category, page, sections, split)
+    return length, instrumentation.take()
+
+
+def run_pipeline(
+    wiki: wikipediaapi.Wikipedia,
+    pages: Mapping[Text, List[Text]],
+    bucket: "storage.Bucket",
+    manifest: page_manifest.Manifest,
+    revisions: Mapping[Text, int],
+    fetch_workers: int = 8,
+    extract_workers: int = 1,
+    upload_workers: int = 8,
+    max_pending: int = 64,
+    senter: bool = False,
+    batch_size: int = 64,
+) -> Mapping[Text, int]:
+    """Processes pages with overlapping fetch, extraction and upload stages.
+
+    Wikipedia fetches and uploads run in thread pools and sentence splitting
+    in a process pool. At most `max_pending` pages are in flight at any time,
+    so memory stays bounded however many pages there are.
+
+    Returns the number of pages added for each category.
+    """
+    totals = Counter()
+    # Sections split by the workers and the seconds they took.
+    split = [0, 0.0]
+    lock = threading.Lock()
+    pending = threading.BoundedSemaphore(max_pending)
+    progress = tqdm.tqdm(total=sum(len(x) for x in pages.values()))
+
+    with futures.ThreadPoolExecutor(fetch_workers) as fetchers, \
+            futures.ProcessPoolExecutor(
+                extract_workers, initializer=_init_extract_worker,
+                initargs=(senter, FLAGS.profile == "trace")) as extractors, \
+            futures.ThreadPoolExecutor(upload_workers) as uploaders, \
+            futures.ThreadPoolExecutor(max_pending) as coordinators:
+
+        def fetch(page):
+            sections = plain_sections(fetch_sections(wiki, page))
+            return sections, page_manifest.content_hash(sections)
+
+        def ingest(category, page):
+            revision = revisions.get(page)
+            if manifest.unchanged(page, revision):
+                return False
+            if needs_fetch(page, manifest, revision):
+                sections, content = fetchers.submit(fetch, page).result()
+                length = None
+                if needs_extract(page, content, manifest):
+                    length, recorded = extractors.submit(
+                        _extract_page, category, page, sections, batch_size
+                    ).result()
+                    with lock:
+                        split[0] += recorded["counters"].get(
+                            "sections_split", 0)
+                        split[1] += recorded["phases"].get(
+                            "split", (0, 0.0))[1]
+                    instrumentation.merge(recorded)
+                record_page(manifest, page, revision, content, length)
+                if skipped(manifest, page, length):
+                    return False
+            return uploaders.submit(
+                upload_page, page, bucket, manifest).result()
+
+        def done(category, page, future):
+            try:
+                added = future.result()
+            except Exception as e:
+                tqdm.tqdm.write(f"Failed {page}: {e}")
+                added = False
+            with lock:
+                totals[category] += int(added)
+                progress.update()
+            pending.release()
+
+        for category in pages:
+            for page in pages[category]:
+                pending.acquire()
+                future = coordinators.submit(ingest, category, page)
+                future.add_done_callback(
+                    lambda f, c=category, p=page: done(c, p, f))
+
+    progress.close()
+    if split[0]:
+        # Seconds of all workers, so this is the rate of a single worker.
+        tqdm.tqdm.write(split_rate(*split) + " per worker")
+    return totals
+
+
+def ingest_pages(
+    wiki: wikipediaapi.Wikipedia,
+    pages: Mapping[Text, List[Text]],
+    bucket: "storage.Bucket",
+    manifest: page_manifest.Manifest,
+    revisions: Mapping[Text, int],
+):
+    if FLAGS.pipeline:
+        totals = run_pipeline(
+            wiki, pages, bucket, manifest, revisions, FLAGS.fetch_workers,
+            FLAGS.extract_workers, FLAGS.upload_workers, FLAGS.max_pending,
+            FLAGS.senter, FLAGS.batch_size)
+        for category in pages:
+            print(f"Added {totals[category]} pages for {category}.")
+        return
+
+    nlp = load_nlp(FLAGS.senter)
+    for category in pages:
+        if FLAGS.bulk_pages > 0:
+            chunks = [
+                pages[category][start:start + FLAGS.bulk_pages]
+                for start in range(0, len(pages[category]), FLAGS.bulk_pages)]
+            total = sum(
+                process_pages(
+                    nlp, category, wiki, chunk,
+                    FLAGS.batch_size, FLAGS.n_process, bucket, manifest,
+                    revisions)
+                for chunk in tqdm.tqdm(chunks, desc=category))
+        else:
+            total = sum(
+                int(process_page(
+                    nlp, category, wiki, page, bucket, manifest,
+                    revisions.get(page)))
+                for page in tqdm.tqdm(pages[category], desc=category))
+        print(f"Added {total} pages for {category}.")
+
+
+def main(argv):
     wiki = wikipediaapi.Wikipedia('en')
     pages, _ = read_categories()
     os.makedirs("pages", exist_ok=True)
+    bucket = fibs_firebase_config.get_bucket()
+    with instrumentation.phase("manifest"):
+        manifest = page_manifest.Manifest.load(
+            bucket, FLAGS.manifest, FLAGS.remote_cache, FLAGS.remote_ttl,
+            FLAGS.lengths)
+    with instrumentation.phase("revisions"):
+        revisions = page_manifest.fetch_revisions(
+            page for category in pages for page in pages[category])
+    try:
+        with instrumentation.phase("ingest"):
+            ingest_pages(wiki, pages, bucket, manifest, revisions)
+    finally:
+        with instrumentation.phase("manifest"):
+            manifest.save(bucket, FLAGS.manifest, FLAGS.lengths)
+        # Blobs uploaded by this run are known to be in the bucket as well.
+        if FLAGS.remote_cache and FLAGS.remote_ttl > 0:
+            manifest.save_remote(FLAGS.remote_cache)
+        stats = fibs_firebase_config.get_stats()
+        print(
+            f"{stats['requests']} Storage requests, "
+            f"{stats['bytes_sent']} bytes sent, "
+            f"{stats['bytes_received']} bytes received.")
 
-    for category in pages:
-        total = sum(
-            int(process_page(nlp, category, wiki, page))
-            for page in tqdm.tqdm(pages[category], desc=category))
-        print(f"Added {total} pages for {category}.")
+
+if __name__ == "__main__":
+    app.run(instrumentation.instrumented(main))
@@ -0,0 +1,252 @@
+# coding=utf-8
+# Copyright 2019 Google LLC.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# Lint as: python3
+
+# Links the evidence of claims to the sentences of their page. Evidence is
+# looked up by a hash of its normalized text among the sentences of the page,
+# then by the character n-grams it shares with them, since pages can change
+# when they are downloaded again. Evidence that matches no sentence is
+# written to a report.
+
+import hashlib
+import json
+import os
+import re
+import tqdm
+
+from collections import Counter
+from csv import DictWriter
+from typing import (
+    Text, Mapping, Dict, List, Iterable, Iterator, Any, Optional, Set, Tuple)
+
+kNON_WORD = re.compile(r"[\W_]+")
+# Characters of the n-grams of the fuzzy lookup.
+kNGRAM = 3
+# Share of the n-grams of the shorter of evidence and a sentence that the
+# other one has, above which the sentence matches. Sentences are split
+# differently when a page is extracted again, so evidence can be part of a
+# sentence or span several.
+kMIN_OVERLAP = 0.8
+# Changes whenever cached sentences or hashes would no longer be valid.
+kCACHE_VERSION = 1
+kEVIDENCE = ["gold_evidence", "retrieved_evidence"]
+kREPORT_FIELDS = ["claim", "page", "evidence", "section_header", "text",
+                  "reason"]
+
+
+def normalize(text: Text) -> Text:
+    return kNON_WORD.sub(" ", text.lower()).strip()
+
+
+def text_hash(text: Text) -> int:
+    """64-bit hash of the normalized text."""
+    digest = hashlib.blake2b(
+        normalize(text).encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "little")
+
+
+def file_stamp(filename: Text) -> List[int]:
+    """Modification time and size, like page_manifest.file_stamp."""
+    stat = os.stat(filename)
+    return [stat.st_mtime_ns, stat.st_size]
+
+
+def read_sentences(filename: Text) -> Tuple[Text, List[List[Any]]]:
+    """Title and (id, name, line, hash) of the sentences of a page file."""
+    with open(filename) as infile:
+        document = json.load(infile)
+    return document["title"], [
+        [x["id"], x["name"], x["line"], text_hash(x["line"])]
+        for x in document["sentences"]]
+
+
+def read_cache(filename: Optional[Text]) -> Dict[Text, Any]:
+    """Pages of a saved index by file, empty if there is none to reuse."""
+    if not filename or not os.path.exists(filename):
+        return {}
+    with open(filename) as infile:
+        cache = json.load(infile)
+    if cache.get("version") != kCACHE_VERSION:
+        return {}
+    return cache["files"]
+
+
+def write_cache(filename: Text, files: Mapping[Text, Any]):
+    temporary = f"{filename}.tmp"
+    with open(temporary, "w") as outfile:
+        json.dump({"version": kCACHE_VERSION, "files": files}, outfile)
+    os.replace(temporary, filename)
+
+
+def ngrams(text: Text) -> Set[Text]:
+    padded = f" {normalize(text)} "
+    return {
+        padded[ii:ii + kNGRAM]
+        for ii in range(max(len(padded) - kNGRAM + 1, 1))}
+
+
+class EvidenceIndex(object):
+    """Sentence ids of each page by the hash of their text.
+
+    The n-grams of the sentences of a page are only indexed the first time
+    evidence of the page has no exact match.
+    """
+
+    def __init__(self):
+        self._exact = {}
+        self._sentences = {}
+        self._ngrams = {}
+
+    def __contains__(self, page: Text) -> bool:
+        return page in self._sentences
+
+    def __len__(self) -> int:
+        return len(self._sentences)
+
+    def add_page(self, page: Text, sentences: List[Mapping[Text, Any]]):
+        self.add_hashed(page, [
+            (x["id"], x["name"], x["line"], text_hash(x["line"]))
+            for x in sentences])
+
+    def add_hashed(self, page: Text, sentences: Iterable[Tuple[Any, ...]]):
+        """Adds (id, name, line, hash) of the sentences of a page."""
+        self._sentences[page] = []
+        exact = {}
+        for sentence_id, name, line, line_hash in sentences:
+            self._sentences[page].append((sentence_id, name, line))
+            exact.setdefault(line_hash, []).append(sentence_id)
+        self._exact[page] = exact
+        self._ngrams.pop(page, None)
+
+    @classmethod
+    def build(
+        cls,
+        filenames: Iterable[Text],
+        cache: Optional[Text] = None,
+    ) -> "EvidenceIndex":
+        """Index of the sentences files written by download_wiki.
+
+        With a cache file, only the files whose stamp changed since it was
+        written are read again, and the cache is updated.
+        """
+        cached = read_cache(cache)
+        files = {}
+        read = 0
+        for filename in tqdm.tqdm(filenames, desc="evidence index"):
+            stamp = file_stamp(filename)
+            entry = cached.get(filename)
+            if entry is None or entry["stamp"] != stamp:
+                title, sentences = read_sentences(filename)
+                entry = {"stamp": stamp, "title": title,
+                         "sentences": sentences}
+                read += 1
+            files[filename] = entry
+        index = cls()
+        for entry in files.values():
+            index.add_hashed(entry["title"], entry["sentences"])
+        if cache and (read or len(files) != len(cached)):
+            write_cache(cache, files)
+        print(f"Evidence index of {len(files)} pages, {read} read again")
+        return index
+
+    def _names(self, page: Text) -> Dict[int, Text]:
+        return {x: y for x, y, _ in self._sentences[page]}
+
+    def _page_ngrams(
+        self,
+        page: Text,
+    ) -> Tuple[Dict[Text, List[int]], List[int]]:
+        if page not in self._ngrams:
+            postings = {}
+            sizes = []
+            for ii, (_, _, line) in enumerate(self._sentences[page]):
+                grams = ngrams(line)
+                sizes.append(len(grams))
+                for gram in grams:
+                    postings.setdefault(gram, []).append(ii)
+            self._ngrams[page] = (postings, sizes)
+        return self._ngrams[page]
+
+    def lookup(
+        self,
+        page: Text,
+        text: Text,
+        section_header: Optional[Text] = None,
+    ) -> Tuple[Optional[int], Text]:
+        """Sentence id of the evidence and how it matched.
+
+        Matches are "exact" or "fuzzy", or the reason there is none,
+        "no_page" or "no_match". Sentences of the same section win ties.
+        """
+        if page not in self._sentences:
+            return None, "no_page"
+        exact = self._exact[page].get(text_hash(text))
+        if exact:
+            names = self._names(page) if len(exact) > 1 else {}
+            same = [x for x in exact if names.get(x) == section_header]
+            return (same or exact)[0], "exact"
+
+        postings, sizes = self._page_ngrams(page)
+        grams = ngrams(text)
+        shared = Counter(
+            ii for gram in grams for ii in postings.get(gram, ()))
+        best = None
+        for ii, count in shared.items():
+            sentence_id, name, _ = self._sentences[page][ii]
+            # Ties go to the same section, the longest overlap and then the
+            # first sentence.
+            score = (count / min(len(grams), sizes[ii]),
+                     name == section_header, count, -ii)
+            if score[0] >= kMIN_OVERLAP and (
+                    best is None or score > best[0]):
+                best = (score, sentence_id)
+        if best is None:
+            return None, "no_match"
+        return best[1], "fuzzy"
+
+
+def link_evidence(
+    records: Iterable[Dict[Text, Any]],
+    index: EvidenceIndex,
+    report_filename: Text,
+) -> Iterator[Dict[Text, Any]]:
+    """Adds the page and sentence_id of the evidence of claim records.
+
+    Records pass through one at a time, evidence that matches no sentence
+    gets a None sentence_id and a row in the report.
+    """
+    matches = Counter()
+    with open(report_filename, mode='w') as outfile:
+        report = DictWriter(outfile, kREPORT_FIELDS)
+        report.writeheader()
+        for record in records:
+            page = record.get("page", "")
+            for field in kEVIDENCE:
+                for evidence in record.get(field, []):
+                    sentence_id, match = index.lookup(
+                        page, evidence["text"], evidence["section_header"])
+                    evidence["page"] = page
+                    evidence["sentence_id"] = sentence_id
+                    matches[match] += 1
+                    if sentence_id is None:
+                        report.writerow({
+                            "claim": record["id"], "page": page,
+                            "evidence": field,
+                            "section_header": evidence["section_header"],
+                            "text": evidence["text"], "reason": match})
+            yield record
+    print(f"Linked evidence to sentences: {matches['exact']} exact, "
+          f"{matches['fuzzy']} fuzzy, {matches['no_match']} unmatched and "
+          f"{matches['no_page']} on pages without sentences")
@@ -0,0 +1,123 @@
+# coding=utf-8
+# Copyright 2019 Google LLC.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# Lint as: python3
+
+import json
+import os
+
+import evidence_index
+
+kDEV = os.path.join(os.path.dirname(__file__), "..", "dataset", "dev.jsonl")
+kCLAIM = "01EICaMMy6uOPHdoEGAf"
+
+
+def dataset_page():
+    """A claim of the dev set and the evidence lines of its page, in order."""
+    with open(kDEV) as infile:
+        claims = [json.loads(x) for x in infile]
+    claim = next(x for x in claims if x["id"] == kCLAIM)
+    lines = {}
+    for other in claims:
+        if other["wikipedia_page"] != claim["wikipedia_page"]:
+            continue
+        for field in evidence_index.kEVIDENCE:
+            for evidence in other[field]:
+                lines.setdefault(evidence["text"], evidence["section_header"])
+    return claim, list(lines.items())
+
+
+def sentences(lines):
+    return [dict(id=ii, name=name, line=line)
+            for ii, (line, name) in enumerate(lines)]
+
+
+def resolve(index, claim):
+    return [
+        index.lookup(claim["wikipedia_page"], x["text"], x["section_header"])
+        for x in claim["gold_evidence"]]
+
+
+def test_gold_evidence_of_real_claim_resolves():
+    claim, lines = dataset_page()
+    index = evidence_index.EvidenceIndex()
+    index.add_page(claim["wikipedia_page"], sentences(lines))
+    gold = [x["text"] for x in claim["gold_evidence"]]
+    assert resolve(index, claim) == [
+        ([x for x, _ in lines].index(x), "exact") for x in gold]
+
+
+def test_gold_evidence_resolves_when_page_is_split_differently():
+    claim, lines = dataset_page()
+    gold = claim["gold_evidence"][0]
+    position = [x for x, _ in lines].index(gold["text"])
+    # Extracted again, the gold sentence is merged with the next one.
+    merged = (f"{lines[position][0]} {lines[position + 1][0]}",
+              gold["section_header"])
+    page = lines[:position] + [merged] + lines[position + 2:]
+    index = evidence_index.EvidenceIndex()
+    index.add_page(claim["wikipedia_page"], sentences(page))
+    assert resolve(index, claim)[0] == (position, "fuzzy")
+
+    # Or split in two.
+    first, second = gold["text"].split(" and ", 1)
+    page = (lines[:position] + [(first, gold["section_header"]),
+                                (f"and {second}", gold["section_header"])] +
+            lines[position + 1:])
+    index = evidence_index.EvidenceIndex()
+    index.add_page(claim["wikipedia_page"], sentences(page))
+    assert resolve(index, claim)[0] == (position, "fuzzy")
+
+
+def test_unrelated_evidence_does_not_match():
+    claim, lines = dataset_page()
+    index = evidence_index.EvidenceIndex()
+    index.add_page(claim["wikipedia_page"], sentences(lines))
+    assert index.lookup(
+        claim["wikipedia_page"],
+        "The weather in Reykjavik was unusually mild that winter.") == (
+            None, "no_match")
+    assert index.lookup("No such page", lines[0][0]) == (None, "no_page")
+
+
+def write_page(directory, title, lines):
+    filename = os.path.join(directory, f"{title}.sentences.json")
+    with open(filename, "w") as outfile:
+        json.dump({"category": "Test", "title": title,
+                   "sentences": sentences(lines)}, outfile)
+    return filename
+
+
+def test_cache_only_reads_changed_pages(tmp_path, monkeypatch):
+    _, lines = dataset_page()
+    directory, cache = str(tmp_path), str(tmp_path / "evidence_index.json")
+    filenames = [write_page(directory, "A", lines[:2]),
+                 write_page(directory, "B", lines[2:4])]
+    evidence_index.EvidenceIndex.build(filenames, cache)
+
+    read = []
+    read_sentences = evidence_index.read_sentences
+    monkeypatch.setattr(
+        evidence_index, "read_sentences",
+        lambda x: read.append(x) or read_sentences(x))
+    index = evidence_index.EvidenceIndex.build(filenames, cache)
+    assert read == []
+    assert index.lookup("A", lines[1][0]) == (1, "exact")
+
+    write_page(directory, "B", lines[4:6])
+    os.utime(filenames[1], ns=(0, 0))
+    index = evidence_index.EvidenceIndex.build(filenames, cache)
+    assert read == [filenames[1]]
+    assert index.lookup("B", lines[5][0]) == (1, "exact")
+    assert index.lookup("A", lines[1][0]) == (1, "exact")
@@ -0,0 +1,103 @@
+# coding=utf-8
+# Copyright 2019 Google LLC.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# Lint as: python3
+
+# Writers for the exports of create_workflow. Records flow through them one
+# at a time, so exports never hold more than a bounded number of records.
+
+import heapq
+import json
+import os
+import tempfile
+
+from csv import DictWriter
+from typing import (
+    Text, Mapping, List, Iterable, Iterator, Any, Callable)
+
+# Records sorted in memory before they are spilled to a temporary file.
+kSORT_BUFFER = 100000
+
+
+def tee_csv(
+    records: Iterable[Mapping[Text, Any]],
+    filename: Text,
+    fields: List[Text],
+) -> Iterator[Mapping[Text, Any]]:
+    """Writes the records to a CSV file as they pass through.
+
+    Columns are the declared fields, other fields of the records are left
+    out of the CSV.
+    """
+    with open(filename, mode='w') as outfile:
+        w = DictWriter(outfile, fields, extrasaction='ignore')
+        w.writeheader()
+        for record in records:
+            w.writerow(record)
+            yield record
+
+
+def write_jsonl(
+    records: Iterable[Mapping[Text, Any]],
+    filename: Text,
+) -> int:
+    """Writes one record per line, returns the number of records."""
+    count = 0
+    with open(filename, mode='w') as outfile:
+        for record in records:
+            outfile.write(json.dumps(record, sort_keys=True) + '\n')
+            count += 1
+    return count
+
+
+def _read_run(filename: Text) -> Iterator[Any]:
+    with open(filename) as infile:
+        for line in infile:
+            yield json.loads(line)
+
+
+def external_sort(
+    records: Iterable[Any],
+    key: Callable[[Any], Any],
+    reverse: bool = False,
+    buffer_size: int = kSORT_BUFFER,
+) -> Iterator[Any]:
+    """Sorts records that may not fit in memory, like a stable sorted().
+
+    Records are sorted in runs of `buffer_size` that are spilled to
+    temporary JSON lines files, then merged. Records must round-trip
+    through JSON.
+    """
+    buffer = []
+    with tempfile.TemporaryDirectory() as tmp:
+        runs = []
+
+        def spill():
+            filename = os.path.join(tmp, f"{len(runs)}.jsonl")
+            write_jsonl(sorted(buffer, key=key, reverse=reverse), filename)
+            runs.append(filename)
+            buffer.clear()
+
+        for record in records:
+            buffer.append(record)
+            if len(buffer) >= buffer_size:
+                spill()
+        if not runs:
+            yield from sorted(buffer, key=key, reverse=reverse)
+            return
+        if buffer:
+            spill()
+        # Ties are taken from earlier runs first, which keeps the sort stable.
+        yield from heapq.merge(
+            *[_read_run(x) for x in runs], key=key, reverse=reverse)
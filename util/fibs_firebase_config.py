@@ -14,22 +14,130 @@
 # limitations under the License.
 # Lint as: python3
 
-from google.cloud import firestore
-from google.cloud import storage
+# Firestore and Storage clients shared by the whole process. The Google Cloud
+# libraries are only imported, and the config only read, when first needed.
+
 import json
 import os
+import threading
+
+from typing import Text, Mapping, Dict, Any
+
+from absl import flags
+
+FLAGS = flags.FLAGS
+flags.DEFINE_integer("http_pool_size", 32,
+                     "Maximum number of connections kept open to Storage")
 
 config_file = os.path.join('board', 'src', 'config', 'firebase.json')
-with open(config_file) as f:
-    config = json.load(f)
-    project_id = config['projectId']
-    bucket = config['storageBucket']
+
+_lock = threading.Lock()
+_config = None
+_clients = {}
+_stats = {"requests": 0, "bytes_sent": 0, "bytes_received": 0}
+
+
+def get_config() -> Mapping[Text, Any]:
+    global _config
+    with _lock:
+        if _config is None:
+            with open(config_file) as f:
+                _config = json.load(f)
+        return _config
+
+
+def __getattr__(name):
+    # project_id and bucket used to be read when the module was imported.
+    if name == 'project_id':
+        return get_config()['projectId']
+    if name == 'bucket':
+        return get_config()['storageBucket']
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def _pool_size() -> int:
+    if FLAGS.is_parsed():
+        return FLAGS.http_pool_size
+    return FLAGS['http_pool_size'].default
+
+
+def _count(response, *args, **kwargs):
+    """Response hook counting the requests made and the bytes transferred."""
+    body = response.request.body
+    sent = len(body) if isinstance(body, (bytes, str)) else 0
+    received = int(response.headers.get('Content-Length', 0))
+    with _lock:
+        _stats["requests"] += 1
+        _stats["bytes_sent"] += sent
+        _stats["bytes_received"] += received
+
+
+def _session(scopes):
+    """Authorized session over a connection pool shared by all threads."""
+    import google.auth
+    import requests
+    from google.auth.transport.requests import AuthorizedSession
+
+    credentials, _ = google.auth.default(scopes=scopes)
+    session = AuthorizedSession(credentials)
+    size = _pool_size()
+    adapter = requests.adapters.HTTPAdapter(
+        pool_connections=size, pool_maxsize=size)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    session.hooks['response'].append(_count)
+    return session
+
+
+def _cached(name, create):
+    with _lock:
+        if name in _clients:
+            return _clients[name]
+    client = create()
+    with _lock:
+        return _clients.setdefault(name, client)
+
 
 def initialize_firebase():
-    return firestore.Client(project_id)
+    # Firestore talks gRPC, whose channel is already shared by all threads.
+    def create():
+        from google.cloud import firestore
+        return firestore.Client(get_config()['projectId'])
+    return _cached('firestore', create)
+
+
+def initialize_async_firebase():
+    def create():
+        from google.cloud import firestore
+        return firestore.AsyncClient(get_config()['projectId'])
+    return _cached('async_firestore', create)
+
 
 def initialize_storage():
-    return storage.Client(project_id)
+    def create():
+        from google.cloud import storage
+        return storage.Client(
+            get_config()['projectId'], _http=_session(storage.Client.SCOPE))
+    return _cached('storage', create)
+
 
 def get_bucket():
-    return initialize_storage().bucket(bucket)
+    return _cached(
+        'bucket',
+        lambda: initialize_storage().bucket(get_config()['storageBucket']))
+
+
+def use_clients(firestore=None, bucket=None, async_firestore=None):
+    """Replaces the clients, with local_backends for instance."""
+    with _lock:
+        for name, client in [
+                ('firestore', firestore), ('bucket', bucket),
+                ('async_firestore', async_firestore)]:
+            if client is not None:
+                _clients[name] = client
+
+
+def get_stats() -> Dict[Text, int]:
+    """Storage requests made so far and the bytes sent and received."""
+    with _lock:
+        return dict(_stats)
@@ -0,0 +1,234 @@
+# coding=utf-8
+# Copyright 2019 Google LLC.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# Lint as: python3
+
+# Columnar copy of the dataset splits. Each split is converted once into
+# NumPy arrays, strings as UTF-8 buffers with offsets and evidence as ragged
+# columns, which are then memory-mapped so loading a split is instant.
+# Run to convert all the splits in dataset/.
+
+import json
+import os
+import numpy as np
+
+from glob import glob
+from typing import (
+    Text, Dict, List, Iterable, Iterator, Any, Optional, Tuple)
+
+from absl import app
+from absl import flags
+
+FLAGS = flags.FLAGS
+flags.DEFINE_string("dataset_dir", "dataset",
+                    "Directory of the JSONL splits")
+flags.DEFINE_string("columns_dir", os.path.join("dataset", "columns"),
+                    "Directory of the converted splits")
+
+kLABELS = ["REFUTES", "SUPPORTS"]
+kSTRINGS = ["id", "text", "wikipedia_page"]
+kCOUNTS = ["correct_votes", "total_votes", "total_likes"]
+kEVIDENCE = ["gold_evidence", "retrieved_evidence"]
+kEVIDENCE_FIELDS = ["section_header", "text"]
+
+
+def pack_strings(strings: Iterable[Text]) -> Tuple[np.ndarray, np.ndarray]:
+    """UTF-8 buffer of the strings and the offset of each one in it."""
+    encoded = [x.encode("utf-8") for x in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(x) for x in encoded], out=offsets[1:])
+    return np.frombuffer(b"".join(encoded), dtype=np.uint8), offsets
+
+
+class StringColumn(object):
+    """Strings stored back to back in a buffer, decoded when accessed."""
+
+    def __init__(self, buffer: np.ndarray, offsets: np.ndarray):
+        self.buffer = buffer
+        self.offsets = offsets
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, ii: int) -> Text:
+        start, end = self.offsets[ii], self.offsets[ii + 1]
+        return self.buffer[start:end].tobytes().decode("utf-8")
+
+
+def _source_stamp(filename: Text) -> List[int]:
+    stat = os.stat(filename)
+    return [stat.st_mtime_ns, stat.st_size]
+
+
+def _save(directory: Text, name: Text, array: np.ndarray):
+    np.save(os.path.join(directory, f"{name}.npy"), array)
+
+
+def convert(filename: Text, directory: Text):
+    """Writes the columns of a JSONL split to a directory."""
+    columns = {x: [] for x in kSTRINGS + kCOUNTS + ["label", "category"]}
+    evidence = {x: {"length": [], **{y: [] for y in kEVIDENCE_FIELDS}}
+                for x in kEVIDENCE}
+    with open(filename) as infile:
+        for line in infile:
+            claim = json.loads(line)
+            for name in kSTRINGS + kCOUNTS + ["category"]:
+                columns[name].append(claim[name])
+            columns["label"].append(kLABELS.index(claim["label"]))
+            for name in kEVIDENCE:
+                evidence[name]["length"].append(len(claim[name]))
+                for field in kEVIDENCE_FIELDS:
+                    evidence[name][field].extend(x[field] for x in claim[name])
+
+    os.makedirs(directory, exist_ok=True)
+    for name in kSTRINGS:
+        buffer, offsets = pack_strings(columns[name])
+        _save(directory, name, buffer)
+        _save(directory, f"{name}.offsets", offsets)
+    for name in kCOUNTS:
+        _save(directory, name, np.array(columns[name], dtype=np.int32))
+    _save(directory, "label", np.array(columns["label"], dtype=np.int8))
+    categories = sorted(set(columns["category"]))
+    _save(directory, "category", np.array(
+        [categories.index(x) for x in columns["category"]], dtype=np.int16))
+    for name in kEVIDENCE:
+        offsets = np.zeros(len(evidence[name]["length"]) + 1, dtype=np.int64)
+        np.cumsum(evidence[name]["length"], out=offsets[1:])
+        _save(directory, f"{name}.offsets", offsets)
+        for field in kEVIDENCE_FIELDS:
+            buffer, field_offsets = pack_strings(evidence[name][field])
+            _save(directory, f"{name}.{field}", buffer)
+            _save(directory, f"{name}.{field}.offsets", field_offsets)
+
+    # Written last, a split without metadata is converted again.
+    with open(os.path.join(directory, "meta.json"), "w") as outfile:
+        json.dump({
+            "size": len(columns["label"]),
+            "labels": kLABELS,
+            "categories": categories,
+            "source": _source_stamp(filename),
+        }, outfile)
+
+
+class Split(object):
+    """Claims of a converted split, with memory-mapped columns.
+
+    Claims are returned as the same dictionaries as in the JSONL files.
+    Numeric columns, like `label` and `category`, can be used directly as
+    NumPy arrays.
+    """
+
+    def __init__(self, directory: Text):
+        with open(os.path.join(directory, "meta.json")) as infile:
+            self.meta = json.load(infile)
+        self.labels = self.meta["labels"]
+        self.categories = self.meta["categories"]
+
+        def load(name):
+            return np.load(
+                os.path.join(directory, f"{name}.npy"), mmap_mode="r")
+
+        self.strings = {
+            x: StringColumn(load(x), load(f"{x}.offsets")) for x in kSTRINGS}
+        self.counts = {x: load(x) for x in kCOUNTS}
+        self.label = load("label")
+        self.category = load("category")
+        self.evidence = {
+            x: (load(f"{x}.offsets"), {
+                y: StringColumn(load(f"{x}.{y}"), load(f"{x}.{y}.offsets"))
+                for y in kEVIDENCE_FIELDS})
+            for x in kEVIDENCE}
+
+    def __len__(self) -> int:
+        return self.meta["size"]
+
+    def __getitem__(self, ii: int) -> Dict[Text, Any]:
+        if ii < 0:
+            ii += len(self)
+        if not 0 <= ii < len(self):
+            raise IndexError(ii)
+        claim = {
+            "category": self.categories[self.category[ii]],
+            "label": self.labels[self.label[ii]],
+        }
+        for name in kSTRINGS:
+            claim[name] = self.strings[name][ii]
+        for name in kCOUNTS:
+            claim[name] = int(self.counts[name][ii])
+        for name in kEVIDENCE:
+            claim[name] = self.evidence_of(name, ii)
+        return dict(sorted(claim.items()))
+
+    def __iter__(self) -> Iterator[Dict[Text, Any]]:
+        for ii in range(len(self)):
+            yield self[ii]
+
+    def evidence_of(self, name: Text, ii: int) -> List[Dict[Text, Text]]:
+        offsets, fields = self.evidence[name]
+        return [
+            {field: fields[field][jj] for field in kEVIDENCE_FIELDS}
+            for jj in range(offsets[ii], offsets[ii + 1])]
+
+    def where(
+        self,
+        category: Optional[Text] = None,
+        label: Optional[Text] = None,
+    ) -> np.ndarray:
+        """Indices of the claims in a category and with a label."""
+        mask = np.ones(len(self), dtype=bool)
+        if category is not None:
+            if category not in self.categories:
+                return np.zeros(0, dtype=np.int64)
+            mask &= self.category == self.categories.index(category)
+        if label is not None:
+            mask &= self.label == self.labels.index(label)
+        return np.flatnonzero(mask)
+
+    def filter(
+        self,
+        category: Optional[Text] = None,
+        label: Optional[Text] = None,
+    ) -> Iterator[Dict[Text, Any]]:
+        """Claims in a category and with a label, read one at a time."""
+        for ii in self.where(category, label):
+            yield self[ii]
+
+
+def load_split(
+    split: Text,
+    dataset_dir: Text = "dataset",
+    columns_dir: Text = os.path.join("dataset", "columns"),
+) -> Split:
+    """Columns of a split, converting it if the JSONL file changed."""
+    filename = os.path.join(dataset_dir, f"{split}.jsonl")
+    directory = os.path.join(columns_dir, split)
+    meta = os.path.join(directory, "meta.json")
+    if os.path.exists(meta):
+        with open(meta) as infile:
+            source = json.load(infile)["source"]
+        if not os.path.exists(filename) or source == _source_stamp(filename):
+            return Split(directory)
+    convert(filename, directory)
+    return Split(directory)
+
+
+def main(argv):
+    for filename in sorted(glob(os.path.join(FLAGS.dataset_dir, "*.jsonl"))):
+        split = os.path.basename(filename)[:-len(".jsonl")]
+        claims = load_split(split, FLAGS.dataset_dir, FLAGS.columns_dir)
+        print(f"{split}: {len(claims)} claims")
+
+
+if __name__ == "__main__":
+    app.run(main)
@@ -0,0 +1,188 @@
+# coding=utf-8
+# Copyright 2019 Google LLC.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# Lint as: python3
+
+# Timers and counters of the phases of the util/ scripts, like fetching,
+# sentence splitting or Firestore reads. Phases can run in any thread. Each
+# run appends a JSON summary to --run_log, and --profile also writes a
+# cProfile dump or a Chrome trace (chrome://tracing) of the phases.
+
+import cProfile
+import contextlib
+import datetime
+import functools
+import json
+import os
+import sys
+import threading
+import time
+
+from typing import Text, Dict, List, Any, Callable, Iterator
+
+from absl import flags
+
+import fibs_firebase_config
+
+FLAGS = flags.FLAGS
+flags.DEFINE_enum("profile", None, ["cprofile", "trace"],
+                  "Write a cProfile dump of the main thread, or a Chrome "
+                  "trace of the phases of all threads")
+flags.DEFINE_string("profile_output", os.path.join("logs", "profile"),
+                    "Prefix of the profile, .pstats or .trace.json is added")
+flags.DEFINE_string("run_log", os.path.join("logs", "runs.jsonl"),
+                    "File the JSON summary of each run is appended to, "
+                    "empty to only print it")
+
+_lock = threading.Lock()
+# Calls and seconds of each phase.
+_phases = {}
+_counters = {}
+# Trace events, only kept when tracing.
+_events = None
+
+
+def reset(trace: bool = False):
+    global _events
+    with _lock:
+        _phases.clear()
+        _counters.clear()
+        _events = [] if trace else None
+
+
+@contextlib.contextmanager
+def phase(name: Text) -> Iterator[None]:
+    """Times a phase. Nested phases are counted in the outer ones too."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        end = time.perf_counter()
+        with _lock:
+            calls, seconds = _phases.get(name, (0, 0.0))
+            _phases[name] = (calls + 1, seconds + end - start)
+            if _events is not None:
+                _events.append({
+                    "name": name, "ph": "X", "ts": start * 1e6,
+                    "dur": (end - start) * 1e6, "pid": os.getpid(),
+                    "tid": threading.get_ident()})
+
+
+def timed(name: Text) -> Callable[[Callable], Callable]:
+    """Decorator timing every call of a function as a phase."""
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with phase(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def count(name: Text, n: int = 1):
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + n
+
+
+def take() -> Dict[Text, Any]:
+    """Phases, counters and events recorded so far, which are cleared.
+
+    Used by worker processes to hand their measurements to `merge`.
+    """
+    with _lock:
+        result = {
+            "phases": dict(_phases), "counters": dict(_counters),
+            "events": list(_events or [])}
+        _phases.clear()
+        _counters.clear()
+        if _events is not None:
+            _events.clear()
+    return result
+
+
+def merge(recorded: Dict[Text, Any]):
+    with _lock:
+        for name, (calls, seconds) in recorded["phases"].items():
+            total_calls, total_seconds = _phases.get(name, (0, 0.0))
+            _phases[name] = (total_calls + calls, total_seconds + seconds)
+        for name, n in recorded["counters"].items():
+            _counters[name] = _counters.get(name, 0) + n
+        if _events is not None:
+            _events.extend(recorded["events"])
+
+
+def summary(started: float, status: Text = "ok") -> Dict[Text, Any]:
+    """Phases, counters and Storage traffic of the run, as JSON.
+
+    Seconds of phases run in several threads add up, and can exceed the
+    duration of the run.
+    """
+    with _lock:
+        phases = {
+            name: {"calls": calls, "seconds": round(seconds, 3)}
+            for name, (calls, seconds) in sorted(_phases.items())}
+        counters = dict(sorted(_counters.items()))
+    return {
+        "script": os.path.basename(sys.argv[0]),
+        "argv": sys.argv[1:],
+        "started": datetime.datetime.fromtimestamp(
+            started, datetime.timezone.utc).isoformat(),
+        "seconds": round(time.time() - started, 3),
+        "status": status,
+        "phases": phases,
+        "counters": counters,
+        "storage": fibs_firebase_config.get_stats(),
+    }
+
+
+def _output(filename: Text) -> Text:
+    """Creates the directory of an output file."""
+    directory = os.path.dirname(filename)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    return filename
+
+
+def write_trace(filename: Text, events: List[Dict[Text, Any]]):
+    with open(_output(filename), "w") as outfile:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, outfile)
+
+
+def instrumented(main: Callable[[List[Text]], Any]) -> Callable:
+    """Wraps the main of a script to profile it and summarize its run."""
+    @functools.wraps(main)
+    def run(argv):
+        started = time.time()
+        reset(trace=FLAGS.profile == "trace")
+        profiler = None
+        if FLAGS.profile == "cprofile":
+            profiler = cProfile.Profile()
+            profiler.enable()
+        status = "failed"
+        try:
+            result = main(argv)
+            status = "ok"
+            return result
+        finally:
+            if profiler is not None:
+                profiler.disable()
+                profiler.dump_stats(_output(FLAGS.profile_output + ".pstats"))
+            if FLAGS.profile == "trace":
+                write_trace(FLAGS.profile_output + ".trace.json", _events)
+            line = json.dumps(summary(started, status), sort_keys=True)
+            print(line)
+            if FLAGS.run_log:
+                with open(_output(FLAGS.run_log), "a") as outfile:
+                    outfile.write(line + "\n")
+    return run
@@ -0,0 +1,226 @@
+# coding=utf-8
+# Copyright 2019 Google LLC.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# Lint as: python3
+
+# LMI of the bigrams of the claims with their labels, as in
+# notebooks/lmi_analysis.ipynb, computed for all bigrams at once.
+# LMI(b, l) = p(b, l) * log(p(l | b) / p(l)), see
+# https://www.aclweb.org/anthology/D19-1341.
+# Run to compare the top bigrams of two files of claims, like the splits of
+# the dataset or the claims.jsonl written by create_workflow.
+
+import json
+import re
+import numpy as np
+
+from scipy import sparse
+from typing import Text, Mapping, Dict, List, Iterable, Any, Optional, Tuple
+
+from absl import app
+from absl import flags
+
+try:
+    import nltk
+except ImportError:
+    nltk = None
+
+FLAGS = flags.FLAGS
+flags.DEFINE_string("lmi_train", "dataset/train.jsonl",
+                    "Claims whose top bigrams are listed first")
+flags.DEFINE_string("lmi_dev", "dataset/dev.jsonl",
+                    "Claims to compare the top bigrams with")
+flags.DEFINE_integer("top_n", 10, "Number of top bigrams per label")
+
+# Close to nltk.word_tokenize, for when NLTK is not installed.
+kTOKEN = re.compile(r"\w+(?:'\w+)?|[^\w\s]")
+# Bigram keys are int64, which leaves room for 2^31 distinct tokens.
+kMAX_TOKENS = 2 ** 31
+
+
+def tokenize(text: Text) -> List[Text]:
+    if nltk is not None:
+        return nltk.word_tokenize(text.lower())
+    return kTOKEN.findall(text.lower())
+
+
+class Vocabulary(object):
+    """Integer ids of tokens, shared by the files being compared."""
+
+    def __init__(self):
+        self.ids = {}
+        self.tokens = []
+
+    def __len__(self) -> int:
+        return len(self.tokens)
+
+    def encode(self, tokens: Iterable[Text]) -> List[int]:
+        ids = []
+        for token in tokens:
+            if token not in self.ids:
+                self.ids[token] = len(self.tokens)
+                self.tokens.append(token)
+            ids.append(self.ids[token])
+        return ids
+
+
+class Lmi(object):
+    """LMI of every bigram and label.
+
+    `bigrams` are sorted keys left * kMAX_TOKENS + right of the token ids,
+    `first` the position where each bigram first appeared and `scores` has
+    a row per bigram and a column per label.
+    """
+
+    def __init__(
+        self,
+        vocabulary: Vocabulary,
+        labels: List[Text],
+        bigrams: np.ndarray,
+        first: np.ndarray,
+        scores: np.ndarray,
+    ):
+        self.vocabulary = vocabulary
+        self.labels = labels
+        self.bigrams = bigrams
+        self.first = first
+        self.scores = scores
+
+    def bigram(self, key: int) -> Tuple[Text, Text]:
+        left, right = divmod(int(key), kMAX_TOKENS)
+        return self.vocabulary.tokens[left], self.vocabulary.tokens[right]
+
+    def top(self, label: Text, n: int) -> List[Tuple[int, float]]:
+        """The n bigrams with the highest LMI for the label, best first."""
+        scores = self.scores[:, self.labels.index(label)]
+        n = min(n, len(scores))
+        if n == 0:
+            return []
+        # Bigrams tied with the n-th are ordered by first appearance, like
+        # the stable sort of the notebook.
+        kth = -np.partition(-scores, n - 1)[n - 1]
+        best = np.flatnonzero(scores >= kth)
+        best = best[np.lexsort((self.first[best], -scores[best]))][:n]
+        return [(int(self.bigrams[x]), float(scores[x])) for x in best]
+
+    def as_dict(self) -> Dict[Text, Dict[Tuple[Text, Text], float]]:
+        """LMI per label and bigram, like compute_lmi in the notebook."""
+        bigrams = [self.bigram(x) for x in self.bigrams]
+        return {
+            label: dict(zip(bigrams, self.scores[:, ii].tolist()))
+            for ii, label in enumerate(self.labels)}
+
+
+def compute_lmi(
+    examples: Iterable[Mapping[Text, Any]],
+    vocabulary: Optional[Vocabulary] = None,
+) -> Lmi:
+    """Counts bigrams per label in a sparse matrix and computes their LMI."""
+    if vocabulary is None:
+        vocabulary = Vocabulary()
+    labels = {}
+    claim_labels = []
+    keys = []
+    key_labels = []
+    for example in examples:
+        label = labels.setdefault(example["label"], len(labels))
+        claim_labels.append(label)
+        ids = np.array(
+            vocabulary.encode(tokenize(example["text"])), dtype=np.int64)
+        keys.append(ids[:-1] * kMAX_TOKENS + ids[1:])
+        key_labels.append(np.full(max(len(ids) - 1, 0), label))
+
+    keys = np.concatenate(keys or [np.zeros(0, dtype=np.int64)])
+    key_labels = np.concatenate(key_labels or [np.zeros(0, dtype=np.int64)])
+    bigrams, first, rows = np.unique(
+        keys, return_index=True, return_inverse=True)
+    counts = sparse.coo_matrix(
+        (np.ones(len(keys)), (rows, key_labels)),
+        shape=(len(bigrams), len(labels))).toarray()
+
+    num_claims = len(claim_labels)
+    p_l = np.bincount(claim_labels, minlength=len(labels)) / max(num_claims, 1)
+    p_b_and_l = counts / max(num_claims, 1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        p_l_given_b = counts / counts.sum(axis=1, keepdims=True)
+        scores = p_b_and_l * np.log(p_l_given_b / p_l)
+    # Like safe_log in the notebook, bigrams never seen with a label get 0.
+    scores[counts == 0] = 0
+    return Lmi(
+        vocabulary, sorted(labels, key=labels.get), bigrams, first, scores)
+
+
+def compare(
+    train: Lmi,
+    dev: Lmi,
+    n: int = 10,
+) -> Dict[Text, List[Tuple[Tuple[Text, Text], Any, Any]]]:
+    """Top n bigrams of both, per label, with their scores or None.
+
+    Rows are merged by LMI like compare_dev_and_train in the notebook, joining
+    on the bigram keys, so both must share the vocabulary.
+    """
+    rows = {}
+    for label in train.labels:
+        train_top = train.top(label, n)
+        dev_top = dev.top(label, n) if label in dev.labels else []
+        train_scores = dict(train_top)
+        dev_scores = dict(dev_top)
+        done = set()
+        ii = jj = 0
+        rows[label] = []
+        while True:
+            while ii < len(train_top) and train_top[ii][0] in done:
+                ii += 1
+            while jj < len(dev_top) and dev_top[jj][0] in done:
+                jj += 1
+            if ii == len(train_top) and jj == len(dev_top):
+                break
+            if jj == len(dev_top) or (
+                    ii < len(train_top) and train_top[ii][1] >= dev_top[jj][1]):
+                key = train_top[ii][0]
+            else:
+                key = dev_top[jj][0]
+            done.add(key)
+            rows[label].append((
+                train.bigram(key), train_scores.get(key), dev_scores.get(key)))
+    return rows
+
+
+def read_claims(filename: Text) -> Iterable[Mapping[Text, Any]]:
+    with open(filename) as infile:
+        for line in infile:
+            if line.strip():
+                yield json.loads(line)
+
+
+def _score(score: Optional[float]) -> Text:
+    return "NONE" if score is None else str(int(score * 10**5))
+
+
+def main(argv):
+    vocabulary = Vocabulary()
+    train = compute_lmi(read_claims(FLAGS.lmi_train), vocabulary)
+    dev = compute_lmi(read_claims(FLAGS.lmi_dev), vocabulary)
+    for label, rows in compare(train, dev, FLAGS.top_n).items():
+        print(label)
+        for bigram, train_score, dev_score in rows:
+            print(
+                f'{" ".join(bigram)} & ${_score(train_score)}$ & '
+                f'${_score(dev_score)}$ \\\\')
+        print()
+
+
+if __name__ == "__main__":
+    app.run(main)
@@ -0,0 +1,407 @@
+# coding=utf-8
+# Copyright 2019 Google LLC.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# Lint as: python3
+
+# Stand-ins for Firestore and Cloud Storage to run the scripts offline: an
+# in-memory Firestore with the part of the client API the scripts use, and a
+# bucket whose blobs are files in a local directory.
+
+import asyncio
+import base64
+import copy
+import gzip
+import hashlib
+import json
+import operator
+import os
+import threading
+
+from typing import (
+    Text, Mapping, Dict, Iterable, Iterator, Any, AsyncIterator, Optional,
+    Tuple)
+
+kOPERATORS = {
+    "<": operator.lt,
+    "<=": operator.le,
+    "==": operator.eq,
+    "!=": operator.ne,
+    ">=": operator.ge,
+    ">": operator.gt,
+    "in": lambda x, y: x in y,
+    "array_contains": lambda x, y: y in x,
+}
+
+
+class DocumentReference(object):
+
+    def __init__(self, client: "FirestoreClient", path: Tuple[Text, ...]):
+        self._client = client
+        self.path = path
+
+    @property
+    def id(self) -> Text:
+        return self.path[-1]
+
+    @property
+    def parent(self) -> "CollectionReference":
+        return CollectionReference(self._client, self.path[:-1])
+
+    def collection(self, name: Text) -> "CollectionReference":
+        return CollectionReference(self._client, self.path + (name,))
+
+    def get(self) -> "DocumentSnapshot":
+        return self._client._snapshot(self.path)
+
+    def set(self, document: Mapping[Text, Any], merge: bool = False):
+        self._client._set(self.path, document, merge)
+
+    def update(self, fields: Mapping[Text, Any]):
+        self._client._set(self.path, fields, merge=True)
+
+    def delete(self):
+        self._client._delete(self.path)
+
+
+class DocumentSnapshot(object):
+
+    def __init__(
+        self,
+        reference: DocumentReference,
+        document: Optional[Dict[Text, Any]],
+    ):
+        self.reference = reference
+        self._document = document
+
+    @property
+    def id(self) -> Text:
+        return self.reference.id
+
+    @property
+    def exists(self) -> bool:
+        return self._document is not None
+
+    def to_dict(self) -> Optional[Dict[Text, Any]]:
+        return copy.deepcopy(self._document)
+
+
+class Query(object):
+    """Documents of a collection, or of a collection group, with filters."""
+
+    def __init__(
+        self,
+        client: "FirestoreClient",
+        path: Tuple[Text, ...],
+        group: bool = False,
+        filters: Tuple[Tuple[Text, Text, Any], ...] = (),
+        fields: Optional[Tuple[Text, ...]] = None,
+    ):
+        self._client = client
+        self._path = path
+        self._group = group
+        self._filters = filters
+        self._fields = fields
+
+    def where(self, field: Text, op: Text, value: Any) -> "Query":
+        return Query(
+            self._client, self._path, self._group,
+            self._filters + ((field, op, value),), self._fields)
+
+    def select(self, field_paths: Iterable[Text]) -> "Query":
+        """Same query, returning only the given fields of the documents."""
+        return Query(
+            self._client, self._path, self._group, self._filters,
+            tuple(field_paths))
+
+    def stream(self) -> Iterator[DocumentSnapshot]:
+        """Snapshots of the matching documents, in the order of their paths.
+        """
+        with self._client._lock:
+            if self._group:
+                paths = list(self._client._groups.get(self._path[-1], ()))
+            else:
+                paths = [
+                    self._path + (x,)
+                    for x in self._client._children.get(self._path, ())]
+        for path in sorted(paths):
+            snapshot = self._client._snapshot(path)
+            document = snapshot._document
+            if document is not None and all(
+                    field in document and kOPERATORS[op](document[field], value)
+                    for field, op, value in self._filters):
+                if self._fields is not None:
+                    snapshot = DocumentSnapshot(snapshot.reference, {
+                        x: document[x] for x in self._fields if x in document})
+                yield snapshot
+
+
+class CollectionReference(Query):
+
+    def __init__(self, client: "FirestoreClient", path: Tuple[Text, ...]):
+        super().__init__(client, path)
+
+    @property
+    def id(self) -> Text:
+        return self._path[-1]
+
+    @property
+    def parent(self) -> Optional[DocumentReference]:
+        if len(self._path) == 1:
+            return None
+        return DocumentReference(self._client, self._path[:-1])
+
+    def document(self, name: Text) -> DocumentReference:
+        return DocumentReference(self._client, self._path + (name,))
+
+
+class WriteBatch(object):
+
+    def __init__(self, client: "FirestoreClient"):
+        self._client = client
+        self._writes = []
+
+    def set(
+        self,
+        reference: DocumentReference,
+        document: Mapping[Text, Any],
+        merge: bool = False,
+    ):
+        self._writes.append((reference.path, document, merge))
+
+    def commit(self):
+        with self._client._lock:
+            for path, document, merge in self._writes:
+                self._client._set(path, document, merge)
+        self._writes = []
+
+
+class FirestoreClient(object):
+    """In-memory Firestore, documents are dictionaries keyed by their path.
+
+    Documents are copied in and out, like they would be serialized.
+    """
+
+    def __init__(self):
+        self._documents = {}
+        # Document ids of each collection and paths of each collection id.
+        self._children = {}
+        self._groups = {}
+        self._lock = threading.RLock()
+
+    def collection(self, name: Text) -> CollectionReference:
+        return CollectionReference(self, (name,))
+
+    def collection_group(self, name: Text) -> Query:
+        return Query(self, (name,), group=True)
+
+    def document(self, path: Text) -> DocumentReference:
+        return DocumentReference(self, tuple(path.split("/")))
+
+    def batch(self) -> WriteBatch:
+        return WriteBatch(self)
+
+    def get_all(
+        self,
+        references: Iterable[DocumentReference],
+    ) -> Iterator[DocumentSnapshot]:
+        for reference in references:
+            yield self._snapshot(reference.path)
+
+    def _snapshot(self, path: Tuple[Text, ...]) -> DocumentSnapshot:
+        with self._lock:
+            document = self._documents.get(path)
+        return DocumentSnapshot(DocumentReference(self, path), document)
+
+    def _set(
+        self,
+        path: Tuple[Text, ...],
+        document: Mapping[Text, Any],
+        merge: bool,
+    ):
+        with self._lock:
+            if merge and path in self._documents:
+                self._documents[path].update(copy.deepcopy(dict(document)))
+                return
+            self._documents[path] = copy.deepcopy(dict(document))
+            self._children.setdefault(path[:-1], {})[path[-1]] = None
+            self._groups.setdefault(path[-2], {})[path] = None
+
+    def _delete(self, path: Tuple[Text, ...]):
+        with self._lock:
+            if self._documents.pop(path, None) is not None:
+                del self._children[path[:-1]][path[-1]]
+                del self._groups[path[-2]][path]
+
+
+class AsyncQuery(object):
+    """Query of an AsyncFirestoreClient."""
+
+    def __init__(self, query: Query, latency: float):
+        self._query = query
+        self._latency = latency
+
+    def where(self, field: Text, op: Text, value: Any) -> "AsyncQuery":
+        return AsyncQuery(self._query.where(field, op, value), self._latency)
+
+    async def stream(self) -> AsyncIterator[DocumentSnapshot]:
+        for snapshot in self._query.stream():
+            await asyncio.sleep(self._latency)
+            yield snapshot
+
+
+class AsyncFirestoreClient(object):
+    """Reads of a FirestoreClient with the API of the asyncio client.
+
+    Each document takes `latency` seconds to arrive, like over a network.
+    """
+
+    def __init__(self, client: FirestoreClient, latency: float = 0.0):
+        self._client = client
+        self._latency = latency
+
+    def collection(self, name: Text) -> AsyncQuery:
+        return AsyncQuery(self._client.collection(name), self._latency)
+
+    def collection_group(self, name: Text) -> AsyncQuery:
+        return AsyncQuery(self._client.collection_group(name), self._latency)
+
+
+class Blob(object):
+    """Blob of a LocalBucket, its metadata is kept next to its data."""
+
+    def __init__(self, bucket: "LocalBucket", name: Text):
+        self.bucket = bucket
+        self.name = name
+        self.content_type = None
+        self.content_encoding = None
+        self.cache_control = None
+        metadata = bucket._read_metadata(name)
+        if metadata:
+            self.__dict__.update(metadata)
+
+    @property
+    def _filename(self) -> Text:
+        return os.path.join(self.bucket.directory, "data", self.name)
+
+    @property
+    def size(self) -> Optional[int]:
+        if not self.exists():
+            return None
+        return os.path.getsize(self._filename)
+
+    @property
+    def md5_hash(self) -> Optional[Text]:
+        """MD5 of the data as stored, base64 encoded like Cloud Storage."""
+        if not self.exists():
+            return None
+        with open(self._filename, "rb") as infile:
+            digest = hashlib.md5(infile.read()).digest()
+        return base64.b64encode(digest).decode("ascii")
+
+    def exists(self) -> bool:
+        return os.path.exists(self._filename)
+
+    def upload_from_string(
+        self,
+        data: Any,
+        content_type: Text = "text/plain",
+    ):
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        os.makedirs(os.path.dirname(self._filename), exist_ok=True)
+        with open(self._filename, "wb") as outfile:
+            outfile.write(data)
+        self.content_type = content_type
+        self.bucket._write_metadata(self.name, {
+            "content_type": self.content_type,
+            "content_encoding": self.content_encoding,
+            "cache_control": self.cache_control,
+        })
+
+    def upload_from_filename(
+        self,
+        filename: Text,
+        content_type: Text = "text/plain",
+    ):
+        with open(filename, "rb") as infile:
+            self.upload_from_string(infile.read(), content_type)
+
+    def delete(self):
+        os.remove(self._filename)
+        metadata = self.bucket._metadata_filename(self.name)
+        if os.path.exists(metadata):
+            os.remove(metadata)
+
+    def download_as_bytes(self, raw_download: bool = False) -> bytes:
+        """Data of the blob, decompressed if gzip-encoded unless raw."""
+        with open(self._filename, "rb") as infile:
+            data = infile.read()
+        if self.content_encoding == "gzip" and not raw_download:
+            data = gzip.decompress(data)
+        return data
+
+
+class LocalBucket(object):
+    """Bucket whose blobs are files under `directory`/data.
+
+    Metadata of each blob is a JSON file under `directory`/metadata.
+    """
+
+    def __init__(self, directory: Text, name: Text = "local"):
+        self.directory = directory
+        self.name = name
+        self.cors = []
+
+    def blob(self, name: Text) -> Blob:
+        return Blob(self, name)
+
+    def get_blob(self, name: Text) -> Optional[Blob]:
+        blob = Blob(self, name)
+        return blob if blob.exists() else None
+
+    def list_blobs(
+        self,
+        prefix: Text = "",
+        fields: Optional[Text] = None,
+    ) -> Iterator[Blob]:
+        root = os.path.join(self.directory, "data")
+        names = []
+        for directory, _, filenames in os.walk(root):
+            for filename in filenames:
+                name = os.path.relpath(
+                    os.path.join(directory, filename), root)
+                name = name.replace(os.sep, "/")
+                if name.startswith(prefix):
+                    names.append(name)
+        for name in sorted(names):
+            yield Blob(self, name)
+
+    def update(self):
+        pass
+
+    def _metadata_filename(self, name: Text) -> Text:
+        return os.path.join(self.directory, "metadata", f"{name}.json")
+
+    def _read_metadata(self, name: Text) -> Optional[Dict[Text, Any]]:
+        filename = self._metadata_filename(name)
+        if not os.path.exists(filename):
+            return None
+        with open(filename) as infile:
+            return json.load(infile)
+
+    def _write_metadata(self, name: Text, metadata: Mapping[Text, Any]):
+        filename = self._metadata_filename(name)
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        with open(filename, "w") as outfile:
+            json.dump(metadata, outfile)
@@ -0,0 +1,179 @@
+# coding=utf-8
+# Copyright 2019 Google LLC.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# Lint as: python3
+
+# Builds the lunr indices of pages in Python, the same way as
+# util/single_index.js does with lunr.js, without starting a Node process.
+# Run with --verify to compare both builders on the pages downloaded so far.
+
+import functools
+import json
+import os
+import re
+import subprocess
+import tempfile
+import tqdm
+
+from glob import glob
+from typing import Text, Mapping, List, Iterable, Any
+
+from absl import app
+from absl import flags
+
+from lunr.builder import Builder
+from lunr.pipeline import Pipeline
+from lunr.stemmer import stemmer
+from lunr.stop_word_filter import stop_word_filter
+from lunr.token import Token
+
+FLAGS = flags.FLAGS
+flags.DEFINE_boolean("verify", False,
+                     "Compare the indices with the ones built by lunr.js")
+flags.DEFINE_boolean("overwrite", False,
+                     "Rebuild indices that already exist")
+flags.DEFINE_integer("max_pages", 0,
+                     "Maximum number of pages to verify, 0 for all")
+
+kFIELDS = ["name", "line"]
+# lunr.js trims with JavaScript's \W, which only knows about ASCII.
+kTRIM = re.compile(r"^\W+|\W+$", re.ASCII)
+kTOLERANCE = 1e-3
+
+
+def _trimmer(token, i=None, tokens=None):
+    return token.update(lambda string, metadata: kTRIM.sub("", string))
+
+
+@functools.lru_cache(maxsize=None)
+def _stem(string: Text) -> Text:
+    return stemmer(Token(string)).string
+
+
+def _cached_stemmer(token, i=None, tokens=None):
+    return token.update(lambda string, metadata: _stem(string))
+
+
+# Only the search pipeline is serialized, these labels never reach the index.
+Pipeline.register_function(_trimmer, "asciiTrimmer")
+Pipeline.register_function(_cached_stemmer, "cachedStemmer")
+
+
+def build_index(sentences: Iterable[Mapping[Text, Any]]) -> Mapping[Text, Any]:
+    """Builds the serialized lunr index of the sentences of a page.
+
+    Stems are cached across calls, so building many pages in one process
+    only stems each distinct word once.
+    """
+    builder = Builder()
+    builder.pipeline.add(_trimmer, stop_word_filter, _cached_stemmer)
+    builder.search_pipeline.add(stemmer)
+    builder.ref("id")
+    for field in kFIELDS:
+        builder.field(field)
+    for sentence in sentences:
+        builder.add({
+            "line": sentence["line"],
+            "name": sentence["name"],
+            "id": sentence["id"],
+        })
+    return builder.build().serialize()
+
+
+def write_index(filename: Text, output_filename: Text):
+    with open(filename) as infile:
+        document = json.load(infile)
+    index = build_index(document["sentences"])
+    with open(output_filename, "w") as outfile:
+        json.dump(index, outfile, indent=1)
+
+
+def node_index(filename: Text) -> Mapping[Text, Any]:
+    """Builds the index of a page with util/single_index.js."""
+    with tempfile.TemporaryDirectory() as tmp:
+        output_filename = os.path.join(tmp, "index.json")
+        subprocess.run(
+            ["node", os.path.join("util", "single_index.js"),
+             filename, output_filename],
+            check=True)
+        with open(output_filename) as infile:
+            return json.load(infile)
+
+
+def diff_indices(left: Any, right: Any, path: Text = "") -> List[Text]:
+    """Paths where two serialized indices differ, ignoring rounding."""
+    if isinstance(left, dict) and isinstance(right, dict):
+        diffs = [
+            f"{path}/{key}: missing"
+            for key in sorted(set(left) ^ set(right))]
+        for key in sorted(set(left) & set(right)):
+            diffs.extend(diff_indices(left[key], right[key], f"{path}/{key}"))
+        return diffs
+    if isinstance(left, list) and isinstance(right, list):
+        if len(left) != len(right):
+            return [f"{path}: length {len(left)} != {len(right)}"]
+        diffs = []
+        for ii, (x, y) in enumerate(zip(left, right)):
+            diffs.extend(diff_indices(x, y, f"{path}/{ii}"))
+        return diffs
+    numbers = (int, float)
+    if isinstance(left, numbers) and isinstance(right, numbers):
+        if abs(left - right) > kTOLERANCE:
+            return [f"{path}: {left} != {right}"]
+        return []
+    if left != right:
+        return [f"{path}: {left} != {right}"]
+    return []
+
+
+def verify(filenames: List[Text]) -> int:
+    """Compares the Python and Node indices, returns the pages that differ."""
+    mismatches = 0
+    for filename in tqdm.tqdm(filenames):
+        with open(filename) as infile:
+            sentences = json.load(infile)["sentences"]
+        expected = node_index(filename)
+        actual = build_index(sentences)
+        # The lunr.js version is not part of the index contents.
+        diffs = [
+            x for x in diff_indices(actual, expected)
+            if not x.startswith("/version")]
+        if diffs:
+            mismatches += 1
+            tqdm.tqdm.write(f"{filename}: {len(diffs)} differences")
+            for diff in diffs[:10]:
+                tqdm.tqdm.write(f"\t{diff}")
+    return mismatches
+
+
+def main(argv):
+    filenames = sorted(glob(os.path.join("pages", "*.sentences.json")))
+    if FLAGS.verify:
+        if FLAGS.max_pages > 0:
+            filenames = filenames[:FLAGS.max_pages]
+        mismatches = verify(filenames)
+        print(f"{mismatches} of {len(filenames)} indices differ from lunr.js.")
+        return
+
+    built = 0
+    for filename in tqdm.tqdm(filenames):
+        output_filename = filename.replace(".sentences.", ".index.")
+        if FLAGS.overwrite or not os.path.exists(output_filename):
+            write_index(filename, output_filename)
+            built += 1
+    print(f"Built {built} indices.")
+
+
+if __name__ == "__main__":
+    app.run(main)
@@ -0,0 +1,316 @@
+# coding=utf-8
+# Copyright 2019 Google LLC.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# Lint as: python3
+
+# Near-duplicate claims, like close paraphrases of another claim. Claims get
+# MinHash signatures of the shingles of their normalized text, and claims that
+# share a band of their signature (LSH) are compared, so finding duplicates
+# takes time close to linear in the number of claims. Only claims with the
+# same label are compared: a true claim and its edited false version differ
+# by a word and are the pairs the game is built on. The index is kept on disk
+# and only new claims are added to it on later runs.
+
+import hashlib
+import json
+import os
+import re
+import numpy as np
+
+from typing import Text, Mapping, Dict, List, Iterable, Any, Tuple
+
+# Bytes per shingle, a shingle packed in an integer is its own hash.
+kSHINGLE = 5
+# Signature of texts without shingles.
+kEMPTY = np.uint32(0xffffffff)
+# Shingles hashed at once, bounds the memory of computing signatures.
+kCHUNK = 1 << 16
+# Claims of a bucket each new claim is compared with, per band.
+kMAX_BUCKET = 16
+kNON_WORD = re.compile(r"[\W_]+")
+
+
+def normalize(text: Text) -> bytes:
+    """Lowercase words of the text separated by spaces, as UTF-8."""
+    return kNON_WORD.sub(" ", text.lower()).strip().encode("utf-8")
+
+
+def shingles(texts: List[bytes]) -> Tuple[np.ndarray, np.ndarray]:
+    """Packed shingles of the texts and the number of shingles of each.
+
+    Texts shorter than a shingle are a single shingle.
+    """
+    texts = [x.ljust(kSHINGLE, b"\0") if x else x for x in texts]
+    lengths = np.array([len(x) for x in texts], dtype=np.int64)
+    counts = np.maximum(lengths - kSHINGLE + 1, 0)
+    data = np.frombuffer(b"".join(texts), dtype=np.uint8).astype(np.uint64)
+    starts = np.repeat(np.cumsum(lengths) - lengths, counts) + (
+        np.arange(counts.sum()) -
+        np.repeat(np.cumsum(counts) - counts, counts))
+    packed = np.zeros(len(starts), dtype=np.uint64)
+    for ii in range(kSHINGLE):
+        packed |= data[starts + ii] << np.uint64(8 * ii)
+    return packed, counts
+
+
+def block_hash(page: Text, label: Text) -> int:
+    """64-bit hash of the page and label only claims sharing it can match."""
+    digest = hashlib.blake2b(
+        f"{page}\0{label}".encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "little")
+
+
+def _ranges(starts: np.ndarray, counts: np.ndarray) -> np.ndarray:
+    """Concatenated aranges of the given starts and lengths."""
+    offsets = np.repeat(np.cumsum(counts) - counts, counts)
+    return np.repeat(starts, counts) + np.arange(counts.sum()) - offsets
+
+
+def _find_roots(parent: np.ndarray) -> np.ndarray:
+    roots = parent.copy()
+    while True:
+        jumped = roots[roots]
+        if np.array_equal(jumped, roots):
+            return roots
+        roots = jumped
+
+
+class DuplicateIndex(object):
+    """MinHash signatures and clusters of near-duplicate claims.
+
+    Claims whose estimated Jaccard similarity is at least `threshold` are
+    duplicates, and duplicates of duplicates too. Claims are candidates when
+    they share one of the `bands` of their signatures, the label with
+    `by_label` and the page with `by_page`. A new claim is compared with up
+    to kMAX_BUCKET claims of each bucket it falls into. Each cluster is
+    represented by the claim that was added first.
+    """
+
+    def __init__(
+        self,
+        threshold: float = 0.7,
+        num_perm: int = 128,
+        bands: int = 32,
+        by_page: bool = True,
+        by_label: bool = True,
+        seed: int = 0,
+    ):
+        if num_perm % bands:
+            raise ValueError("Bands must divide the number of permutations")
+        self.params = {
+            "threshold": threshold, "num_perm": num_perm, "bands": bands,
+            "by_page": by_page, "by_label": by_label, "seed": seed,
+            "shingle": kSHINGLE, "max_bucket": kMAX_BUCKET}
+        rng = np.random.RandomState(seed)
+        self._a = rng.randint(
+            0, 1 << 63, num_perm, dtype=np.uint64) * np.uint64(2) + np.uint64(1)
+        self._b = rng.randint(0, 1 << 63, num_perm, dtype=np.uint64)
+        self.keys = []
+        self._rows = {}
+        self.signatures = np.zeros((0, num_perm), dtype=np.uint32)
+        self.band_keys = np.zeros((0, bands), dtype=np.uint64)
+        # Hash of the page and label, claims only match within a block.
+        self.blocks = np.zeros(0, dtype=np.uint64)
+        # Union-find forest, roots are the first claim of their cluster.
+        self.parent = np.zeros(0, dtype=np.int64)
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def __contains__(self, key: Text) -> bool:
+        return key in self._rows
+
+    def signatures_of(self, texts: List[Text]) -> np.ndarray:
+        """MinHash signatures, texts without shingles get kEMPTY everywhere.
+
+        Shingles are hashed by multiply-shift with a random odd multiplier
+        and offset for each permutation.
+        """
+        result = np.full((len(texts), len(self._a)), kEMPTY, dtype=np.uint32)
+        normalized = [normalize(x) for x in texts]
+        sizes = [max(len(x) - kSHINGLE + 1, 1) for x in normalized]
+        start = 0
+        while start < len(texts):
+            # Texts with about kCHUNK shingles, at least one text.
+            end = start + 1
+            total = sizes[start]
+            while end < len(texts) and total + sizes[end] <= kCHUNK:
+                total += sizes[end]
+                end += 1
+            packed, counts = shingles(normalized[start:end])
+            if len(packed):
+                with np.errstate(over="ignore"):
+                    hashed = (
+                        (self._a[:, None] * packed[None, :] + self._b[:, None])
+                        >> np.uint64(32)).astype(np.uint32)
+                offsets = np.cumsum(counts) - counts
+                nonempty = counts > 0
+                result[start:end][nonempty] = np.minimum.reduceat(
+                    hashed, offsets[nonempty], axis=1).T
+            start = end
+        return result
+
+    def _blocks(self, pages: List[Text], labels: List[Text]) -> np.ndarray:
+        by_page, by_label = self.params["by_page"], self.params["by_label"]
+        return np.array([
+            block_hash(x if by_page else "", y if by_label else "")
+            for x, y in zip(pages, labels)], dtype=np.uint64)
+
+    def _band_keys(
+        self,
+        signatures: np.ndarray,
+        blocks: np.ndarray,
+        rows: np.ndarray,
+    ) -> np.ndarray:
+        bands = self.params["bands"]
+        rows_per_band = signatures.shape[1] // bands
+        banded = signatures.reshape(len(signatures), bands, rows_per_band)
+        keys = np.repeat(blocks[:, None], bands, axis=1)
+        with np.errstate(over="ignore"):
+            for ii in range(rows_per_band):
+                keys = keys * np.uint64(1000003) + banded[:, :, ii]
+        # Claims without text never share a band.
+        empty = (signatures == kEMPTY).all(axis=1)
+        keys[empty] = (rows[empty].astype(np.uint64) | np.uint64(1 << 63))[
+            :, None]
+        return keys
+
+    def add(self, claims: Iterable[Tuple[Text, Text, Text, Text]]) -> int:
+        """Adds the claims not yet in the index, as key, text, page and label.
+
+        Returns the number of claims added. Add claims in the order they were
+        written, so clusters are represented by their oldest claim.
+        """
+        claims = [x for x in claims if x[0] not in self._rows]
+        if not claims:
+            return 0
+        start = len(self.keys)
+        rows = np.arange(start, start + len(claims))
+        signatures = self.signatures_of([x[1] for x in claims])
+        blocks = self._blocks([x[2] for x in claims], [x[3] for x in claims])
+        band_keys = self._band_keys(signatures, blocks, rows)
+
+        candidates = []
+        for band in range(band_keys.shape[1]):
+            # Each new claim is compared with the first claims of its bucket.
+            old = self.band_keys[:, band]
+            order = np.argsort(old, kind="stable")
+            new = band_keys[:, band]
+            lo = np.searchsorted(old[order], new, side="left")
+            hi = np.searchsorted(old[order], new, side="right")
+            count = np.minimum(hi - lo, kMAX_BUCKET)
+            candidates.append(
+                (np.repeat(rows, count), order[_ranges(lo, count)]))
+
+            # And with the new claims before it in its bucket.
+            order = np.argsort(new, kind="stable")
+            ordered = new[order]
+            for distance in range(1, min(kMAX_BUCKET, len(new) - 1) + 1):
+                same = ordered[distance:] == ordered[:-distance]
+                if not same.any():
+                    break
+                candidates.append((
+                    rows[order[distance:][same]],
+                    rows[order[:-distance][same]]))
+
+        self.keys.extend(x[0] for x in claims)
+        self._rows.update((x[0], ii) for ii, x in zip(rows.tolist(), claims))
+        self.signatures = np.concatenate([self.signatures, signatures])
+        self.band_keys = np.concatenate([self.band_keys, band_keys])
+        self.blocks = np.concatenate([self.blocks, blocks])
+        self.parent = np.concatenate([self.parent, rows])
+
+        left = np.concatenate([x for x, _ in candidates])
+        right = np.concatenate([y for _, y in candidates])
+        pairs = np.unique(np.stack([left, right], axis=1), axis=0)
+        if len(pairs):
+            similar = (
+                self.signatures[pairs[:, 0]] == self.signatures[pairs[:, 1]]
+            ).mean(axis=1) >= self.params["threshold"]
+            # Band keys of different blocks can collide, blocks cannot.
+            similar &= self.blocks[pairs[:, 0]] == self.blocks[pairs[:, 1]]
+            for x, y in pairs[similar].tolist():
+                self._union(x, y)
+        return len(claims)
+
+    def _find(self, x: int) -> int:
+        root = x
+        while self.parent[root] != root:
+            root = self.parent[root]
+        while self.parent[x] != root:
+            self.parent[x], x = root, self.parent[x]
+        return root
+
+    def _union(self, x: int, y: int):
+        x, y = self._find(x), self._find(y)
+        if x != y:
+            self.parent[max(x, y)] = min(x, y)
+
+    def duplicate_of(self) -> Dict[Text, Text]:
+        """Oldest claim of the cluster of each claim that is a duplicate."""
+        roots = _find_roots(self.parent)
+        return {
+            self.keys[x]: self.keys[y]
+            for x, y in enumerate(roots.tolist()) if x != y}
+
+    def clusters(self) -> List[List[Text]]:
+        """Clusters of more than one claim, each starting with the oldest."""
+        result = {}
+        for x, y in enumerate(_find_roots(self.parent).tolist()):
+            result.setdefault(y, []).append(self.keys[x])
+        return [x for x in result.values() if len(x) > 1]
+
+    def save(self, filename: Text):
+        directory = os.path.dirname(filename)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(filename, "wb") as outfile:
+            np.savez(
+                outfile,
+                params=np.array(json.dumps(self.params, sort_keys=True)),
+                keys=np.array(self.keys, dtype=str),
+                signatures=self.signatures,
+                band_keys=self.band_keys,
+                blocks=self.blocks,
+                parent=self.parent)
+
+    @classmethod
+    def load(cls, filename: Text, **params: Any) -> "DuplicateIndex":
+        """Index saved in the file, or an empty one if its parameters differ.
+        """
+        index = cls(**params)
+        if not os.path.exists(filename):
+            return index
+        with np.load(filename) as saved:
+            if json.loads(str(saved["params"])) != index.params:
+                return index
+            index.keys = saved["keys"].tolist()
+            index.signatures = saved["signatures"]
+            index.band_keys = saved["band_keys"]
+            index.blocks = saved["blocks"]
+            index.parent = saved["parent"]
+        index._rows = {x: ii for ii, x in enumerate(index.keys)}
+        return index
+
+
+def claim_items(
+    claims: Mapping[Text, Mapping[Text, Any]],
+) -> List[Tuple[Text, Text, Text, Text]]:
+    """Key, text, page and label of the claims, oldest first."""
+    ordered = sorted(
+        claims, key=lambda x: (str(claims[x].get("created") or ""), x))
+    return [
+        (x, claims[x].get("claim", ""), claims[x].get("page", ""),
+         str(claims[x].get("veracity", "")).lower())
+        for x in ordered]
@@ -0,0 +1,76 @@
+# coding=utf-8
+# Copyright 2019 Google LLC.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# Lint as: python3
+
+import near_duplicates
+
+kTRUE = "Ringo Starr was born in 1940 in Liverpool, England."
+kFALSE = "Ringo Starr was born in 1947 in Liverpool, England."
+
+
+def claim(text, veracity, created, page="Ringo Starr"):
+    return {"claim": text, "veracity": veracity, "page": page,
+            "created": created}
+
+
+def test_opposite_labels_are_not_duplicates():
+    claims = {
+        "true": claim(kTRUE, "TRUE", "2020-01-01"),
+        "false": claim(kFALSE, "FALSE", "2020-01-02"),
+        "not": claim(kTRUE.replace("was", "was not"), "FALSE", "2020-01-03"),
+    }
+    index = near_duplicates.DuplicateIndex()
+    index.add(near_duplicates.claim_items(claims))
+    assert index.duplicate_of() == {}
+
+    # Only the labels keep them apart.
+    index = near_duplicates.DuplicateIndex(by_label=False)
+    index.add(near_duplicates.claim_items(claims))
+    assert index.duplicate_of() == {"false": "true", "not": "true"}
+
+
+def test_same_label_paraphrase_is_duplicate():
+    claims = {
+        "first": claim(kTRUE, "TRUE", "2020-01-01"),
+        "second": claim(kTRUE.replace("England", "England!"), "TRUE",
+                        "2020-01-02"),
+    }
+    index = near_duplicates.DuplicateIndex()
+    index.add(near_duplicates.claim_items(claims))
+    assert index.duplicate_of() == {"second": "first"}
+
+
+def test_paraphrase_of_later_bucket_member_is_found():
+    # The third claim shares every band with the second but not with the
+    # first, which comes first in their buckets.
+    index = near_duplicates.DuplicateIndex(by_page=False)
+    index.add([
+        ("a", "a claim about something else entirely", "", "true"),
+        ("b", kTRUE, "", "true"),
+    ])
+    index.band_keys[0] = index.band_keys[1]
+    index.add([("c", kTRUE + " Indeed.", "", "true")])
+    assert index.duplicate_of() == {"c": "b"}
+
+
+def test_saved_index_keeps_blocks(tmp_path):
+    filename = str(tmp_path / "duplicates.npz")
+    index = near_duplicates.DuplicateIndex()
+    index.add([("true", kTRUE, "Ringo Starr", "true")])
+    index.save(filename)
+    index = near_duplicates.DuplicateIndex.load(filename)
+    index.add([("false", kFALSE, "Ringo Starr", "false")])
+    assert index.duplicate_of() == {}
+    assert len(index) == 2
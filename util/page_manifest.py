@@ -0,0 +1,327 @@
+# coding=utf-8
+# Copyright 2019 Google LLC.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# Lint as: python3
+
+# Keeps track of what has been ingested so download_wiki only fetches,
+# extracts and uploads the pages that changed since the last run.
+
+import base64
+import gzip
+import hashlib
+import json
+import os
+import threading
+import time
+import requests
+
+import instrumentation
+
+from absl import flags
+
+from typing import (
+    TYPE_CHECKING, Text, Mapping, Dict, List, Iterable, Any, Optional)
+
+if TYPE_CHECKING:
+    from google.cloud import storage
+
+FLAGS = flags.FLAGS
+flags.DEFINE_string("lengths", os.path.join("pages", "lengths.json"),
+                    "Number of sentences of every page, written by "
+                    "download_wiki and updated by create_workflow")
+
+kWIKI_API = "https://en.wikipedia.org/w/api.php"
+# Maximum number of titles the API accepts in a single query.
+kTITLES_PER_QUERY = 50
+kMANIFEST_BLOB = "manifest/pages.json"
+kUSER_AGENT = "fool-me-twice (https://github.com/google-research/fool-me-twice)"
+# Caches revalidate pages and indices on every use, so a page and its index
+# never come from different uploads. Unchanged blobs only cost a 304.
+kCACHE_CONTROL = "public, no-cache"
+
+
+def md5_hash(data: bytes) -> Text:
+    """MD5 in the same base64 encoding that Cloud Storage reports."""
+    return base64.b64encode(hashlib.md5(data).digest()).decode("ascii")
+
+
+def file_hash(filename: Text) -> Text:
+    with open(filename, "rb") as infile:
+        return md5_hash(infile.read())
+
+
+def compress_json(data: bytes) -> bytes:
+    """Minified and gzip-compressed JSON, the same for the same JSON."""
+    minified = json.dumps(
+        json.loads(data), separators=(",", ":"), ensure_ascii=False)
+    return gzip.compress(minified.encode("utf-8"), mtime=0)
+
+
+def upload_compressed(
+    bucket: "storage.Bucket",
+    name: Text,
+    payload: bytes,
+    content_type: Text = "application/json",
+):
+    """Uploads a gzip payload that clients decompress as they download it."""
+    blob = bucket.blob(name)
+    blob.content_encoding = "gzip"
+    blob.cache_control = kCACHE_CONTROL
+    blob.upload_from_string(payload, content_type=content_type)
+    instrumentation.count("blobs_uploaded")
+    instrumentation.count("bytes_uploaded", len(payload))
+
+
+def content_hash(sections: Iterable[Any]) -> Text:
+    """Hash of the titles and texts of the sections of a page."""
+    def tree(sections):
+        return [[x.title, x.text, tree(x.sections)] for x in sections]
+    return md5_hash(json.dumps(tree(sections)).encode("utf-8"))
+
+
+def file_stamp(filename: Text) -> List[int]:
+    """Modification time and size, to tell if a file changed."""
+    stat = os.stat(filename)
+    return [stat.st_mtime_ns, stat.st_size]
+
+
+def read_lengths(filename: Text) -> Dict[Text, Dict[Text, Any]]:
+    """Number of sentences of each page, with the stamp of its file."""
+    if not os.path.exists(filename):
+        return {}
+    with open(filename) as infile:
+        return json.load(infile)
+
+
+def write_lengths(lengths: Mapping[Text, Mapping[Text, Any]], filename: Text):
+    with open(filename, "w") as outfile:
+        json.dump(lengths, outfile, sort_keys=True)
+
+
+def length_entry(filename: Text, length: int) -> Dict[Text, Any]:
+    return {"stamp": file_stamp(filename), "length": length}
+
+
+def cached_length(
+    lengths: Mapping[Text, Mapping[Text, Any]],
+    page: Text,
+    filename: Text,
+) -> Optional[int]:
+    """Length of the page, unless its file changed since it was recorded."""
+    entry = lengths.get(page)
+    if entry is None or not os.path.exists(filename):
+        return None
+    if entry["stamp"] != file_stamp(filename):
+        return None
+    return entry["length"]
+
+
+def fetch_revisions(
+    pages: Iterable[Text],
+    session: Optional[requests.Session] = None,
+) -> Dict[Text, int]:
+    """Latest revision id of each page, querying many titles at once."""
+    pages = list(dict.fromkeys(pages))
+    if session is None:
+        session = requests.Session()
+        session.headers["User-Agent"] = kUSER_AGENT
+    revisions = {}
+    for start in range(0, len(pages), kTITLES_PER_QUERY):
+        titles = pages[start:start + kTITLES_PER_QUERY]
+        response = session.get(kWIKI_API, params={
+            "action": "query",
+            "prop": "info",
+            "titles": "|".join(titles),
+            "redirects": 1,
+            "format": "json",
+            "formatversion": 2,
+        })
+        response.raise_for_status()
+        query = response.json().get("query", {})
+        renames = {
+            x["from"]: x["to"]
+            for x in query.get("normalized", []) + query.get("redirects", [])}
+        latest = {
+            x["title"]: x["lastrevid"]
+            for x in query.get("pages", []) if "lastrevid" in x}
+        for title in titles:
+            resolved = title
+            for _ in range(len(renames)):
+                if resolved not in renames:
+                    break
+                resolved = renames[resolved]
+            if resolved in latest:
+                revisions[title] = latest[resolved]
+    return revisions
+
+
+def list_remote(bucket: "storage.Bucket") -> Dict[Text, Text]:
+    """MD5 hashes of the page and index blobs in the bucket."""
+    remote = {}
+    for prefix in ["pages/", "indices/"]:
+        # Only ask for the fields we need, listing through the whole prefix.
+        for blob in bucket.list_blobs(
+                prefix=prefix, fields="items(name,md5Hash),nextPageToken"):
+            remote[blob.name] = blob.md5_hash
+    return remote
+
+
+class Manifest(object):
+    """Revision and hashes of every ingested page and of the uploaded blobs.
+
+    Pages map to their Wikipedia `revision`, the `content` hash of their
+    sections and the hashes of their `sentences` and `index` files, which are
+    None for pages that were skipped, like disambiguation pages.
+
+    Uploads are compressed, so `sentences_blob` and `index_blob` keep the
+    hashes of the blobs, which are the ones Cloud Storage reports.
+    """
+
+    def __init__(
+        self,
+        pages: Optional[Dict[Text, Dict[Text, Any]]] = None,
+        remote: Optional[Dict[Text, Text]] = None,
+        listed: Optional[float] = None,
+        lengths: Optional[Dict[Text, Dict[Text, Any]]] = None,
+    ):
+        self.pages = pages or {}
+        self.remote = remote or {}
+        self.lengths = lengths or {}
+        # When the bucket was listed to get the remote hashes.
+        self.listed = listed or time.time()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(
+        cls,
+        bucket: "storage.Bucket",
+        filename: Text,
+        remote_cache: Optional[Text] = None,
+        ttl: int = 0,
+        lengths_filename: Optional[Text] = None,
+    ) -> "Manifest":
+        """Reads the local manifest, or the one in the bucket if missing.
+
+        The listing of the bucket is read from `remote_cache` if it is less
+        than `ttl` seconds old.
+        """
+        lengths = read_lengths(lengths_filename) if lengths_filename else {}
+        if os.path.exists(filename):
+            with open(filename) as infile:
+                pages = json.load(infile)
+        else:
+            blob = bucket.get_blob(kMANIFEST_BLOB)
+            pages = json.loads(blob.download_as_bytes()) if blob else {}
+
+        if remote_cache and ttl > 0 and os.path.exists(remote_cache):
+            with open(remote_cache) as infile:
+                cache = json.load(infile)
+            if time.time() - cache["listed"] < ttl:
+                return cls(pages, cache["blobs"], cache["listed"], lengths)
+        manifest = cls(pages, lengths=lengths)
+        manifest.remote = list_remote(bucket)
+        if remote_cache:
+            manifest.save_remote(remote_cache)
+        return manifest
+
+    def save(
+        self,
+        bucket: "storage.Bucket",
+        filename: Text,
+        lengths_filename: Optional[Text] = None,
+    ):
+        data = json.dumps(self.pages, indent=1, sort_keys=True)
+        with open(filename, "w") as outfile:
+            outfile.write(data)
+        bucket.blob(kMANIFEST_BLOB).upload_from_string(
+            data, content_type="application/json")
+        if lengths_filename:
+            write_lengths(self.lengths, lengths_filename)
+
+    def save_remote(self, remote_cache: Text):
+        with open(remote_cache, "w") as outfile:
+            json.dump({"listed": self.listed, "blobs": self.remote}, outfile)
+
+    def unchanged(self, page: Text, revision: Optional[int]) -> bool:
+        """Whether the bucket has the page at this revision."""
+        entry = self.pages.get(page)
+        if not entry or "sentences" not in entry:
+            return False
+        if entry["revision"] != revision:
+            return False
+        if entry["sentences"] is None:
+            return True
+        # Pages uploaded before compression only have the file hashes.
+        return (
+            self.remote.get(f"pages/{page}.json") ==
+            entry.get("sentences_blob", entry["sentences"]) and
+            self.remote.get(f"indices/{page}.json") ==
+            entry.get("index_blob", entry["index"]))
+
+    def current_locally(
+        self,
+        page: Text,
+        revision: Optional[int],
+        filename: Text,
+    ) -> bool:
+        """Whether the local sentences of the page are at this revision."""
+        entry = self.pages.get(page, {})
+        return (
+            entry.get("revision") == revision and
+            entry.get("sentences") is not None and
+            os.path.exists(filename) and
+            file_hash(filename) == entry["sentences"])
+
+    def extracted(self, page: Text, content: Text, filename: Text) -> bool:
+        """Whether the sentences were already extracted from this content."""
+        entry = self.pages.get(page, {})
+        if entry.get("content") != content or "sentences" not in entry:
+            return False
+        if entry["sentences"] is None:
+            return True
+        return (
+            os.path.exists(filename) and
+            file_hash(filename) == entry["sentences"])
+
+    def is_page(self, page: Text) -> bool:
+        return self.pages.get(page, {}).get("sentences") is not None
+
+    def record_length(self, page: Text, filename: Text, length: int):
+        with self._lock:
+            self.lengths[page] = length_entry(filename, length)
+
+    def update(self, page: Text, **fields):
+        with self._lock:
+            self.pages.setdefault(page, {}).update(fields)
+
+    def upload(
+        self,
+        bucket: "storage.Bucket",
+        name: Text,
+        filename: Text,
+        content_type: Text = "application/json",
+    ) -> bool:
+        """Uploads a file compressed unless the blob has its hash already.
+
+        The hash of the compressed file is recorded in `remote` either way.
+        """
+        with open(filename, "rb") as infile:
+            payload = compress_json(infile.read())
+        md5 = md5_hash(payload)
+        if self.remote.get(name) == md5:
+            return False
+        upload_compressed(bucket, name, payload, content_type)
+        with self._lock:
+            self.remote[name] = md5
+        return True
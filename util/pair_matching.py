@@ -0,0 +1,187 @@
+# coding=utf-8
+# Copyright 2019 Google LLC.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# Lint as: python3
+
+# Matches true with false claims for voting tasks. Claims of the same page
+# are never paired, as many claims as possible are, and optionally pairs
+# are made of claims of similar difficulty.
+
+import numpy as np
+
+from scipy.optimize import linear_sum_assignment
+from typing import Text, Mapping, Dict, List, Any, Optional, Tuple
+
+kMODES = ["greedy", "optimal"]
+# Larger clusters are matched greedily in the optimal mode, their cost
+# matrix would not fit in memory.
+kMAX_OPTIMAL = 2000
+
+
+def claim_difficulty(
+    claim: Mapping[Text, Any],
+    evidence_used: Optional[float] = None,
+) -> float:
+    """Difficulty between 0 and 1 from votes, likes and evidence used.
+
+    Averages the smoothed share of players that were fooled, how liked the
+    claim is and how much evidence players needed, when known.
+    """
+    total = claim.get("total_votes", 0)
+    correct = claim.get("correct_votes", 0)
+    signals = [1 - (correct + 1) / (total + 2)]
+    likes = claim.get("total_likes", len(claim.get("likes", [])))
+    signals.append(likes / (likes + 1))
+    if evidence_used is not None and evidence_used >= 0:
+        signals.append(evidence_used / (evidence_used + 1))
+    return sum(signals) / len(signals)
+
+
+def mean_evidence_used(
+    votes: Mapping[Text, Mapping[Text, Mapping[Text, Any]]],
+) -> Dict[Text, float]:
+    """Average evidence players saw of each claim before voting."""
+    result = {}
+    for key in votes:
+        seen = [
+            vote["evidence_used"][key] for vote in votes[key].values()
+            if vote.get("evidence_used", {}).get(key, -1) >= 0]
+        if seen:
+            result[key] = sum(seen) / len(seen)
+    return result
+
+
+def greedy_match(
+    true_pages: np.ndarray,
+    false_pages: np.ndarray,
+    true_order: Optional[np.ndarray] = None,
+    false_order: Optional[np.ndarray] = None,
+) -> List[Tuple[int, int]]:
+    """Maximum matching of claims on different pages.
+
+    Claims are taken in the given orders, each true claim with the first
+    false claim of another page. Claims left over on a single page are
+    then paired by swapping partners with pairs that do not involve it.
+    """
+    true_order = (
+        np.arange(len(true_pages)) if true_order is None else true_order)
+    false_order = (
+        np.arange(len(false_pages)) if false_order is None else false_order)
+    true_pages = true_pages.tolist()
+    false_pages = false_pages.tolist()
+    pairs = _match_in_order(
+        true_order.tolist(), false_order.tolist(), true_pages, false_pages)
+
+    matched_true = {x for x, _ in pairs}
+    matched_false = {y for _, y in pairs}
+    left_true = [x for x in true_order.tolist() if x not in matched_true]
+    left_false = [y for y in false_order.tolist() if y not in matched_false]
+    if not left_true or not left_false:
+        return pairs
+
+    # Leftovers of both sides are all on the same page, otherwise they would
+    # have been paired.
+    page = true_pages[left_true[0]]
+    free = (
+        ii for ii, (x, y) in enumerate(pairs)
+        if true_pages[x] != page and false_pages[y] != page)
+    for x, y in zip(left_true, left_false):
+        ii = next(free, None)
+        if ii is None:
+            break
+        other_true, other_false = pairs[ii]
+        pairs[ii] = (x, other_false)
+        pairs.append((other_true, y))
+    return pairs
+
+
+def _match_in_order(true_order, false_order, true_pages, false_pages):
+    # Positions of the pending false claims, as a doubly linked list.
+    end = len(false_order)
+    following = list(range(1, end + 1))
+    preceding = list(range(-1, end - 1))
+    head = 0
+    pairs = []
+    for x in true_order:
+        pos = head
+        while pos < end and false_pages[false_order[pos]] == true_pages[x]:
+            pos = following[pos]
+        if pos == end:
+            continue
+        pairs.append((x, false_order[pos]))
+        if preceding[pos] < 0:
+            head = following[pos]
+        else:
+            following[preceding[pos]] = following[pos]
+        if following[pos] < end:
+            preceding[following[pos]] = preceding[pos]
+    return pairs
+
+
+def optimal_match(
+    true_pages: np.ndarray,
+    false_pages: np.ndarray,
+    true_difficulty: np.ndarray,
+    false_difficulty: np.ndarray,
+) -> List[Tuple[int, int]]:
+    """Maximum matching across pages with the least difference in difficulty.
+    """
+    if not len(true_pages) or not len(false_pages):
+        return []
+    cost = np.abs(true_difficulty[:, None] - false_difficulty[None, :])
+    # Costlier than any matching of allowed pairs, so as few same-page
+    # pairs as possible are chosen, and then dropped.
+    forbidden = true_pages[:, None] == false_pages[None, :]
+    cost[forbidden] = min(len(true_pages), len(false_pages)) + 1
+    rows, cols = linear_sum_assignment(cost)
+    return [
+        (int(x), int(y)) for x, y in zip(rows, cols) if not forbidden[x, y]]
+
+
+def match(
+    true_claims: List[Mapping[Text, Any]],
+    false_claims: List[Mapping[Text, Any]],
+    mode: Text = "greedy",
+    difficulty: Optional[Mapping[Text, float]] = None,
+) -> List[Tuple[int, int]]:
+    """Pairs indices of true and false claims.
+
+    Without `difficulty` claims are taken in the order given, otherwise
+    claims of similar difficulty are paired.
+    """
+    if mode not in kMODES:
+        raise ValueError(f"Unknown pairing mode {mode}")
+    pages = {}
+    true_pages = np.array(
+        [pages.setdefault(x["page"], len(pages)) for x in true_claims],
+        dtype=np.int64)
+    false_pages = np.array(
+        [pages.setdefault(x["page"], len(pages)) for x in false_claims],
+        dtype=np.int64)
+    if difficulty is None:
+        true_difficulty = np.zeros(len(true_claims))
+        false_difficulty = np.zeros(len(false_claims))
+    else:
+        true_difficulty = np.array([difficulty[x["id"]] for x in true_claims])
+        false_difficulty = np.array(
+            [difficulty[x["id"]] for x in false_claims])
+
+    if mode == "optimal" and max(len(true_claims), len(false_claims)) <= (
+            kMAX_OPTIMAL):
+        return optimal_match(
+            true_pages, false_pages, true_difficulty, false_difficulty)
+    return greedy_match(
+        true_pages, false_pages,
+        np.argsort(true_difficulty, kind="stable"),
+        np.argsort(false_difficulty, kind="stable"))
@@ -0,0 +1,87 @@
+# coding=utf-8
+# Copyright 2019 Google LLC.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# Lint as: python3
+
+import random
+
+import numpy as np
+import pytest
+
+import pair_matching
+
+
+def claims(prefix, pages):
+    return [{"id": f"{prefix}{ii}", "page": page}
+            for ii, page in enumerate(pages)]
+
+
+def max_pairs(true_claims, false_claims):
+    """Size of a maximum matching across pages, by brute force."""
+    def best(ii, used):
+        if ii == len(true_claims):
+            return 0
+        result = best(ii + 1, used)
+        for jj, claim in enumerate(false_claims):
+            if jj not in used and claim["page"] != true_claims[ii]["page"]:
+                result = max(result, 1 + best(ii + 1, used | {jj}))
+        return result
+    return best(0, frozenset())
+
+
+@pytest.mark.parametrize("mode", pair_matching.kMODES)
+def test_pairs_as_many_claims_as_possible_across_pages(mode):
+    rng = random.Random(0)
+    for _ in range(200):
+        true_claims = claims("t", [rng.randrange(3) for _ in range(
+            rng.randrange(6))])
+        false_claims = claims("f", [rng.randrange(3) for _ in range(
+            rng.randrange(6))])
+        pairs = pair_matching.match(true_claims, false_claims, mode)
+        assert len(pairs) == max_pairs(true_claims, false_claims)
+        assert len({x for x, _ in pairs}) == len(pairs)
+        assert len({y for _, y in pairs}) == len(pairs)
+        for x, y in pairs:
+            assert true_claims[x]["page"] != false_claims[y]["page"]
+
+
+def test_leftovers_of_one_page_are_swapped_in():
+    # In order, the last true claim is only left with a false claim of its
+    # own page.
+    pairs = pair_matching.greedy_match(
+        np.array([0, 1]), np.array([2, 1]))
+    assert sorted(pairs) == [(0, 1), (1, 0)]
+
+
+@pytest.mark.parametrize("mode", pair_matching.kMODES)
+def test_pairs_claims_of_similar_difficulty(mode):
+    true_claims = claims("t", ["a", "b", "c"])
+    false_claims = claims("f", ["d", "e", "f"])
+    difficulty = {"t0": 0.9, "t1": 0.1, "t2": 0.5,
+                  "f0": 0.45, "f1": 0.85, "f2": 0.15}
+    pairs = pair_matching.match(true_claims, false_claims, mode, difficulty)
+    assert sorted(pairs) == [(0, 1), (1, 2), (2, 0)]
+
+
+def test_claim_difficulty():
+    assert pair_matching.claim_difficulty({}) == 0.25
+    fooled = {"total_votes": 8, "correct_votes": 0, "total_likes": 0}
+    assert pair_matching.claim_difficulty(fooled) == pytest.approx(0.45)
+    assert pair_matching.claim_difficulty(fooled, 1) == pytest.approx(
+        (0.9 + 0 + 0.5) / 3)
+
+
+def test_unknown_mode():
+    with pytest.raises(ValueError):
+        pair_matching.match([], [], "random")
@@ -0,0 +1,214 @@
+# coding=utf-8
+# Copyright 2019 Google LLC.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# Lint as: python3
+
+# Synthetic game data shaped like the dataset: claims take their text,
+# evidence, votes and likes from claims of the dataset splits, and pages come
+# from categories/. Everything scales with a factor and is the same for the
+# same seed, so benchmarks of different commits compare.
+
+import datetime
+import json
+import random
+
+from collections import defaultdict
+from typing import Text, Mapping, Dict, List, Iterator, Any, Tuple
+
+import download_wiki
+
+kUSERS = 100
+kCLAIMS = 1000
+# Pages get at least this many sentences, the evidence of their claims and
+# sentences of other pages.
+kMIN_SENTENCES = 40
+kSTART = datetime.datetime(2020, 8, 1, tzinfo=datetime.timezone.utc)
+kDAYS = 60
+
+
+class SyntheticData(object):
+    """Users, pages, claims, votes and likes of a game.
+
+    Claims are Firestore documents, like the ones written by the game, on
+    pages of `categories` and with the text and evidence of the `templates`,
+    claims of the dataset. Each claim gets about as many votes and likes as
+    its template.
+    """
+
+    def __init__(
+        self,
+        templates: List[Mapping[Text, Any]],
+        categories: Mapping[Text, List[Text]],
+        scale: float = 1.0,
+        seed: int = 0,
+    ):
+        rng = random.Random(seed)
+        self.users = {
+            f"user{ii:06d}": f"Player {ii}"
+            for ii in range(max(2, round(kUSERS * scale)))}
+        users = list(self.users)
+
+        # Pages of the categories, repeated with a suffix if more are needed.
+        pages = [(x, y) for x in sorted(categories) for y in categories[x]]
+        num_pages = max(1, round(len(pages) * scale))
+        self.categories = defaultdict(list)
+        for ii in range(num_pages):
+            category, page = pages[ii % len(pages)]
+            if ii >= len(pages):
+                page = f"{page} ({ii // len(pages) + 1})"
+            self.categories[category].append(page)
+        page_names = [x for y in self.categories.values() for x in y]
+        self.priority = set(page_names[::4])
+
+        num_claims = max(2, round(kCLAIMS * scale))
+        step = datetime.timedelta(days=kDAYS) / num_claims
+        self.claims = {}
+        self.sentences = defaultdict(list)
+        counts = {}
+        for ii in range(num_claims):
+            template = templates[rng.randrange(len(templates))]
+            page = page_names[rng.randrange(len(page_names))]
+            key = f"claim{ii:07d}"
+            self.claims[key] = {
+                "page": page,
+                "claim": template["text"],
+                "author": users[rng.randrange(len(users))],
+                # Half true and half false, whatever the templates are.
+                "veracity": "TRUE" if ii % 2 else "FALSE",
+                "created": kSTART + ii * step,
+                "gold": [
+                    {"line": x["text"], "name": x["section_header"]}
+                    for x in template["gold_evidence"]],
+                "evidence": [
+                    {"line": x["text"], "name": x["section_header"]}
+                    for x in template["retrieved_evidence"]],
+            }
+            self.sentences[page].extend(self.claims[key]["gold"])
+            counts[key] = (template["total_votes"], template["total_likes"])
+
+        self.votes = []
+        self.likes = []
+        self.status = defaultdict(dict)
+        keys = list(self.claims)
+        # A player votes at most once on a claim, like in the game.
+        voted = set()
+        for key in keys:
+            created = self.claims[key]["created"]
+            total_votes, total_likes = counts[key]
+            # Votes are on pairs, each adds a vote to both claims.
+            for _ in range((total_votes + 1) // 2):
+                other = keys[rng.randrange(len(keys))]
+                voter = users[rng.randrange(len(users))]
+                if other == key or self.claims[other]["page"] == (
+                        self.claims[key]["page"]):
+                    continue
+                if (key, voter) in voted or (other, voter) in voted:
+                    continue
+                pair = [key, other]
+                evidence_used = [rng.randrange(4), rng.randrange(4)]
+                success = rng.random() < 0.6
+                points = rng.randrange(-5, 20) if success else 0
+                seconds_left = rng.randrange(0, 60)
+                when = max(created, self.claims[other]["created"]) + (
+                    datetime.timedelta(minutes=rng.randrange(1, 600)))
+                for claim in pair:
+                    voted.add((claim, voter))
+                    self.votes.append((claim, voter, {
+                        "author": voter,
+                        "points": points,
+                        "secondsLeft": seconds_left,
+                        "evidenceUsed": evidence_used,
+                        "fibs": pair,
+                        "success": success,
+                        "created": when,
+                    }))
+                self.status[voter]["_".join(pair)] = {"done": True}
+            for user in rng.sample(users, min(total_likes, len(users))):
+                self.likes.append((key, user, {
+                    "created": created + datetime.timedelta(hours=1)}))
+
+        # Every page gets sentences, borrowing from the other pages.
+        lines = [x for y in self.sentences.values() for x in y] or [
+            {"line": "A sentence of a synthetic page.", "name": "Summary"}]
+        for page in page_names:
+            while len(self.sentences[page]) < kMIN_SENTENCES:
+                self.sentences[page].append(lines[rng.randrange(len(lines))])
+
+    def pages(self) -> Iterator[Tuple[Text, Text]]:
+        """Category and name of every page."""
+        for category in sorted(self.categories):
+            for page in self.categories[category]:
+                yield category, page
+
+    def page_document(self, category: Text, page: Text) -> Dict[Text, Any]:
+        """Sentences of a page, as download_wiki writes them."""
+        return {
+            "category": category,
+            "title": page,
+            "sentences": [
+                dict(id=ii, **x) for ii, x in enumerate(self.sentences[page])],
+        }
+
+    def documents(self) -> Iterator[Tuple[Text, Dict[Text, Any]]]:
+        """Path and content of every Firestore document."""
+        for user, name in self.users.items():
+            yield f"users/{user}", {"displayName": name}
+        for user, status in self.status.items():
+            yield f"status/{user}", status
+        for key, claim in self.claims.items():
+            yield f"fibs/{key}", claim
+        for key, voter, vote in self.votes:
+            yield f"fibs/{key}/votes/{voter}", vote
+        for key, user, like in self.likes:
+            yield f"fibs/{key}/likes/{user}", like
+        for category, page in self.pages():
+            yield f"pages/{page}", {"sentences": json.dumps(
+                self.page_document(category, page))}
+
+    def write(self, db: Any, batch_size: int = 500) -> int:
+        """Writes all documents with batched writes, returns their number."""
+        batch = db.batch()
+        written = 0
+        for path, document in self.documents():
+            batch.set(db.document(path), document)
+            written += 1
+            if written % batch_size == 0:
+                batch.commit()
+                batch = db.batch()
+        batch.commit()
+        return written
+
+
+class SyntheticPage(object):
+    """What download_wiki reads of a Wikipedia page."""
+
+    def __init__(self, summary: Text, sections: List[download_wiki.Section]):
+        self.summary = summary
+        self.sections = sections
+
+
+class SyntheticWiki(object):
+    """Wikipedia whose pages have the sentences of the synthetic pages."""
+
+    def __init__(self, data: SyntheticData, sentences_per_section: int = 8):
+        self.data = data
+        self.sentences_per_section = sentences_per_section
+
+    def page(self, title: Text) -> SyntheticPage:
+        lines = [x["line"] for x in self.data.sentences[title]]
+        n = self.sentences_per_section
+        texts = [" ".join(lines[x:x + n]) for x in range(0, len(lines), n)]
+        return SyntheticPage(texts[0] if texts else "", [
+            download_wiki.Section(f"Section {ii}", text, [])
+            for ii, text in enumerate(texts[1:])])
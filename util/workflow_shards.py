@@ -0,0 +1,163 @@
+# coding=utf-8
+# Copyright 2019 Google LLC.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# Lint as: python3
+
+# Sharded workflows. Tasks are split into shards, and players get the shard
+# of the hash of their user ID. The tasks of its shard a player should not
+# get, votes on their own claims or on claims they already compared, go in an
+# object of their own, named by a salted hash of their user ID so no shard
+# or name reveals another player. Objects are uploaded minified and
+# gzip-encoded, with a manifest that board/src/config/server.js reads first.
+
+import gzip
+import hashlib
+import json
+import secrets
+
+from collections import defaultdict
+from concurrent import futures
+from typing import Text, Mapping, Dict, List, Any, Optional
+
+kHASH = "fnv1a32"
+# Workflows are split in fewer shards rather than into shards with fewer
+# tasks than this, so every player still has plenty to do.
+kMIN_SHARD_TASKS = 200
+
+
+def user_shard(user: Text, num_shards: int) -> int:
+    """FNV-1a hash of the UTF-16 code units of a user ID, as in server.js."""
+    h = 0x811c9dc5
+    units = user.encode("utf-16-le")
+    for ii in range(0, len(units), 2):
+        h = ((h ^ (units[ii] | units[ii + 1] << 8)) * 0x01000193) & 0xffffffff
+    return h % num_shards
+
+
+def hidden_name(salt: Text, user: Text) -> Text:
+    """SHA-256 of the salt and user ID, as hiddenName in server.js."""
+    return hashlib.sha256((salt + user).encode("utf-8")).hexdigest()
+
+
+def num_shards(num_tasks: int, requested: int) -> int:
+    return max(1, min(requested, num_tasks // kMIN_SHARD_TASKS))
+
+
+def split_tasks(
+    tasks: Mapping[Text, Mapping[Text, Any]],
+    shards: int,
+) -> List[Dict[Text, Mapping[Text, Any]]]:
+    """Deals the tasks of each type in turn, so shards get as many of each."""
+    result = [{} for _ in range(shards)]
+    dealt = defaultdict(int)
+    for key in sorted(tasks):
+        task_type = tasks[key]["type"]
+        result[dealt[task_type] % shards][key] = tasks[key]
+        dealt[task_type] += 1
+    return result
+
+
+def hidden_tasks(
+    tasks: Mapping[Text, Mapping[Text, Any]],
+    claims: Mapping[Text, Mapping[Text, Any]],
+    comparisons: Mapping[Text, Mapping[Text, Text]],
+    shards: int,
+) -> Dict[Text, List[Text]]:
+    """Per player, the keys of the votes of their shard they should not get.
+
+    Like canSee in Workflow.jsx, a vote on a claim the player already
+    compared with another is hidden, unless it is that same comparison.
+    """
+    votes_of = defaultdict(list)
+    for key, task in tasks.items():
+        if task["type"] == "verify":
+            votes_of[task["claim_left"]].append(key)
+            votes_of[task["claim_right"]].append(key)
+    authored = defaultdict(set)
+    for key, claim in claims.items():
+        if claim.get("author"):
+            authored[claim["author"]].add(key)
+
+    result = {}
+    shard_of = {key: ii for ii, x in enumerate(split_tasks(tasks, shards))
+                for key in x}
+    for user in set(authored) | set(comparisons):
+        shard = user_shard(user, shards)
+        seen = comparisons.get(user, {})
+        hidden = set()
+        for claim in authored[user]:
+            hidden.update(votes_of[claim])
+        for claim in seen:
+            hidden.update(
+                x for x in votes_of[claim]
+                if seen.get(tasks[x]["claim_left"]) != tasks[x]["claim_right"])
+        hidden = sorted(x for x in hidden if shard_of[x] == shard)
+        if hidden:
+            result[user] = hidden
+    return result
+
+
+def encode(document: Any) -> bytes:
+    """Minified JSON, gzip-compressed."""
+    data = json.dumps(document, separators=(",", ":"), sort_keys=True)
+    return gzip.compress(data.encode("utf-8"), mtime=0)
+
+
+def upload(bucket: Any, name: Text, document: Any) -> int:
+    """Uploads a document gzip-encoded, returns the compressed size."""
+    data = encode(document)
+    blob = bucket.blob(name)
+    blob.content_encoding = "gzip"
+    blob.upload_from_string(data, content_type="application/json")
+    return len(data)
+
+
+def save_shards(
+    bucket: Any,
+    workflow_name: Text,
+    tasks: Mapping[Text, Mapping[Text, Any]],
+    claims: Mapping[Text, Mapping[Text, Any]],
+    comparisons: Optional[Mapping[Text, Mapping[Text, Text]]] = None,
+    requested_shards: int = 8,
+    workers: int = 8,
+) -> Dict[Text, Any]:
+    """Uploads the shards of a workflow and then its manifest.
+
+    Shards and hidden tasks are compressed and uploaded concurrently. The
+    manifest goes last, so players never read a manifest of objects that are
+    not there yet, and the hidden tasks of earlier uploads are deleted after
+    it.
+    """
+    shards = num_shards(len(tasks), requested_shards)
+    hidden = hidden_tasks(tasks, claims, comparisons or {}, shards)
+    salt = secrets.token_hex(16)
+    directory = f"workflow/{workflow_name}"
+    documents = {
+        f"{directory}/{ii}.json": {"tasks": x}
+        for ii, x in enumerate(split_tasks(tasks, shards))}
+    documents.update(
+        (f"{directory}/hidden/{hidden_name(salt, x)}.json", y)
+        for x, y in hidden.items())
+    with futures.ThreadPoolExecutor(workers) as executor:
+        sizes = list(executor.map(
+            lambda x: upload(bucket, x, documents[x]), documents))
+    manifest = {"hash": kHASH, "shards": shards, "tasks": len(tasks),
+                "salt": salt}
+    upload(bucket, f"{directory}/manifest.json", manifest)
+
+    stale = [x for x in bucket.list_blobs(prefix=f"{directory}/hidden/")
+             if x.name not in documents]
+    with futures.ThreadPoolExecutor(workers) as executor:
+        list(executor.map(lambda x: x.delete(), stale))
+    return {**manifest, "hidden": len(hidden), "bytes": sum(sizes)}
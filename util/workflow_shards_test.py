@@ -0,0 +1,99 @@
+# coding=utf-8
+# Copyright 2019 Google LLC.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# Lint as: python3
+
+import json
+
+import pytest
+
+import local_backends
+import workflow_shards
+
+# userHash and hiddenName of board/src/config/server.js, computed with node.
+kSERVER_JS = [
+    ("", 2166136261,
+     "fb8e20fc2e4c3f248c60c39bd652f3c1347298bb977b8b4d5903b85055620603"),
+    ("a", 3826002220,
+     "e124adcce1fb2f88e1ea799c3d0820845ed343e6c739e54131fcb3a56e4bc1bd"),
+    ("kXbq3T9mWcZ1pL0Rr7sYv2Ndf8J3", 3167491,
+     "8637fa1c3aa93560ff38c83b442592366540005a9fa9f3c90aa39e67d99049d9"),
+    ("üser", 282613423,
+     "c6fb108298b852a94f1df525ce1a5007e4dfd4f0c2ae9030e2fe4ff2d2c20c72"),
+    ("user😀", 3395561191,
+     "eb4386c5e17d7a872fa8895e42c4b3b6611cbdd9e124f464ddfe79f257c537c7"),
+]
+kUSERS = ["uid-alice", "uid-bob", "uid-carol"]
+
+
+@pytest.mark.parametrize("user, user_hash, hidden", kSERVER_JS)
+def test_same_shard_and_hidden_name_as_server_js(user, user_hash, hidden):
+    assert workflow_shards.user_shard(user, 2 ** 32) == user_hash
+    assert workflow_shards.user_shard(user, 8) == user_hash % 8
+    assert workflow_shards.hidden_name("ab", user) == hidden
+
+
+def workflow():
+    claims = {f"c{ii:02d}": {"author": kUSERS[ii % 2]} for ii in range(40)}
+    tasks = {
+        f"t{ii:03d}": {"type": "verify", "claim_left": f"c{ii % 40:02d}",
+                       "claim_right": f"c{(ii + ii // 40 + 1) % 40:02d}"}
+        for ii in range(400)}
+    comparisons = {"uid-carol": {"c01": "c02"}}
+    return tasks, claims, comparisons
+
+
+def test_hidden_tasks_of_a_players_shard():
+    tasks, claims, comparisons = workflow()
+    hidden = workflow_shards.hidden_tasks(tasks, claims, comparisons, 2)
+    shards = workflow_shards.split_tasks(tasks, 2)
+    for user in kUSERS:
+        shard = shards[workflow_shards.user_shard(user, 2)]
+        own = {x for x in claims if claims[x].get("author") == user}
+        seen = comparisons.get(user, {})
+        expected = sorted(
+            key for key, task in shard.items()
+            if {task["claim_left"], task["claim_right"]} & own or (
+                {task["claim_left"], task["claim_right"]} & set(seen) and
+                seen.get(task["claim_left"]) != task["claim_right"]))
+        assert hidden.get(user, []) == expected
+    # The comparison carol already made is not hidden.
+    assert "t001" in shards[workflow_shards.user_shard("uid-carol", 2)]
+    assert "t001" not in hidden["uid-carol"]
+
+
+def test_uploads_reveal_no_user_ids(tmp_path):
+    tasks, claims, comparisons = workflow()
+    bucket = local_backends.LocalBucket(str(tmp_path))
+    result = workflow_shards.save_shards(
+        bucket, "test", tasks, claims, comparisons, requested_shards=2)
+    assert result["shards"] == 2
+    hidden = workflow_shards.hidden_tasks(tasks, claims, comparisons, 2)
+    assert result["hidden"] == len(hidden) == 3
+
+    blobs = {x.name: x.download_as_bytes().decode("utf-8")
+             for x in bucket.list_blobs(prefix="workflow/test/")}
+    for user in kUSERS:
+        assert not any(user in x or user in y for x, y in blobs.items())
+    manifest = json.loads(blobs["workflow/test/manifest.json"])
+    for user, keys in hidden.items():
+        name = workflow_shards.hidden_name(manifest["salt"], user)
+        assert json.loads(blobs[f"workflow/test/hidden/{name}.json"]) == keys
+
+    # A new upload has a new salt, and the old hidden objects are deleted.
+    workflow_shards.save_shards(
+        bucket, "test", tasks, claims, comparisons, requested_shards=2)
+    names = [x.name for x in bucket.list_blobs(prefix="workflow/test/hidden/")]
+    assert len(names) == 3
+    assert not set(names) & set(blobs)
@@ -0,0 +1,343 @@
+# coding=utf-8
+# Copyright 2019 Google LLC.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# Lint as: python3
+
+# SQLite store for the data create_workflow reads from Firestore. It keeps
+# the claims, votes and likes synced so far, the users and the comparisons
+# they saw, indexed so analyses can query it instead of loading everything.
+
+import datetime
+import json
+import sqlite3
+
+from typing import (
+    Text, Mapping, Dict, Iterable, Iterator, Tuple, Any, Optional)
+
+kSCHEMA = """
+CREATE TABLE IF NOT EXISTS claims (
+    id TEXT PRIMARY KEY,
+    page TEXT,
+    author TEXT,
+    veracity TEXT,
+    created TEXT,
+    document TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS claims_page ON claims (page);
+CREATE INDEX IF NOT EXISTS claims_author ON claims (author);
+
+CREATE TABLE IF NOT EXISTS votes (
+    claim TEXT NOT NULL,
+    voter TEXT NOT NULL,
+    created TEXT,
+    points INTEGER,
+    document TEXT NOT NULL,
+    PRIMARY KEY (claim, voter)
+);
+CREATE INDEX IF NOT EXISTS votes_voter ON votes (voter);
+
+CREATE TABLE IF NOT EXISTS likes (
+    claim TEXT NOT NULL,
+    user TEXT NOT NULL,
+    created TEXT,
+    PRIMARY KEY (claim, user)
+);
+CREATE INDEX IF NOT EXISTS likes_user ON likes (user);
+
+CREATE TABLE IF NOT EXISTS users (
+    id TEXT PRIMARY KEY,
+    display_name TEXT
+);
+
+CREATE TABLE IF NOT EXISTS comparisons (
+    user TEXT NOT NULL,
+    claim TEXT NOT NULL,
+    other TEXT NOT NULL,
+    PRIMARY KEY (user, claim)
+);
+
+CREATE TABLE IF NOT EXISTS pages (
+    page TEXT PRIMARY KEY,
+    category TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS pages_category ON pages (category);
+
+CREATE TABLE IF NOT EXISTS stats (
+    zone TEXT NOT NULL,
+    granularity TEXT NOT NULL,
+    dimension TEXT NOT NULL,
+    bucket TEXT NOT NULL,
+    key TEXT NOT NULL,
+    vote_correct INTEGER,
+    vote_incorrect INTEGER,
+    write INTEGER,
+    PRIMARY KEY (zone, granularity, dimension, bucket, key)
+);
+
+CREATE TABLE IF NOT EXISTS synced (
+    name TEXT PRIMARY KEY,
+    created TEXT NOT NULL
+);
+"""
+kDATETIME = "__datetime__"
+# Columns of the keys of the tables synced from Firestore.
+kKEYS = {
+    "claims": ("id",),
+    "votes": ("claim", "voter"),
+    "likes": ("claim", "user"),
+}
+
+
+def to_text(time: Optional[datetime.datetime]) -> Optional[Text]:
+    """UTC time in a format SQLite date functions understand."""
+    if time is None:
+        return None
+    time = time.astimezone(datetime.timezone.utc)
+    return time.strftime("%Y-%m-%d %H:%M:%S.%f")
+
+
+def from_text(text: Optional[Text]) -> Optional[datetime.datetime]:
+    if text is None:
+        return None
+    time = datetime.datetime.strptime(text, "%Y-%m-%d %H:%M:%S.%f")
+    return time.replace(tzinfo=datetime.timezone.utc)
+
+
+def _default(value):
+    if isinstance(value, datetime.datetime):
+        return {kDATETIME: to_text(value)}
+    if isinstance(value, set):
+        return sorted(value)
+    return str(value)
+
+
+def _object_hook(value):
+    if kDATETIME in value:
+        return from_text(value[kDATETIME])
+    return value
+
+
+def encode(document: Mapping[Text, Any]) -> Text:
+    return json.dumps(document, default=_default, sort_keys=True)
+
+
+def decode(text: Text) -> Dict[Text, Any]:
+    return json.loads(text, object_hook=_object_hook)
+
+
+class WorkflowStore(object):
+    """Claims, votes, likes, users and comparisons in a SQLite database."""
+
+    def __init__(self, filename: Text = ":memory:"):
+        self.db = sqlite3.connect(filename)
+        self.db.executescript(kSCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    def clear(self):
+        with self.db:
+            for table in [
+                    "claims", "votes", "likes", "users", "comparisons",
+                    "stats", "synced"]:
+                self.db.execute(f"DELETE FROM {table}")
+
+    def empty(self) -> bool:
+        return self.count("claims") == 0
+
+    def count(self, table: Text) -> int:
+        return self.db.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+
+    def put_claims(self, claims: Iterable[Tuple[Text, Mapping[Text, Any]]]):
+        with self.db:
+            self.db.executemany(
+                "INSERT OR REPLACE INTO claims VALUES (?, ?, ?, ?, ?, ?)",
+                ((key, x.get("page"), x.get("author"), x.get("veracity"),
+                  to_text(x.get("created")), encode(x)) for key, x in claims))
+
+    def put_votes(
+        self,
+        votes: Iterable[Tuple[Text, Text, Mapping[Text, Any]]],
+    ):
+        with self.db:
+            self.db.executemany(
+                "INSERT OR REPLACE INTO votes VALUES (?, ?, ?, ?, ?)",
+                ((claim, voter, to_text(x.get("created")), x.get("points"),
+                  encode(x)) for claim, voter, x in votes))
+
+    def put_likes(
+        self,
+        likes: Iterable[Tuple[Text, Text, Mapping[Text, Any]]],
+    ):
+        with self.db:
+            self.db.executemany(
+                "INSERT OR REPLACE INTO likes VALUES (?, ?, ?)",
+                ((claim, user, to_text(x.get("created")))
+                 for claim, user, x in likes))
+
+    def delete_missing(
+        self,
+        table: Text,
+        keys: Iterable[Tuple[Text, ...]],
+    ) -> int:
+        """Deletes the claims, votes or likes whose key is not given.
+
+        Returns the number of rows deleted.
+        """
+        columns = ", ".join(kKEYS[table])
+        marks = ", ".join("?" for _ in kKEYS[table])
+        with self.db:
+            self.db.execute(
+                f"CREATE TEMP TABLE present ({columns}, "
+                f"PRIMARY KEY ({columns}))")
+            try:
+                self.db.executemany(
+                    f"INSERT OR IGNORE INTO present VALUES ({marks})", keys)
+                return self.db.execute(
+                    f"DELETE FROM {table} WHERE ({columns}) NOT IN "
+                    f"(SELECT {columns} FROM present)").rowcount
+            finally:
+                self.db.execute("DROP TABLE present")
+
+    def put_users(self, users: Mapping[Text, Text]):
+        with self.db:
+            self.db.execute("DELETE FROM users")
+            self.db.executemany(
+                "INSERT INTO users VALUES (?, ?)", users.items())
+
+    def put_comparisons(
+        self,
+        comparisons: Mapping[Text, Mapping[Text, Text]],
+    ):
+        with self.db:
+            self.db.execute("DELETE FROM comparisons")
+            self.db.executemany(
+                "INSERT INTO comparisons VALUES (?, ?, ?)",
+                ((user, claim, other)
+                 for user in comparisons
+                 for claim, other in comparisons[user].items()))
+
+    def put_pages(self, categories: Mapping[Text, Text]):
+        """Replaces the category of every page."""
+        with self.db:
+            self.db.execute("DELETE FROM pages")
+            self.db.executemany(
+                "INSERT INTO pages VALUES (?, ?)", categories.items())
+
+    def synced(self, name: Text) -> Optional[datetime.datetime]:
+        row = self.db.execute(
+            "SELECT created FROM synced WHERE name = ?", (name,)).fetchone()
+        return from_text(row[0]) if row else None
+
+    def set_synced(self, name: Text, created: datetime.datetime):
+        with self.db:
+            self.db.execute(
+                "INSERT OR REPLACE INTO synced VALUES (?, ?)",
+                (name, to_text(created)))
+
+    def claims(
+        self,
+    ) -> Iterator[Tuple[Text, Dict[Text, Any], Optional[Text]]]:
+        """Claims with the category of their page, if it has one."""
+        for key, document, category in self.db.execute(
+                "SELECT claims.id, claims.document, pages.category "
+                "FROM claims LEFT JOIN pages ON pages.page = claims.page "
+                "ORDER BY claims.id"):
+            yield key, decode(document), category
+
+    def votes(self) -> Iterator[Tuple[Text, Text, Dict[Text, Any]]]:
+        """Votes of known claims, sorted like the documents in Firestore."""
+        for claim, voter, document in self.db.execute(
+                "SELECT votes.claim, votes.voter, votes.document FROM votes "
+                "JOIN claims ON claims.id = votes.claim "
+                "ORDER BY votes.claim, votes.voter"):
+            yield claim, voter, decode(document)
+
+    def likes(self) -> Iterator[Tuple[Text, Text]]:
+        return self.db.execute(
+            "SELECT likes.claim, likes.user FROM likes "
+            "JOIN claims ON claims.id = likes.claim "
+            "ORDER BY likes.claim, likes.user")
+
+    def users(self) -> Dict[Text, Text]:
+        return dict(self.db.execute("SELECT id, display_name FROM users"))
+
+    def comparisons(self) -> Dict[Text, Dict[Text, Text]]:
+        result = {}
+        for user, claim, other in self.db.execute(
+                "SELECT user, claim, other FROM comparisons"):
+            result.setdefault(user, {})[claim] = other
+        return result
+
+    def activity(
+        self,
+        since: Optional[datetime.datetime] = None,
+    ) -> Iterator[Tuple[int, Optional[Text], int, int, Text, Optional[Text]]]:
+        """Votes and writes of known claims, created after `since` if given.
+
+        Rows are the UTC time in seconds, the display name of the player,
+        whether it is a write, whether a vote got points (-1 if unknown),
+        and the page and category of the claim.
+        """
+        since = to_text(since) if since else ""
+        return self.db.execute("""
+            SELECT CAST(strftime('%s', votes.created) AS INTEGER),
+                users.display_name, 0, COALESCE(votes.points > 0, -1),
+                claims.page, pages.category
+            FROM votes JOIN claims ON claims.id = votes.claim
+            LEFT JOIN users ON users.id = votes.voter
+            LEFT JOIN pages ON pages.page = claims.page
+            WHERE votes.created IS NOT NULL AND votes.created >= :since
+            UNION ALL
+            SELECT CAST(strftime('%s', claims.created) AS INTEGER),
+                users.display_name, 1, 0, claims.page, pages.category
+            FROM claims LEFT JOIN users ON users.id = claims.author
+            LEFT JOIN pages ON pages.page = claims.page
+            WHERE claims.created IS NOT NULL AND claims.created >= :since
+        """, {"since": since})
+
+    def has_stats(self, zone: Text, granularity: Text, dimension: Text) -> bool:
+        return self.db.execute(
+            "SELECT 1 FROM stats WHERE zone = ? AND granularity = ? AND "
+            "dimension = ? LIMIT 1", (zone, granularity, dimension)
+        ).fetchone() is not None
+
+    def put_stats(
+        self,
+        zone: Text,
+        granularity: Text,
+        dimension: Text,
+        rows: Iterable[Tuple[Text, Text, int, int, int]],
+        since: Optional[Text] = None,
+    ):
+        """Replaces the statistics of the buckets from `since` on, or all."""
+        with self.db:
+            self.db.execute(
+                "DELETE FROM stats WHERE zone = ? AND granularity = ? AND "
+                "dimension = ? AND bucket >= ?",
+                (zone, granularity, dimension, since or ""))
+            self.db.executemany(
+                "INSERT INTO stats VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                ((zone, granularity, dimension) + tuple(x) for x in rows))
+
+    def stats(
+        self,
+        zone: Text,
+        granularity: Text,
+        dimension: Text,
+    ) -> Iterator[Tuple[Text, Text, int, int, int]]:
+        return self.db.execute(
+            "SELECT bucket, key, vote_correct, vote_incorrect, write "
+            "FROM stats WHERE zone = ? AND granularity = ? AND dimension = ? "
+            "ORDER BY bucket, key", (zone, granularity, dimension))
@@ -0,0 +1,42 @@
+# coding=utf-8
+# Copyright 2019 Google LLC.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# Lint as: python3
+
+import local_backends
+import workflow_store
+
+
+def test_delete_missing_keeps_only_given_keys():
+    store = workflow_store.WorkflowStore()
+    store.put_claims([("a", {"page": "P"}), ("b", {"page": "P"})])
+    store.put_votes([("a", "u", {}), ("a", "v", {}), ("b", "u", {})])
+    store.put_likes([("a", "u", {}), ("b", "u", {})])
+
+    assert store.delete_missing("claims", [("a",), ("c",)]) == 1
+    assert store.delete_missing("votes", [("a", "u"), ("b", "u")]) == 1
+    assert store.delete_missing("likes", []) == 2
+    assert [x for x, _, _ in store.claims()] == ["a"]
+    assert [(x, y) for x, y, _ in store.votes()] == [("a", "u")]
+    assert store.count("likes") == 0
+
+
+def test_select_reads_keys_without_fields():
+    db = local_backends.FirestoreClient()
+    db.collection("fibs").document("a").set({"page": "P", "created": 1})
+    snapshots = list(db.collection("fibs").select([]).stream())
+    assert [(x.id, x.to_dict()) for x in snapshots] == [("a", {})]
+    snapshots = db.collection("fibs").where("created", ">", 0).select(
+        ["page"]).stream()
+    assert [x.to_dict() for x in snapshots] == [{"page": "P"}]